@@ -0,0 +1,123 @@
+import re
+import numpy
+
+from backtest.HistoryStore import HistoryStore
+
+
+# How each field of a finer bar folds into a coarser one. Anything not listed (price, close, ...) takes the last value
+AGGREGATIONS = {"open": "first", "high": "max", "low": "min", "volume": "sum"}
+
+MINUTES_PER_SESSION = 390
+
+
+def parseFrequency(frequency):
+    """ Turn a bar frequency like '1d', '1m' or '5m' into a numpy timedelta64 """
+    match = re.match(r"^(\d+)([dm])$", frequency)
+    if match is None:
+        raise ValueError("Unsupported bar frequency %s, expected e.g. '1d', '1m' or '5m'" % frequency)
+    (count, unit) = (int(match.group(1)), match.group(2))
+    if unit == "d" and count != 1:
+        raise ValueError("Only single day bars are supported, got frequency %s" % frequency)
+    return numpy.timedelta64(count, "D" if unit == "d" else "m")
+
+
+def inferFrequency(dates):
+    """ The frequency of a sorted array of bar timestamps: '1d' for daily bars, otherwise the smallest gap in minutes """
+    gaps = numpy.diff(numpy.asarray(dates, dtype='datetime64[ns]'))
+    gaps = gaps[gaps > numpy.timedelta64(0, "ns")]
+    if len(gaps) == 0 or gaps.min() >= numpy.timedelta64(1, "D"):
+        return "1d"
+    return "%dm" % max(1, int(gaps.min() / numpy.timedelta64(1, "m")))
+
+
+def bucketIds(dates, frequency):
+    """ Label every timestamp with the bar of the given frequency it falls in: the session date for '1d', otherwise
+    the number of whole frequency intervals since midnight of that date """
+    dates = numpy.asarray(dates, dtype='datetime64[ns]')
+    step = parseFrequency(frequency)
+    days = dates.astype('datetime64[D]')
+    if step == numpy.timedelta64(1, "D"):
+        return days.astype(numpy.int64)
+    intraday = (dates - days) // step.astype('timedelta64[ns]')
+    return days.astype(numpy.int64) * (numpy.timedelta64(1, "D") // step) + intraday
+
+
+def periodsPerYear(frequency):
+    """ Bars per trading year at a frequency, to annualise statistics """
+    step = parseFrequency(frequency)
+    if step == numpy.timedelta64(1, "D"):
+        return 252
+    return 252 * MINUTES_PER_SESSION / (step / numpy.timedelta64(1, "m"))
+
+
+class BarAggregator(object):
+    """ Streams finer bars (e.g. minutes) into coarser ones (e.g. days). Finished bars are kept in a HistoryStore,
+    whose latest row is the bar still being built, updated in place as each finer bar arrives. history() at the
+    coarser frequency is then a view of the store, including the partial current bar like Quantopian. """
+
+    def __init__(self, frequency, n_columns, fields, capacity=1260):
+        self.frequency = frequency
+        self.fields = list(fields)
+        self.store = HistoryStore(n_columns, self.fields, capacity)
+        self.bucket = None
+
+    def append(self, bar, date, bucket):
+        """ Fold one finer bar into the current coarser bar, starting a new one when bucket changes.
+        bar - mapping of field to a vector with one value per column """
+        if bucket != self.bucket:
+            self.bucket = bucket
+            self.store.append(bar, date)
+            return
+
+        current = {}
+        for field in self.fields:
+            previous = self.store.window(1, field)[0]
+            rule = AGGREGATIONS.get(field, "last")
+            if rule == "first":
+                current[field] = numpy.where(numpy.isnan(previous), bar[field], previous)
+            elif rule == "max":
+                current[field] = numpy.fmax(previous, bar[field])
+            elif rule == "min":
+                current[field] = numpy.fmin(previous, bar[field])
+            elif rule == "sum":
+                current[field] = numpy.nan_to_num(previous) + numpy.nan_to_num(bar[field])
+            else:
+                current[field] = numpy.where(numpy.isnan(bar[field]), previous, bar[field])
+        self.store.replace(current, date)
+
+    def extend(self, bars, dates, buckets):
+        """ Aggregate a block of finer bars at once, oldest first, e.g. to backfill before streaming starts.
+        bars - mapping of field to a (bars x columns) matrix, buckets - the bucket of every bar """
+        if len(dates) == 0:
+            return
+        buckets = numpy.asarray(buckets)
+        starts = numpy.concatenate([[0], numpy.flatnonzero(numpy.diff(buckets)) + 1])
+        ends = numpy.concatenate([starts[1:], [len(buckets)]])
+
+        # Only the bars that still fit in the store are worth building
+        starts = starts[-self.store.capacity:]
+        ends = ends[-self.store.capacity:]
+
+        aggregated = {}
+        for field in self.fields:
+            values = bars[field]
+            rule = AGGREGATIONS.get(field, "last")
+            if rule == "first":
+                aggregated[field] = values[starts]
+            elif rule == "max":
+                aggregated[field] = numpy.fmax.reduceat(values, starts, axis=0)
+            elif rule == "min":
+                aggregated[field] = numpy.fmin.reduceat(values, starts, axis=0)
+            elif rule == "sum":
+                aggregated[field] = numpy.add.reduceat(numpy.nan_to_num(values), starts, axis=0)
+            else:
+                aggregated[field] = values[ends - 1]
+
+        self.store.extend(aggregated, dates[ends - 1])
+        self.bucket = buckets[-1]
+
+    def window(self, bar_count, field="price", columns=None):
+        return self.store.window(bar_count, field, columns)
+
+    def windowDates(self, bar_count):
+        return self.store.windowDates(bar_count)
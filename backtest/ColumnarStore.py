@@ -0,0 +1,116 @@
+import os
+import sys
+import json
+import argparse
+import numpy
+import pandas
+
+from backtest.PriceData import PriceData, priceFiles, readPriceFile, readSymbols
+
+
+# Bumped whenever the on disk layout changes
+FORMAT_VERSION = 1
+
+
+def ingest(source, destination, dtype="float64"):
+    """ Convert a directory of <sid>.csv / <sid>.parquet price files (see PriceData.load) into a columnar store:
+    dates.npy, one (n_dates x n_sids) <field>.npy array per field, and meta.json with the sids, symbols and fields.
+    Files are read one at a time and written straight into the memory-mapped arrays, so the universe never has
+    to fit in memory. Like PriceData.fromFrames, dates missing for a sid are forward filled. """
+    files = priceFiles(source)
+    if not files:
+        raise ValueError("No <sid>.csv or <sid>.parquet price files found in %s" % source)
+
+    # First pass for the shape: the union of every file's dates, and every field
+    (dates, names) = (numpy.zeros(0, dtype='datetime64[ns]'), set())
+    for (sid, fullpath) in files:
+        frame = readPriceFile(fullpath)
+        dates = numpy.union1d(dates, frame.index.values.astype('datetime64[ns]'))
+        names.update(frame.columns)
+    (sids, names) = ([sid for (sid, fullpath) in files], sorted(names))
+
+    if not os.path.exists(destination):
+        os.makedirs(destination)
+    # A store only counts as one once meta.json is written, so drop any old one before overwriting the arrays
+    if os.path.exists(os.path.join(destination, "meta.json")):
+        os.remove(os.path.join(destination, "meta.json"))
+    numpy.save(os.path.join(destination, "dates.npy"), dates)
+
+    # Second pass fills one column of every field per file
+    arrays = {}
+    for name in names:
+        arrays[name] = numpy.lib.format.open_memmap(os.path.join(destination, "%s.npy" % name), mode="w+",
+                                                    dtype=dtype, shape=(len(dates), len(sids)))
+        arrays[name][:] = numpy.nan
+    index = pandas.DatetimeIndex(dates)
+    for (i, (sid, fullpath)) in enumerate(files):
+        frame = readPriceFile(fullpath).reindex(index).ffill()
+        for name in frame.columns:
+            arrays[name][:, i] = frame[name].values
+    for array in arrays.values():
+        array.flush()
+
+    meta = {"version": FORMAT_VERSION,
+            "sids": sids,
+            "symbols": dict((str(sid), symbol) for (sid, symbol) in readSymbols(source).items()),
+            "fields": names,
+            "dtype": numpy.dtype(dtype).name,
+            "shape": [len(dates), len(sids)]}
+    with open(os.path.join(destination, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def openStore(path):
+    """ A PriceData whose field arrays are read-only memory maps of a columnar store. Nothing is read until it is
+    touched, and a bar (row) or a window of bars is a zero-copy slice of the file. """
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    if meta["version"] != FORMAT_VERSION:
+        raise ValueError("%s is a version %d columnar store, expected version %d, ingest it again" % (path, meta["version"], FORMAT_VERSION))
+
+    dates = numpy.load(os.path.join(path, "dates.npy"))
+    fields = dict((name, numpy.load(os.path.join(path, "%s.npy" % name), mmap_mode="r")) for name in meta["fields"])
+    symbols = dict((int(sid), symbol) for (sid, symbol) in meta["symbols"].items())
+    prices = PriceData(dates, meta["sids"], fields, symbols)
+    prices.mapped = True
+    return prices
+
+
+class MappedHistory(object):
+    """ Stand in for a HistoryStore over memory-mapped PriceData: the data already holds every bar contiguously,
+    so a window is a zero-copy slice of the mapped arrays ending at the current bar, and appending a bar only moves
+    that end along instead of copying the bar into a ring buffer. """
+
+    def __init__(self, prices, end=0):
+        self.prices = prices
+        self.capacity = len(prices)
+        self.end = end
+
+    def __len__(self):
+        return self.end
+
+    def append(self, bar, date=None):
+        self.end += 1
+
+    def window(self, bar_count, field="price", columns=None):
+        view = self.prices.fields[field][max(0, self.end - bar_count):self.end]
+        return view if columns is None else view[:, columns]
+
+    def windowDates(self, bar_count):
+        return self.prices.dates[max(0, self.end - bar_count):self.end]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a directory of <sid>.csv / <sid>.parquet price files into a memory-mapped columnar store")
+    parser.add_argument("source", help="directory of price files, as for backtest.Harness --data")
+    parser.add_argument("destination", help="directory to write the store to, then pass it as --data")
+    parser.add_argument("--dtype", default="float64", choices=["float64", "float32"], help="float32 halves the store's size")
+    args = parser.parse_args(argv)
+
+    meta = ingest(args.source, args.destination, args.dtype)
+    print("%d dates x %d sids, fields %s, written to %s" % (meta["shape"][0], meta["shape"][1], ", ".join(meta["fields"]), args.destination))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
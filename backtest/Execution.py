@@ -0,0 +1,161 @@
+import random
+import asyncio
+import threading
+from collections import deque
+
+
+def splitShares(amount, pieces):
+    """ Split a signed share amount into up to pieces nonzero parts that add up to it """
+    (size, rest) = divmod(abs(amount), pieces)
+    sign = 1 if amount > 0 else -1
+    return [sign * (size + (1 if i < rest else 0)) for i in range(pieces) if size or i < rest]
+
+
+class FakeBroker(object):
+    """ In-process stand in for a broker, to run and benchmark the execution layer offline. Opening a connection and
+    every order cost a simulated network round-trip of latency seconds (plus up to jitter more), and each fill comes
+    back another round-trip later. With probability partialFills an order is only partly filled, the rest is left
+    for the caller to send again. Fills are in up to maxChunks pieces, at priceOf(sid) when they happen. """
+
+    def __init__(self, priceOf, latency=0.002, jitter=0.0, partialFills=0.0, maxChunks=3, seed=0):
+        self.priceOf = priceOf
+        self.latency = latency
+        self.jitter = jitter
+        self.partialFills = partialFills
+        self.maxChunks = maxChunks
+        # Fill decisions are drawn per order from the seed, the order id and how often it was sent before, so they
+        # don't depend on the order the orders happen to reach the broker in. Jitter only moves timings.
+        self.seed = seed
+        self.attempts = {}         # orderId -> times sent, for orders not filled or cancelled yet
+        self.jitterRandom = random.Random(seed)
+        self.connections = 0
+
+    def roundTrip(self):
+        return asyncio.sleep(self.latency + self.jitter * self.jitterRandom.random())
+
+    async def connect(self):
+        await self.roundTrip()
+        self.connections += 1
+        return FakeConnection(self)
+
+    def forget(self, orderId):
+        """ Stop counting an order's attempts once it won't be sent again, i.e. it was filled or cancelled """
+        self.attempts.pop(orderId, None)
+
+
+class FakeConnection(object):
+    """ One connection to a FakeBroker """
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    async def submit(self, orderId, sid, amount, onFill):
+        """ Send an order and wait for the broker to acknowledge it. Fills are reported later through
+        onFill(orderId, amount, price). Returns the shares that will be filled, and the task delivering the fills. """
+        broker = self.broker
+        broker.attempts[orderId] = broker.attempts.get(orderId, 0) + 1
+        draws = random.Random("%d:%s:%d" % (broker.seed, orderId, broker.attempts[orderId]))
+        filled = amount
+        if draws.random() < broker.partialFills:
+            filled = int(amount * draws.random())
+        chunks = splitShares(filled, draws.randint(1, broker.maxChunks)) if filled else []
+        if filled == amount:
+            broker.forget(orderId)
+
+        await broker.roundTrip()
+        return (filled, asyncio.ensure_future(self.deliver(orderId, sid, chunks, onFill)))
+
+    async def deliver(self, orderId, sid, chunks, onFill):
+        for chunk in chunks:
+            await self.broker.roundTrip()
+            onFill(orderId, chunk, self.broker.priceOf(sid))
+
+
+class ConnectionPool(object):
+    """ Up to size broker connections, opened on first use and then reused, so orders don't pay for a connect each
+    and no more than size of them are in flight at once. Only used from the event loop's thread. """
+
+    def __init__(self, broker, size):
+        self.broker = broker
+        self.size = size
+        self.opened = 0
+        self.idle = None
+
+    async def acquire(self):
+        if self.idle is None:
+            self.idle = asyncio.Queue()
+        if self.idle.empty() and self.opened < self.size:
+            self.opened += 1
+            return await self.broker.connect()
+        return await self.idle.get()
+
+    def release(self, connection):
+        self.idle.put_nowait(connection)
+
+
+class AsyncExecution(object):
+    """ Sends orders to a broker from an asyncio event loop on a background thread. send() fans a whole batch of
+    orders out at once over a ConnectionPool and returns when every one is acknowledged, so a bar's orders cost one
+    round-trip instead of one each. Fills come back through callbacks into a thread-safe queue that the caller
+    drains, plus onFill(orderId, amount, price) if given (called on the loop's thread). """
+
+    def __init__(self, broker, poolSize=8, onFill=None):
+        self.broker = broker
+        self.pool = ConnectionPool(broker, poolSize)
+        self.onFill = onFill
+        self.fills = deque()       # (orderId, amount, price) not drained yet
+        self.deliveries = []       # tasks still delivering fills, only touched on the loop's thread
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="AsyncExecution")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def send(self, orders):
+        """ Submit (orderId, sid, amount) orders concurrently. Returns a mapping of orderId to the shares the broker
+        will fill, once all of them are acknowledged. """
+        if not orders:
+            return {}
+        return asyncio.run_coroutine_threadsafe(self.sendAll(orders), self.loop).result()
+
+    async def sendAll(self, orders):
+        filled = await asyncio.gather(*[self.sendOne(*currOrder) for currOrder in orders])
+        return dict(zip([currOrder[0] for currOrder in orders], filled))
+
+    async def sendOne(self, orderId, sid, amount):
+        connection = await self.pool.acquire()
+        try:
+            (filled, delivery) = await connection.submit(orderId, sid, amount, self.fillReceived)
+        finally:
+            self.pool.release(connection)
+        self.deliveries.append(delivery)
+        return filled
+
+    def fillReceived(self, orderId, amount, price):
+        self.fills.append((orderId, amount, price))
+        if self.onFill is not None:
+            self.onFill(orderId, amount, price)
+
+    def wait(self):
+        """ Block until every fill of the orders sent so far has come back """
+        asyncio.run_coroutine_threadsafe(self.settle(), self.loop).result()
+
+    async def settle(self):
+        (deliveries, self.deliveries) = (self.deliveries, [])
+        await asyncio.gather(*deliveries)
+
+    def drain(self):
+        """ The fills received since the last drain, oldest first """
+        fills = []
+        while self.fills:
+            fills.append(self.fills.popleft())
+        return fills
+
+    def cancel(self, orderId):
+        """ Tell the broker an order partly filled earlier won't be sent again """
+        self.broker.forget(orderId)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
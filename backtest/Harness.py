@@ -0,0 +1,642 @@
+import sys
+import time
+import logging
+import argparse
+from array import array
+import numpy
+import pandas
+
+from backtest.PriceData import PriceData
+from backtest.ModelCache import ModelCache
+from backtest.HistoryStore import HistoryStore
+from backtest.ColumnarStore import MappedHistory
+from backtest.Profiler import Profiler
+from backtest.Execution import AsyncExecution, FakeBroker
+from backtest.Output import RecordWriter, startLogSink
+from backtest.BarAggregator import BarAggregator, parseFrequency, inferFrequency, bucketIds, periodsPerYear
+
+
+class Security(object):
+    """ Stand in for a Quantopian security, as returned by sid(). Hashes and compares by sid. """
+    __slots__ = ("sid", "symbol")
+
+    def __init__(self, sid, symbol=None):
+        self.sid = sid
+        self.symbol = symbol
+
+    def __hash__(self):
+        return hash(self.sid)
+
+    def __eq__(self, other):
+        return isinstance(other, Security) and other.sid == self.sid
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __lt__(self, other):
+        return self.sid < other.sid
+
+    def __repr__(self):
+        return "Security(%d [%s])" % (self.sid, self.symbol) if self.symbol else "Security(%d)" % self.sid
+
+
+class Order(object):
+    """ An order as returned by get_order() """
+    __slots__ = ("id", "sid", "amount", "filled", "limit", "stop", "created", "dt", "status", "commission")
+
+    OPEN = 0
+    FILLED = 1
+    CANCELLED = 2
+
+    def __init__(self, id, sid, amount, created, limit=None, stop=None):
+        self.id = id
+        self.sid = sid
+        self.amount = amount
+        self.filled = 0
+        self.limit = limit
+        self.stop = stop
+        self.created = created
+        self.dt = created
+        self.status = Order.OPEN
+        self.commission = 0.0
+
+    def __repr__(self):
+        return "Order(id=%s, sid=%s, amount=%d, filled=%d, limit=%s, stop=%s, status=%d)" % \
+            (self.id, self.sid, self.amount, self.filled, self.limit, self.stop, self.status)
+
+
+class Position(object):
+    """ Holding in a single security """
+    __slots__ = ("sid", "amount", "cost_basis", "last_sale_price")
+
+    def __init__(self, sid):
+        self.sid = sid
+        self.amount = 0
+        self.cost_basis = 0.0
+        self.last_sale_price = 0.0
+
+    def __repr__(self):
+        return "Position(sid=%s, amount=%d, cost_basis=%f)" % (self.sid, self.amount, self.cost_basis)
+
+
+class Positions(dict):
+    """ Mapping of security to Position, with an empty position for anything not held """
+
+    def __missing__(self, security):
+        return Position(security)
+
+
+class Portfolio(object):
+    """ Cash plus positions. Share counts are mirrored in a numpy vector, one entry per price column, so the
+    portfolio can be marked to market with one dot product per bar. """
+
+    def __init__(self, capital_base, n_sids):
+        self.starting_cash = capital_base
+        self.capital_base = capital_base
+        self.cash = capital_base
+        self.positions = Positions()
+        self.shares = numpy.zeros(n_sids)
+        self.positions_value = 0.0
+        self.portfolio_value = capital_base
+        self.pnl = 0.0
+        self.returns = 0.0
+
+    def markToMarket(self, prices):
+        """ Revalue every position at a vector of current prices """
+        self.positions_value = float(numpy.dot(self.shares, numpy.nan_to_num(prices)))
+        self.portfolio_value = self.cash + self.positions_value
+        self.pnl = self.portfolio_value - self.starting_cash
+        self.returns = self.pnl / self.starting_cash
+
+
+class Context(object):
+    """ The context object handed to initialize() and handle_data() """
+    pass
+
+
+class SIDData(object):
+    """ data[stock] for a single bar: exposes .price, .datetime and any other loaded field as attributes """
+    __slots__ = ("bars", "column")
+
+    def __init__(self, bars, column):
+        self.bars = bars
+        self.column = column
+
+    @property
+    def datetime(self):
+        return self.bars.backtest.datetimes[self.bars.backtest.index]
+
+    def __getattr__(self, name):
+        if name not in self.bars.backtest.prices.fields:
+            raise AttributeError(name)
+        return self.bars.backtest.currentBar(name)[self.column]
+
+
+class BarData(object):
+    """ The data object handed to handle_data(). Bars are read straight out of the columnar arrays on access,
+    nothing is built per bar. """
+
+    def __init__(self, backtest):
+        self.backtest = backtest
+
+    def __getitem__(self, security):
+        return SIDData(self, self.backtest.prices.column[security.sid])
+
+    def __contains__(self, security):
+        return security.sid in self.backtest.prices.column
+
+
+class LogMessage(object):
+    """ A message with {} placeholders and its arguments, put together with str.format only when a handler turns it
+    into text """
+    __slots__ = ("msg", "args")
+
+    def __init__(self, msg, args):
+        self.msg = msg
+        self.args = args
+
+    def __str__(self):
+        return self.msg.format(*self.args)
+
+
+class AlgorithmLog(object):
+    """ Quantopian style log object that stamps messages with the simulation time. Quantopian's log is logbook,
+    which formats messages with str.format, so arguments go in {} placeholders here too. """
+
+    def __init__(self, backtest, logger):
+        self.backtest = backtest
+        self.logger = logger
+
+    def _log(self, level, msg, args):
+        # Formatting is left to the handler, which may do it on another thread (see Output.startLogSink)
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, "%s %s", self.backtest.currentDatetime(), LogMessage(msg, args) if args else msg)
+
+    def debug(self, msg, *args):
+        self._log(logging.DEBUG, msg, args)
+
+    def info(self, msg, *args):
+        self._log(logging.INFO, msg, args)
+
+    def warn(self, msg, *args):
+        self._log(logging.WARNING, msg, args)
+
+    warning = warn
+
+    def error(self, msg, *args):
+        self._log(logging.ERROR, msg, args)
+
+
+class Backtest(object):
+    """ Event driven backtester that runs a Quantopian style initialize() / handle_data() algorithm over local
+    daily or intraday bars. Orders placed on a bar are filled at the next bar's price, like Quantopian does. """
+
+    def __init__(self, prices, capital_base=100000, commission=0.0, slippage=0.0, logger=None, modelCache=None, historyCapacity=1260,
+                 frequency=None, latencyBudget=None, profiler=None, execution=None, recordWriter=None):
+        """ prices - a PriceData. commission is charged per share, slippage is a fraction of the fill price.
+        modelCache - optional ModelCache, handed to the algorithm as context.modelCache.
+        historyCapacity - bars kept for history(), grown automatically if an algorithm asks for more.
+        frequency - bar size handle_data is called on, e.g. '1m', '5m' or '1d'. Defaults to the frequency of the
+        data, and coarser bars are built from finer data as it streams in.
+        latencyBudget - seconds handle_data may take per bar before the overrun is counted and logged.
+        profiler - optional Profiler to time every section of the algorithm with.
+        execution - optional backtest.Execution.AsyncExecution to route fills through a (fake) broker with.
+        recordWriter - optional backtest.Output.RecordWriter to stream record() output to. Also keeps memory flat
+        on long runs by not keeping transactions, and forgetting orders once they are done and a bar old. """
+        self.prices = prices
+        self.historyCapacity = historyCapacity
+        self.dataFrequency = inferFrequency(prices.dates)
+        self.frequency = frequency or self.dataFrequency
+        if parseFrequency(self.frequency) < parseFrequency(self.dataFrequency):
+            raise ValueError("Can't run on %s bars with %s data" % (self.frequency, self.dataFrequency))
+        self.latencyBudget = latencyBudget
+        self.profiler = profiler
+        self.execution = execution
+        self.recordWriter = recordWriter
+        self.modelCache = modelCache
+        self.capital_base = capital_base
+        self.commission = commission
+        self.slippage = slippage
+
+        self.securities = [Security(s, prices.symbols.get(s)) for s in prices.sids]
+        self.securityBySid = dict((s.sid, s) for s in self.securities)
+        self.columns = pandas.Index(self.securities)
+        self.datetimes = list(pandas.DatetimeIndex(prices.dates).to_pydatetime())
+        self.index = 0
+
+        self.bars = BarData(self)
+        self.aggregators = {}
+        self.buckets = {}
+        self.log = AlgorithmLog(self, logger or logging.getLogger("backtest"))
+
+        self.orders = {}
+        self.openOrders = []
+        self.nextOrderId = 0
+        self.transactions = []
+        self.closedTrades = array("d")
+        self.recorded = []
+
+    def currentDatetime(self):
+        return self.datetimes[self.index]
+
+    ###
+    ### Quantopian API, injected as globals into the algorithm
+    ###
+
+    def sid(self, number):
+        if number not in self.securityBySid:
+            raise KeyError("No price data loaded for sid %d" % number)
+        return self.securityBySid[number]
+
+    def history(self, bar_count, frequency='1d', field='price', ffill=True):
+        if frequency == self.dataFrequency:
+            if bar_count > self.historyStore.capacity:
+                self.resetHistory(bar_count)
+            store = self.historyStore
+        else:
+            # Coarser bars, built from the data as it streams in (the last one is still in progress)
+            store = self.aggregator(frequency, bar_count)
+
+        # The window ends with (and includes) the current bar, like Quantopian's history(), and is a view straight
+        # into the history ring buffer
+        (window, dates) = (store.window(bar_count, field), store.windowDates(bar_count))
+
+        # Quantopian always has bar_count bars to hand back. Near the start of the data there are fewer, so the
+        # oldest bar is repeated in their place (with no timestamp)
+        missing = bar_count - len(window)
+        if missing > 0 and len(window):
+            window = numpy.concatenate([numpy.repeat(window[:1], missing, axis=0), window])
+            dates = numpy.concatenate([numpy.full(missing, numpy.datetime64("NaT"), dtype=dates.dtype), dates])
+
+        return pandas.DataFrame(window, index=dates, columns=self.columns, copy=False)
+
+    def order(self, security, amount, limit_price=None, stop_price=None, style=None):
+        amount = int(amount)
+        if amount == 0:
+            return None
+
+        self.nextOrderId += 1
+        orderId = "%08d" % self.nextOrderId
+        currOrder = Order(orderId, security, amount, self.currentDatetime(), limit=limit_price, stop=stop_price)
+        self.orders[orderId] = currOrder
+        self.openOrders.append(currOrder)
+        return orderId
+
+    def order_batch(self, securities, amounts, limit_prices=None, stop_prices=None):
+        """ Not part of Quantopian's API: one order per security for a whole vector of share amounts at once (zero
+        or NaN amounts are skipped), with optional vectors of limit / stop prices. Returns the order ids, None
+        where nothing was ordered. """
+        amounts = numpy.nan_to_num(numpy.asarray(amounts, dtype=float)).astype(int)
+        created = self.currentDatetime()
+        orderIds = [None] * len(amounts)
+        for i in numpy.flatnonzero(amounts):
+            self.nextOrderId += 1
+            orderId = orderIds[i] = "%08d" % self.nextOrderId
+            currOrder = Order(orderId, securities[i], int(amounts[i]), created,
+                              limit=float(limit_prices[i]) if limit_prices is not None else None,
+                              stop=float(stop_prices[i]) if stop_prices is not None else None)
+            self.orders[orderId] = currOrder
+            self.openOrders.append(currOrder)
+        return orderIds
+
+    def order_value(self, security, value, limit_price=None, stop_price=None, style=None):
+        price = self.prices.fields["price"][self.index, self.prices.column[security.sid]]
+        return self.order(security, value / price, limit_price, stop_price)
+
+    def order_percent(self, security, percent, limit_price=None, stop_price=None, style=None):
+        return self.order_value(security, percent * self.portfolio.portfolio_value, limit_price, stop_price)
+
+    def order_target(self, security, target, limit_price=None, stop_price=None, style=None):
+        return self.order(security, target - self.portfolio.positions[security].amount, limit_price, stop_price)
+
+    def order_target_percent(self, security, percent, limit_price=None, stop_price=None, style=None):
+        price = self.prices.fields["price"][self.index, self.prices.column[security.sid]]
+        target = int(percent * self.portfolio.portfolio_value / price)
+        return self.order_target(security, target, limit_price, stop_price)
+
+    def get_order(self, orderId):
+        return self.orders.get(orderId)
+
+    def get_open_orders(self, security=None):
+        return [o for o in self.openOrders if security is None or o.sid == security]
+
+    def cancel_order(self, orderId):
+        currOrder = self.orders.get(orderId)
+        if currOrder is not None and currOrder.status == Order.OPEN:
+            currOrder.status = Order.CANCELLED
+            self.openOrders.remove(currOrder)
+            if self.execution is not None:
+                self.execution.cancel(orderId)
+
+    def record(self, **kwargs):
+        if self.recordWriter is not None:
+            self.recordWriter.record(self.prices.dates[self.index], kwargs)
+        else:
+            self.recorded.append((self.currentDatetime(), kwargs))
+
+    def api(self):
+        """ Globals that Quantopian provides to an algorithm """
+        return {"sid": self.sid,
+                "symbol": self.sid,
+                "history": self.history,
+                "order": self.order,
+                "order_value": self.order_value,
+                "order_batch": self.order_batch,
+                "order_percent": self.order_percent,
+                "order_target": self.order_target,
+                "order_target_percent": self.order_target_percent,
+                "get_order": self.get_order,
+                "get_open_orders": self.get_open_orders,
+                "cancel_order": self.cancel_order,
+                "record": self.record,
+                "log": self.log}
+
+    ###
+    ### Simulation
+    ###
+
+    def resetHistory(self, capacity):
+        """ (Re)build the history ring buffer with room for capacity bars, filled up to and including the current bar.
+        Memory-mapped data is sliced directly instead. """
+        end = self.index + 1
+        if self.prices.mapped:
+            self.historyStore = MappedHistory(self.prices, end)
+            return
+        start = max(0, end - capacity)
+        self.historyStore = HistoryStore(len(self.prices.sids), list(self.prices.fields), capacity)
+        self.historyStore.extend(dict((field, values[start:end]) for (field, values) in self.prices.fields.items()),
+                                 self.prices.dates[start:end])
+
+    def bucketIds(self, frequency):
+        """ Bar of the given frequency that every row of the data falls in, worked out once per frequency """
+        if frequency not in self.buckets:
+            self.buckets[frequency] = bucketIds(self.prices.dates, frequency)
+        return self.buckets[frequency]
+
+    def aggregator(self, frequency, capacity=None):
+        """ The BarAggregator building frequency bars, created (or rebuilt to hold capacity bars) from the data up to
+        and including the current bar on first use, then kept up to date by run() """
+        capacity = max(capacity or 0, self.historyCapacity)
+        current = self.aggregators.get(frequency)
+        if current is not None and current.store.capacity >= capacity:
+            return current
+
+        if parseFrequency(frequency) < parseFrequency(self.dataFrequency):
+            raise ValueError("Can't build %s bars from %s data" % (frequency, self.dataFrequency))
+        buckets = self.bucketIds(frequency)
+        end = self.index + 1
+
+        # Backfill from the first row of the oldest bar that fits
+        starts = numpy.flatnonzero(numpy.diff(buckets[:end])) + 1
+        start = starts[-capacity] if len(starts) >= capacity else 0
+
+        aggregator = BarAggregator(frequency, len(self.prices.sids), list(self.prices.fields), capacity)
+        aggregator.extend(dict((field, values[start:end]) for (field, values) in self.prices.fields.items()),
+                          self.prices.dates[start:end], buckets[start:end])
+        self.aggregators[frequency] = aggregator
+        return aggregator
+
+    def currentBar(self, field):
+        """ Vector of the current bar's values of a field, at the frequency handle_data runs on """
+        if self.frequency == self.dataFrequency:
+            return self.prices.fields[field][self.index]
+        return self.aggregators[self.frequency].window(1, field)[0]
+
+    def fillOrders(self):
+        """ Fill open orders at the current bar's price. Stop and limit orders wait until the price crosses. With an
+        execution layer the fillable orders all go to its broker at once instead, and whatever part of an order the
+        broker didn't fill stays open for the next bar. """
+        prices = self.prices.fields["price"][self.index]
+        (stillOpen, fillable) = ([], [])
+        for currOrder in self.openOrders:
+            price = prices[self.prices.column[currOrder.sid.sid]]
+            buying = currOrder.amount > 0
+
+            # No price for this security on this bar, or the stop / limit has not been hit yet
+            if numpy.isnan(price) or \
+               (currOrder.stop is not None and (price < currOrder.stop if buying else price > currOrder.stop)) or \
+               (currOrder.limit is not None and (price > currOrder.limit if buying else price < currOrder.limit)):
+                stillOpen.append(currOrder)
+            else:
+                fillable.append(currOrder)
+
+        if self.execution is None:
+            for currOrder in fillable:
+                self.applyFill(currOrder, currOrder.amount - currOrder.filled, prices[self.prices.column[currOrder.sid.sid]])
+        else:
+            self.execution.send([(currOrder.id, currOrder.sid.sid, currOrder.amount - currOrder.filled) for currOrder in fillable])
+            self.execution.wait()
+            for (orderId, amount, price) in self.execution.drain():
+                self.applyFill(self.orders[orderId], amount, price)
+            stillOpen += [currOrder for currOrder in fillable if currOrder.status == Order.OPEN]
+
+        self.openOrders = stillOpen
+
+    def applyFill(self, currOrder, amount, price):
+        """ Book a fill of amount shares of an order at price, plus slippage and commission """
+        buying = amount > 0
+        fillPrice = price * (1 + self.slippage) if buying else price * (1 - self.slippage)
+        commission = abs(amount) * self.commission
+
+        # Update the position, keeping an average cost basis
+        position = self.portfolio.positions.get(currOrder.sid)
+        if position is None:
+            position = self.portfolio.positions[currOrder.sid] = Position(currOrder.sid)
+        # Realised profit on whatever part of the position this fill closes out
+        if position.amount != 0 and (amount > 0) != (position.amount > 0):
+            closed = min(abs(amount), abs(position.amount))
+            self.closedTrades.append(closed * (fillPrice - position.cost_basis) * (1 if position.amount > 0 else -1))
+
+        newAmount = position.amount + amount
+        if newAmount == 0:
+            position.cost_basis = 0.0
+        elif position.amount == 0 or (position.amount > 0) != (newAmount > 0):
+            position.cost_basis = fillPrice
+        elif (amount > 0) == (position.amount > 0):
+            position.cost_basis = (position.cost_basis * position.amount + fillPrice * amount) / newAmount
+        position.amount = newAmount
+        position.last_sale_price = price
+
+        self.portfolio.shares[self.prices.column[currOrder.sid.sid]] = newAmount
+        self.portfolio.cash -= fillPrice * amount + commission
+
+        currOrder.filled += amount
+        currOrder.commission += commission
+        currOrder.dt = self.currentDatetime()
+        if currOrder.filled == currOrder.amount:
+            currOrder.status = Order.FILLED
+        if self.recordWriter is None:
+            self.transactions.append((currOrder.dt, currOrder.sid, amount, fillPrice, commission))
+
+    def lastPrice(self, sid):
+        """ The current bar's price of a sid, what a FakeBroker fills at """
+        return self.prices.fields["price"][self.index, self.prices.column[sid]]
+
+    def run(self, algorithm, start=None, end=None, context=None):
+        """ Run an algorithm namespace (see loadAlgorithm) between two dates. Returns the vector of portfolio values
+        at the end of every bar handle_data saw. """
+        self.portfolio = Portfolio(self.capital_base, len(self.prices.sids))
+        self.context = context or Context()
+        self.context.portfolio = self.portfolio
+        self.context.barFrequency = self.frequency
+        if self.modelCache is not None:
+            self.context.modelCache = self.modelCache
+
+        startIndex = self.prices.index(start) if start is not None else 0
+        endIndex = self.prices.index(end) if end is not None else len(self.prices)
+
+        # History before the first bar is available from the start, like on Quantopian
+        self.index = startIndex - 1
+        self.resetHistory(self.historyCapacity)
+        self.aggregators = {}
+        if self.frequency != self.dataFrequency:
+            self.aggregator(self.frequency)
+
+        # handle_data runs on the last row of every bar at the run frequency, i.e. every row when it matches the data
+        buckets = self.bucketIds(self.frequency)
+        barEnds = numpy.append(buckets[1:] != buckets[:-1], True)
+
+        self.index = startIndex
+        if self.profiler is not None:
+            self.profiler.instrument(algorithm)
+        algorithm["initialize"](self.context)
+        handle_data = algorithm["handle_data"]
+
+        prices = self.prices.fields["price"]
+        nBars = int(numpy.count_nonzero(barEnds[startIndex:endIndex]))
+        self.portfolioValues = numpy.zeros(nBars)
+        self.valueDates = self.prices.dates[startIndex:endIndex][barEnds[startIndex:endIndex]]
+        self.latencies = numpy.zeros(nBars)
+        self.overBudget = 0
+        n = 0
+        for t in range(startIndex, endIndex):
+            self.index = t
+            bar = dict((field, values[t]) for (field, values) in self.prices.fields.items())
+            self.historyStore.append(bar, self.prices.dates[t])
+            for (frequency, aggregator) in self.aggregators.items():
+                aggregator.append(bar, self.prices.dates[t], self.buckets[frequency][t])
+
+            # Streaming: get_order() only needs to know the orders still open and the ones the last bar placed
+            if self.recordWriter is not None and len(self.orders) > len(self.openOrders):
+                self.orders = dict((currOrder.id, currOrder) for currOrder in self.openOrders)
+
+            # Yesterday's orders go through at today's price before the algorithm sees the bar
+            if self.openOrders:
+                self.fillOrders()
+            self.portfolio.markToMarket(prices[t])
+
+            if not barEnds[t]:
+                continue
+
+            if self.profiler is not None:
+                self.profiler.beginBar()
+            began = time.perf_counter()
+            handle_data(self.context, self.bars)
+            self.latencies[n] = time.perf_counter() - began
+            if self.profiler is not None:
+                self.profiler.endBar()
+            if self.latencyBudget is not None and self.latencies[n] > self.latencyBudget:
+                self.overBudget += 1
+
+            self.portfolioValues[n] = self.portfolio.portfolio_value
+            n += 1
+
+        if self.overBudget:
+            self.log.logger.warning("handle_data went over its %.3f ms latency budget on %d of %d bars",
+                                    self.latencyBudget * 1000, self.overBudget, nBars)
+        return self.portfolioValues
+
+
+def loadAlgorithm(path, api):
+    """ Execute a Quantopian algorithm file with the API globals injected, returning its namespace """
+    namespace = dict(api)
+    namespace["__name__"] = "algorithm"
+    namespace["__file__"] = path
+    with open(path) as f:
+        source = f.read()
+    exec(compile(source, path, "exec"), namespace)
+    return namespace
+
+
+def performanceSummary(portfolioValues, closedTrades=None, periodsPerYear=252):
+    """ Total return, annualised Sharpe ratio and maximum drawdown of a vector of portfolio values. Given the
+    realised profit of each closed trade, also the number of trades and the fraction that made money. """
+    portfolioValues = numpy.asarray(portfolioValues, dtype=float)
+    returns = numpy.diff(portfolioValues) / portfolioValues[:-1]
+    sd = returns.std() if len(returns) else 0.0
+    peaks = numpy.maximum.accumulate(portfolioValues)
+
+    summary = {"total_return": portfolioValues[-1] / portfolioValues[0] - 1 if len(portfolioValues) else 0.0,
+               "sharpe": returns.mean() / sd * numpy.sqrt(periodsPerYear) if sd > 0 else 0.0,
+               "max_drawdown": float(((peaks - portfolioValues) / peaks).max()) if len(portfolioValues) else 0.0}
+    if closedTrades is not None:
+        summary["trades"] = len(closedTrades)
+        summary["hit_rate"] = float(numpy.mean(numpy.asarray(closedTrades) > 0)) if len(closedTrades) else 0.0
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a Quantopian style algorithm over local daily bars")
+    parser.add_argument("algorithm", help="path to the algorithm file, e.g. part3/KalmanFilter1.py")
+    parser.add_argument("--data", required=True, help="directory of <sid>.csv / <sid>.parquet price files, or a columnar store made from them by backtest.ColumnarStore")
+    parser.add_argument("--start", help="first date to trade")
+    parser.add_argument("--end", help="stop before this date")
+    parser.add_argument("--capital", type=float, default=100000)
+    parser.add_argument("--commission", type=float, default=0.0, help="per share")
+    parser.add_argument("--slippage", type=float, default=0.0, help="fraction of the fill price")
+    parser.add_argument("--output", help="write the portfolio value per bar to this csv")
+    parser.add_argument("--cache", help="directory to cache fitted models in across runs")
+    parser.add_argument("--cache-size", type=float, default=512, help="cache size limit in MB")
+    parser.add_argument("--frequency", help="bar size to run handle_data on, e.g. 1m, 5m or 1d (defaults to the data's)")
+    parser.add_argument("--latency-budget", type=float, help="per bar handle_data budget in ms, reports latency percentiles")
+    parser.add_argument("--profile", help="time every section of the algorithm and write the summary to this .json / .csv")
+    parser.add_argument("--broker-latency", type=float, help="fill orders through a simulated broker with this round-trip latency in ms")
+    parser.add_argument("--partial-fills", type=float, default=0.0, help="probability the simulated broker only partly fills an order")
+    parser.add_argument("--broker-connections", type=int, default=8, help="connections to the simulated broker, i.e. orders in flight at once")
+    parser.add_argument("--records", help="stream record() output to this chunked columnar file (read it back with backtest.Output.readRecords), keeping memory flat on long runs")
+    parser.add_argument("--log-file", help="write the algorithm's log output to this file from a background thread")
+    parser.add_argument("--verbose", action="store_true", help="show the algorithm's log output")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(message)s")
+    logSink = None
+    if args.log_file:
+        logging.getLogger("backtest").setLevel(logging.INFO)
+        logSink = startLogSink(logging.getLogger("backtest"), logging.FileHandler(args.log_file, mode="w"))
+    recordWriter = RecordWriter(args.records) if args.records else None
+
+    prices = PriceData.load(args.data)
+    modelCache = ModelCache(args.cache, maxBytes=int(args.cache_size * 1024 * 1024)) if args.cache else None
+    execution = None
+    if args.broker_latency is not None:
+        broker = FakeBroker(lambda sid: backtest.lastPrice(sid), latency=args.broker_latency / 1000.0, partialFills=args.partial_fills)
+        execution = AsyncExecution(broker, poolSize=args.broker_connections)
+    backtest = Backtest(prices, capital_base=args.capital, commission=args.commission, slippage=args.slippage, modelCache=modelCache,
+                        frequency=args.frequency, latencyBudget=args.latency_budget / 1000.0 if args.latency_budget else None,
+                        profiler=Profiler() if args.profile else None, execution=execution, recordWriter=recordWriter)
+    algorithm = loadAlgorithm(args.algorithm, backtest.api())
+    portfolioValues = backtest.run(algorithm, start=args.start, end=args.end)
+    if execution is not None:
+        execution.close()
+    if recordWriter is not None:
+        recordWriter.close()
+    if logSink is not None:
+        logSink.stop()
+
+    for (name, value) in sorted(performanceSummary(portfolioValues, backtest.closedTrades, periodsPerYear(backtest.frequency)).items()):
+        print("%s: %f" % (name, value))
+    if args.latency_budget:
+        for percentile in (50, 99):
+            print("latency_p%d_ms: %f" % (percentile, numpy.percentile(backtest.latencies, percentile) * 1000))
+        print("bars_over_budget: %d" % backtest.overBudget)
+
+    if args.profile:
+        backtest.profiler.write(args.profile)
+        print("\n".join(backtest.profiler.report()))
+
+    if args.output:
+        pandas.Series(portfolioValues, index=backtest.valueDates, name="portfolio_value").to_csv(args.output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+import numpy
+
+
+class HistoryStore(object):
+    """ Ring buffer of the last capacity bars, one preallocated (bars x columns) array per field, plus the bar
+    timestamps. Every bar is written twice, capacity rows apart, so the last N bars are always a contiguous
+    zero-copy view no matter where the ring currently starts. """
+
+    def __init__(self, n_columns, fields=("price",), capacity=1260, dtype=numpy.float64):
+        self.n_columns = n_columns
+        self.capacity = capacity
+        self.buffers = dict((field, numpy.full((2 * capacity, n_columns), numpy.nan, dtype=dtype)) for field in fields)
+        self.dates = numpy.zeros(2 * capacity, dtype='datetime64[ns]')
+        self.pos = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, bar, date=None):
+        """ Add a new bar in place. bar - mapping of field to a vector with one value per column """
+        for (field, buffer) in self.buffers.items():
+            buffer[self.pos] = bar[field]
+            buffer[self.pos + self.capacity] = bar[field]
+        if date is not None:
+            self.dates[self.pos] = date
+            self.dates[self.pos + self.capacity] = date
+
+        self.pos = (self.pos + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def extend(self, bars, dates=None):
+        """ Add several bars at once. bars - mapping of field to a (bars x columns) matrix, oldest first """
+        n = len(dates) if dates is not None else len(next(iter(bars.values())))
+        for i in range(max(0, n - self.capacity), n):
+            self.append(dict((field, bars[field][i]) for field in self.buffers), dates[i] if dates is not None else None)
+
+    def replace(self, bar, date=None):
+        """ Overwrite the whole latest bar in place, e.g. a coarser bar that is still being built """
+        last = (self.pos - 1) % self.capacity
+        for (field, buffer) in self.buffers.items():
+            buffer[last] = bar[field]
+            buffer[last + self.capacity] = bar[field]
+        if date is not None:
+            self.dates[last] = date
+            self.dates[last + self.capacity] = date
+
+    def window(self, bar_count, field="price", columns=None):
+        """ The last bar_count bars (fewer if the store doesn't hold that many yet), oldest first. A zero-copy view
+        for all columns, a single column or a slice of columns; a list of columns is gathered into a new array. """
+        bar_count = min(bar_count, self.count)
+        end = self.pos + self.capacity
+        view = self.buffers[field][end - bar_count:end]
+        return view if columns is None else view[:, columns]
+
+    def windowDates(self, bar_count):
+        """ Timestamps of the bars in window(bar_count) """
+        bar_count = min(bar_count, self.count)
+        end = self.pos + self.capacity
+        return self.dates[end - bar_count:end]
@@ -0,0 +1,101 @@
+import os
+import pickle
+import hashlib
+import tempfile
+import numpy
+
+
+class ModelCache(object):
+    """ On-disk cache of fitted models and other artifacts, so repeat backtests and restarts can skip training.
+    Entries are pickles named by their key. Hits touch the file, and once the directory grows past maxBytes the
+    least recently used entries are evicted. """
+
+    def __init__(self, directory, maxBytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @staticmethod
+    def key(*parts):
+        """ Hash any mix of strings, numbers, dicts, lists and numpy arrays (e.g. a stock, its params dict and its
+        training window) into a cache key """
+        digest = hashlib.sha1()
+
+        def feed(part):
+            if isinstance(part, dict):
+                digest.update(b"{")
+                for name in sorted(part, key=repr):
+                    feed(name)
+                    feed(part[name])
+                digest.update(b"}")
+            elif isinstance(part, (list, tuple)):
+                digest.update(b"[")
+                for item in part:
+                    feed(item)
+                digest.update(b"]")
+            elif hasattr(part, "__array__") and not isinstance(part, (str, bytes)):
+                array = numpy.ascontiguousarray(part)
+                digest.update(("%s%s" % (array.dtype.str, array.shape)).encode())
+                digest.update(array.tobytes())
+            else:
+                digest.update(repr(part).encode())
+            digest.update(b"|")
+
+        for part in parts:
+            feed(part)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".pkl")
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def get(self, key, default=None):
+        """ Return the cached value for key, or default on a miss """
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return default
+
+        # Mark as recently used
+        os.utime(path, None)
+        return value
+
+    def put(self, key, value):
+        """ Store value under key, then evict old entries if the cache is over size """
+        # Write to a temporary file first so a reader never sees a half written entry
+        (fd, tmpPath) = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpPath, self.path(key))
+        self.evict()
+
+    def getOrCreate(self, key, factory):
+        """ Return the cached value for key, building and storing it with factory() on a miss """
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            self.put(key, value)
+        return value
+
+    def evict(self):
+        """ Remove least recently used entries until the cache fits in maxBytes """
+        entries = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".pkl"):
+                stat = os.stat(os.path.join(self.directory, filename))
+                entries.append((stat.st_mtime, stat.st_size, filename))
+
+        total = sum(size for (mtime, size, filename) in entries)
+        for (mtime, size, filename) in sorted(entries):
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,230 @@
+import os
+import sys
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+
+from backtest.PriceData import PriceData
+from backtest.ModelCache import ModelCache
+from backtest.Harness import Backtest, Context, Order, Portfolio, loadAlgorithm, performanceSummary
+from backtest.BarAggregator import periodsPerYear
+
+
+def shared(name):
+    """ An attribute a Strategy reads and writes on the feed it belongs to, instead of keeping its own """
+    return property(lambda self: getattr(self.feed, name), lambda self, value: setattr(self.feed, name, value))
+
+
+class Strategy(Backtest):
+    """ One algorithm hosted by a MultiStrategy. It has the Quantopian API and its own orders and book like a
+    Backtest, sized to its share of the capital, so the algorithm sees exactly what it would running alone. The
+    current bar, the history ring buffer and the coarser bars are the feed's, shared with every other strategy. """
+
+    index = shared("index")
+    historyStore = shared("historyStore")
+    aggregators = shared("aggregators")
+    buckets = shared("buckets")
+    datetimes = shared("datetimes")
+
+    def __init__(self, feed, name, path, capital_base, attributes=None):
+        """ attributes - extra context attributes for the algorithm, e.g. paramOverrides or screenedPairs """
+        self.feed = feed
+        self.name = name
+        self.path = path
+        self.attributes = attributes or {}
+        Backtest.__init__(self, feed.prices, capital_base, feed.commission, feed.slippage,
+                          logging.getLogger("backtest.%s" % name), feed.modelCache, feed.historyCapacity, feed.frequency)
+
+
+class MultiStrategy(Backtest):
+    """ Runs several algorithms side by side over one data feed. Every bar is read once and appended once to the
+    history buffers all the strategies' history() calls are served from. Each strategy trades its own book, and the
+    shares its orders fill are netted per security into this backtest's book, the one position book of the whole
+    portfolio: orders that cancel out across strategies never reach the market and pay no commission.
+
+    With workers, the strategies are split across that many processes, each with its own feed. A strategy's fills
+    only depend on its own orders and the bar prices, so the processes never need to talk while they run, and
+    their net fills are added up afterwards. """
+
+    def __init__(self, prices, strategies, capital_base=100000, commission=0.0, slippage=0.0, logger=None, modelCache=None,
+                 historyCapacity=1260, frequency=None, workers=None):
+        """ strategies - list of (name, algorithm path, share of the capital, context attributes or None) """
+        Backtest.__init__(self, prices, capital_base, commission, slippage, logger, modelCache, historyCapacity, frequency)
+        total = float(sum(weight for (name, path, weight, attributes) in strategies))
+        self.strategies = [Strategy(self, name, path, capital_base * weight / total, attributes)
+                           for (name, path, weight, attributes) in strategies]
+        self.workers = workers
+
+    def runStrategies(self, indices, startIndex, endIndex):
+        """ Run the strategies at indices over rows startIndex to endIndex of the feed. Returns the (rows x sids)
+        matrix of the net shares they filled on every row. """
+        strategies = [self.strategies[i] for i in indices]
+        for strategy in strategies:
+            strategy.portfolio = Portfolio(strategy.capital_base, len(self.prices.sids))
+            strategy.sharesTraded = 0
+            strategy.context = Context()
+            for (name, value) in strategy.attributes.items():
+                setattr(strategy.context, name, value)
+            strategy.context.portfolio = strategy.portfolio
+            strategy.context.barFrequency = self.frequency
+            if self.modelCache is not None:
+                strategy.context.modelCache = self.modelCache
+            strategy.algorithm = loadAlgorithm(strategy.path, strategy.api())
+
+        # History before the first bar is available from the start, like on Quantopian
+        self.index = startIndex - 1
+        self.resetHistory(self.historyCapacity)
+        self.aggregators = {}
+        if self.frequency != self.dataFrequency:
+            self.aggregator(self.frequency)
+
+        buckets = self.bucketIds(self.frequency)
+        barEnds = numpy.append(buckets[1:] != buckets[:-1], True)
+
+        self.index = startIndex
+        for strategy in strategies:
+            strategy.algorithm["initialize"](strategy.context)
+
+        prices = self.prices.fields["price"]
+        nBars = int(numpy.count_nonzero(barEnds[startIndex:endIndex]))
+        for strategy in strategies:
+            strategy.portfolioValues = numpy.zeros(nBars)
+            strategy.valueDates = self.prices.dates[startIndex:endIndex][barEnds[startIndex:endIndex]]
+        netFills = numpy.zeros((endIndex - startIndex, len(self.prices.sids)))
+        n = 0
+        for t in range(startIndex, endIndex):
+            # The bar is read and appended to the shared history once, whatever the number of strategies
+            self.index = t
+            bar = dict((field, values[t]) for (field, values) in self.prices.fields.items())
+            self.historyStore.append(bar, self.prices.dates[t])
+            for (frequency, aggregator) in self.aggregators.items():
+                aggregator.append(bar, self.prices.dates[t], self.buckets[frequency][t])
+
+            for strategy in strategies:
+                if strategy.openOrders:
+                    before = strategy.portfolio.shares.copy()
+                    strategy.fillOrders()
+                    filled = strategy.portfolio.shares - before
+                    netFills[t - startIndex] += filled
+                    strategy.sharesTraded += numpy.abs(filled).sum()
+                strategy.portfolio.markToMarket(prices[t])
+
+            if not barEnds[t]:
+                continue
+            for strategy in strategies:
+                strategy.algorithm["handle_data"](strategy.context, strategy.bars)
+                strategy.portfolioValues[n] = strategy.portfolio.portfolio_value
+            n += 1
+
+        return netFills
+
+    def run(self, start=None, end=None):
+        """ Run every strategy between two dates and book their net fills. Returns the vector of the whole
+        portfolio's value at the end of every bar. """
+        startIndex = self.prices.index(start) if start is not None else 0
+        endIndex = self.prices.index(end) if end is not None else len(self.prices)
+
+        if not self.workers or self.workers < 2 or len(self.strategies) < 2:
+            netFills = self.runStrategies(range(len(self.strategies)), startIndex, endIndex)
+        else:
+            groups = [list(range(len(self.strategies)))[i::self.workers] for i in range(min(self.workers, len(self.strategies)))]
+            context = multiprocessing.get_context("fork")
+            with ProcessPoolExecutor(max_workers=len(groups), mp_context=context, initializer=initWorker, initargs=(self,)) as executor:
+                results = list(executor.map(runGroup, groups, [startIndex] * len(groups), [endIndex] * len(groups)))
+
+            netFills = numpy.zeros((endIndex - startIndex, len(self.prices.sids)))
+            for (group, (rows, columns, shares), strategyResults) in zip(groups, *zip(*results)):
+                numpy.add.at(netFills, (rows, columns), shares)
+                for (i, (portfolioValues, valueDates, closedTrades, recorded, sharesTraded)) in zip(group, strategyResults):
+                    strategy = self.strategies[i]
+                    (strategy.portfolioValues, strategy.valueDates, strategy.closedTrades, strategy.recorded, strategy.sharesTraded) = \
+                        (portfolioValues, valueDates, closedTrades, recorded, sharesTraded)
+
+        return self.bookNetFills(netFills, startIndex, endIndex)
+
+    def bookNetFills(self, netFills, startIndex, endIndex):
+        """ Fill the net shares of every row into this backtest's book at that row's price, marking it to market at
+        the end of every bar """
+        self.portfolio = Portfolio(self.capital_base, len(self.prices.sids))
+        buckets = self.bucketIds(self.frequency)
+        barEnds = numpy.append(buckets[1:] != buckets[:-1], True)
+        prices = self.prices.fields["price"]
+
+        self.portfolioValues = numpy.zeros(int(numpy.count_nonzero(barEnds[startIndex:endIndex])))
+        self.valueDates = self.prices.dates[startIndex:endIndex][barEnds[startIndex:endIndex]]
+        self.grossShares = sum(strategy.sharesTraded for strategy in self.strategies)
+        n = 0
+        for t in range(startIndex, endIndex):
+            self.index = t
+            for column in numpy.flatnonzero(netFills[t - startIndex]):
+                currOrder = Order(None, self.securities[column], int(netFills[t - startIndex, column]), self.currentDatetime())
+                self.applyFill(currOrder, currOrder.amount, prices[t, column])
+            self.portfolio.markToMarket(prices[t])
+            if barEnds[t]:
+                self.portfolioValues[n] = self.portfolio.portfolio_value
+                n += 1
+        return self.portfolioValues
+
+
+# The MultiStrategy a worker process runs its share of the strategies on, inherited through fork
+workerState = {}
+
+
+def initWorker(runner):
+    workerState["runner"] = runner
+
+
+def runGroup(indices, startIndex, endIndex):
+    """ Run some of the strategies in a worker. Returns their net fills as (rows, columns, shares) of the nonzero
+    entries, and each strategy's (portfolio values, value dates, closed trades, records, shares traded) """
+    runner = workerState["runner"]
+    netFills = runner.runStrategies(indices, startIndex, endIndex)
+    (rows, columns) = numpy.nonzero(netFills)
+    results = [(runner.strategies[i].portfolioValues, runner.strategies[i].valueDates, runner.strategies[i].closedTrades,
+                runner.strategies[i].recorded, runner.strategies[i].sharesTraded) for i in indices]
+    return ((rows, columns, netFills[rows, columns]), results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run several Quantopian style algorithms side by side over one data feed, netting their orders into one book")
+    parser.add_argument("algorithm", nargs="+", help="algorithm files, optionally as path=weight for their share of the capital (default 1 each)")
+    parser.add_argument("--data", required=True, help="directory of <sid>.csv / <sid>.parquet price files, or a columnar store made from them by backtest.ColumnarStore")
+    parser.add_argument("--start", help="first date to trade")
+    parser.add_argument("--end", help="stop before this date")
+    parser.add_argument("--capital", type=float, default=100000, help="split across the algorithms by weight")
+    parser.add_argument("--commission", type=float, default=0.0, help="per share")
+    parser.add_argument("--slippage", type=float, default=0.0, help="fraction of the fill price")
+    parser.add_argument("--frequency", help="bar size to run handle_data on, e.g. 1m, 5m or 1d (defaults to the data's)")
+    parser.add_argument("--workers", type=int, help="split the algorithms across this many processes")
+    parser.add_argument("--cache", help="directory to cache fitted models in across runs")
+    parser.add_argument("--cache-size", type=float, default=512, help="cache size limit in MB")
+    parser.add_argument("--verbose", action="store_true", help="show the algorithms' log output")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(message)s")
+
+    strategies = []
+    for spec in args.algorithm:
+        (path, weight) = spec.rsplit("=", 1) if "=" in spec else (spec, 1.0)
+        strategies.append((os.path.splitext(os.path.basename(path))[0], path, float(weight), None))
+
+    prices = PriceData.load(args.data)
+    modelCache = ModelCache(args.cache, maxBytes=int(args.cache_size * 1024 * 1024)) if args.cache else None
+    runner = MultiStrategy(prices, strategies, capital_base=args.capital, commission=args.commission, slippage=args.slippage,
+                           modelCache=modelCache, frequency=args.frequency, workers=args.workers)
+    portfolioValues = runner.run(start=args.start, end=args.end)
+
+    perYear = periodsPerYear(runner.frequency)
+    for strategy in runner.strategies:
+        summary = performanceSummary(strategy.portfolioValues, strategy.closedTrades, perYear)
+        print("%s: %s" % (strategy.name, " ".join("%s=%f" % item for item in sorted(summary.items()))))
+    for (name, value) in sorted(performanceSummary(portfolioValues, runner.closedTrades, perYear).items()):
+        print("%s: %f" % (name, value))
+    netShares = sum(abs(amount) for (dt, sid, amount, price, commission) in runner.transactions)
+    print("shares_traded: %d (%d before netting)" % (netShares, runner.grossShares))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
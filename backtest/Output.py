@@ -0,0 +1,114 @@
+import json
+import queue
+import struct
+import logging
+import logging.handlers
+from array import array
+import numpy
+import pandas
+
+
+MAGIC = b"RECORDS1\n"
+
+
+class RecordWriter(object):
+    """ Streams record() output into an append-only columnar file, so a backtest's recorded series don't grow
+    with its length. Like Quantopian, the last value recorded under a name in a bar wins, giving one row per bar.
+    Rows are buffered column by column and written chunkRows at a time, each chunk a length prefixed JSON header
+    (rows, column names) followed by the int64 nanosecond timestamps and one float64 array per column. A name first
+    recorded mid chunk is NaN for the rows before. """
+
+    def __init__(self, path, chunkRows=4096):
+        self.path = path
+        self.chunkRows = chunkRows
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.dates = array("q")
+        self.columns = {}          # name -> array("d") of the buffered rows
+        self.pendingDate = None
+        self.pending = {}
+        self.rows = 0
+
+    def record(self, date, values):
+        """ Record values (mapping of name to number) for the bar at date """
+        if date != self.pendingDate:
+            self.commit()
+            self.pendingDate = date
+        self.pending.update(values)
+
+    def commit(self):
+        """ Add the pending bar as a row, writing a chunk once chunkRows are buffered """
+        if self.pendingDate is None:
+            return
+        for name in self.pending:
+            if name not in self.columns:
+                self.columns[name] = array("d", [numpy.nan]) * len(self.dates)
+        self.dates.append(int(numpy.datetime64(self.pendingDate, "ns").astype(numpy.int64)))
+        for (name, column) in self.columns.items():
+            column.append(float(self.pending.get(name, numpy.nan)))
+        (self.pendingDate, self.pending) = (None, {})
+
+        if len(self.dates) >= self.chunkRows:
+            self.flush()
+
+    def flush(self):
+        """ Write the buffered rows as one chunk """
+        if not len(self.dates):
+            return
+        names = sorted(self.columns)
+        header = json.dumps({"rows": len(self.dates), "columns": names}).encode("utf-8")
+        self.file.write(struct.pack("<I", len(header)))
+        self.file.write(header)
+        self.file.write(self.dates.tobytes())
+        for name in names:
+            self.file.write(self.columns[name].tobytes())
+        self.rows += len(self.dates)
+
+        self.dates = array("q")
+        self.columns = dict((name, array("d")) for name in names)
+
+    def close(self):
+        self.commit()
+        self.flush()
+        self.file.close()
+
+
+def readRecords(path):
+    """ Read a file written by RecordWriter back as a DataFrame indexed by bar time, one column per recorded name """
+    frames = []
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a record file" % path)
+        while True:
+            prefix = f.read(4)
+            if not prefix:
+                break
+            header = json.loads(f.read(struct.unpack("<I", prefix)[0]).decode("utf-8"))
+            rows = header["rows"]
+            dates = numpy.frombuffer(f.read(8 * rows), dtype=numpy.int64).astype('datetime64[ns]')
+            columns = dict((name, numpy.frombuffer(f.read(8 * rows), dtype=numpy.float64)) for name in header["columns"])
+            frames.append(pandas.DataFrame(columns, index=pandas.DatetimeIndex(dates, name="date")))
+    return pandas.concat(frames, sort=True) if frames else pandas.DataFrame()
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """ QueueHandler that hands records over unformatted, so even formatting the message happens on the
+    listener's thread (arguments are formatted after the call returns, so only log values that won't change). When
+    the queue is full it waits for the listener instead of dropping records, which bounds the memory it takes. """
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        self.queue.put(record)
+
+
+def startLogSink(logger, handler, maxsize=100000):
+    """ Send logger's records through a queue to handler on a background thread, so a log call on the hot path
+    costs a level check and a queue put. Returns the QueueListener, stop() it to flush at the end of a run. """
+    records = queue.Queue(maxsize)
+    logger.addHandler(LazyQueueHandler(records))
+    logger.propagate = False
+    listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,124 @@
+import os
+import sys
+import argparse
+import itertools
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy
+
+from backtest.PriceData import PriceData
+from backtest.Harness import Backtest, Context, loadAlgorithm, performanceSummary
+from backtest.BarAggregator import periodsPerYear
+
+
+PAIRS_ALGORITHM = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "part1", "PairsAlgoPortfolio.py")
+
+# Per worker state: the shared price matrix and the algorithm's test_coint, set up once by initWorker
+workerState = {}
+
+
+def initWorker(name, shape, algorithmPath):
+    """ Attach a worker process to the shared price matrix and load test_coint from the pairs algorithm """
+    memory = shared_memory.SharedMemory(name=name)
+    workerState["memory"] = memory
+    workerState["prices"] = numpy.ndarray(shape, dtype=numpy.float64, buffer=memory.buf)
+    workerState["test_coint"] = loadAlgorithm(algorithmPath, {})["test_coint"]
+
+
+def screenChunk(chunk):
+    """ Run test_coint over a chunk of (x, y) column pairs, returning the ones that pass """
+    prices = workerState["prices"]
+    test_coint = workerState["test_coint"]
+    return [(x, y) for (x, y) in chunk if test_coint(pair=(prices[:, x], prices[:, y]))]
+
+
+def screenPairs(prices, sids=None, window=60, end=None, minCorrelation=0.8, processes=None, chunksize=256,
+                algorithmPath=PAIRS_ALGORITHM):
+    """ Screen every pair of a universe with the pairs algorithm's test_coint over the last window bars before end.
+
+    Pairs whose prices are correlated less than minCorrelation are rejected up front, since working out one
+    correlation matrix is far cheaper than a cointegration test per pair. The rest are spread across a process pool
+    in chunks, with the price matrix handed over through shared memory instead of being pickled with every task.
+    Returns a list of (x sid, y sid) pairs, ordered like context.stocks expects. """
+    sids = list(sids) if sids is not None else list(prices.sids)
+    endIndex = prices.index(end) if end is not None else len(prices)
+    matrix = prices.fields["price"][max(0, endIndex - window):endIndex, [prices.column[s] for s in sids]]
+
+    # Securities without a full window of prices can't be tested
+    complete = ~numpy.isnan(matrix).any(axis=0)
+    sids = [s for (s, ok) in zip(sids, complete) if ok]
+    matrix = numpy.ascontiguousarray(matrix[:, complete])
+
+    # Cheap prefilter on the correlation of prices
+    correlation = numpy.corrcoef(matrix, rowvar=False)
+    candidates = [(x, y) for (x, y) in itertools.combinations(range(len(sids)), 2) if correlation[x, y] >= minCorrelation]
+    if not candidates:
+        return []
+    chunks = [candidates[i:i + chunksize] for i in range(0, len(candidates), chunksize)]
+
+    # Copy the price matrix into shared memory once for all workers
+    memory = shared_memory.SharedMemory(create=True, size=matrix.nbytes)
+    try:
+        numpy.ndarray(matrix.shape, dtype=numpy.float64, buffer=memory.buf)[...] = matrix
+
+        pool = multiprocessing.Pool(processes, initializer=initWorker, initargs=(memory.name, matrix.shape, algorithmPath))
+        try:
+            accepted = [pair for chunk in pool.imap_unordered(screenChunk, chunks) for pair in chunk]
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        memory.close()
+        memory.unlink()
+
+    return [(sids[x], sids[y]) for (x, y) in sorted(accepted)]
+
+
+def readPairs(path):
+    """ Read back the pairs written by --output, as a list of (x sid, y sid) for context.screenedPairs """
+    with open(path) as f:
+        lines = f.read().split()
+    return [tuple(int(s) for s in line.split(",")) for line in lines[1:]]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Screen every pair in a universe for cointegration, optionally backtesting the pairs algorithm on the result")
+    parser.add_argument("--data", required=True, help="directory of <sid>.csv / <sid>.parquet price files")
+    parser.add_argument("--sids", help="comma separated sids to screen (defaults to every loaded sid)")
+    parser.add_argument("--window", type=int, default=60, help="bars to test cointegration over")
+    parser.add_argument("--end", help="screen on the bars before this date (defaults to the last bar, or --start with --run)")
+    parser.add_argument("--min-correlation", type=float, default=0.8)
+    parser.add_argument("--processes", type=int, help="worker processes (defaults to one per core)")
+    parser.add_argument("--chunksize", type=int, default=256, help="pairs per task")
+    parser.add_argument("--output", help="write the accepted pairs to this csv")
+    parser.add_argument("--run", action="store_true", help="backtest the pairs algorithm on the accepted pairs")
+    parser.add_argument("--start", help="first date to trade with --run")
+    parser.add_argument("--stop", help="stop trading before this date with --run")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+
+    prices = PriceData.load(args.data)
+    sids = [int(s) for s in args.sids.split(",")] if args.sids else None
+    pairs = screenPairs(prices, sids, window=args.window, end=args.end or (args.start if args.run else None),
+                        minCorrelation=args.min_correlation, processes=args.processes, chunksize=args.chunksize)
+
+    for (x, y) in pairs:
+        print("%d,%d" % (x, y))
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write("x,y\n")
+            f.writelines("%d,%d\n" % pair for pair in pairs)
+
+    if args.run and pairs:
+        backtest = Backtest(prices)
+        context = Context()
+        context.screenedPairs = pairs
+        portfolioValues = backtest.run(loadAlgorithm(PAIRS_ALGORITHM, backtest.api()), start=args.start, end=args.stop, context=context)
+        for (name, value) in sorted(performanceSummary(portfolioValues, backtest.closedTrades, periodsPerYear(backtest.frequency)).items()):
+            print("%s: %f" % (name, value))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
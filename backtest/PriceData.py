@@ -0,0 +1,96 @@
+import os
+import numpy
+import pandas
+
+
+class PriceData(object):
+    """ Columnar daily bar storage for the local backtester. Every field (price, volume, ...) is one
+    (n_dates x n_sids) float array, so a bar is a row and a symbol's history is a column slice. """
+
+    def __init__(self, dates, sids, fields, symbols=None):
+        """ dates - sorted datetime64 array, sids - list of integer sids (one per column),
+        fields - mapping of field name to (n_dates x n_sids) float array """
+        self.dates = numpy.asarray(dates, dtype='datetime64[ns]')
+        self.sids = [int(s) for s in sids]
+        self.fields = dict(fields)
+        self.symbols = symbols or {}
+        # Whether the field arrays are memory maps of a columnar store (see backtest.ColumnarStore)
+        self.mapped = False
+
+        # Lookup of sid to its column in every field array
+        self.column = dict((s, i) for (i, s) in enumerate(self.sids))
+
+    def __len__(self):
+        return len(self.dates)
+
+    def index(self, date):
+        """ Return the row of the first bar on or after date """
+        return int(numpy.searchsorted(self.dates, numpy.datetime64(pandas.Timestamp(date), 'ns')))
+
+    @classmethod
+    def fromFrames(cls, frames, symbols=None):
+        """ Build the columnar arrays from a mapping of sid to a DataFrame indexed by date, one column per field.
+        Dates missing for a sid are forward filled, and left as NaN before its first bar. """
+        sids = sorted(frames)
+        dates = numpy.unique(numpy.concatenate([frames[s].index.values.astype('datetime64[ns]') for s in sids]))
+        names = sorted(set(name for s in sids for name in frames[s].columns))
+
+        fields = {}
+        for name in names:
+            fields[name] = numpy.full((len(dates), len(sids)), numpy.nan)
+        for (i, s) in enumerate(sids):
+            frame = frames[s].reindex(pandas.DatetimeIndex(dates)).ffill()
+            for name in frame.columns:
+                fields[name][:, i] = frame[name].values
+
+        return cls(dates, sids, fields, symbols)
+
+    @classmethod
+    def load(cls, path):
+        """ Load daily bars from a directory holding one <sid>.csv or <sid>.parquet file per security, each with a
+        date column plus one column per field (at least price). An optional symbols.csv maps sid to symbol.
+        A columnar store written by backtest.ColumnarStore is memory-mapped instead of read. """
+        if os.path.exists(os.path.join(path, "meta.json")):
+            from backtest.ColumnarStore import openStore
+            return openStore(path)
+
+        frames = dict((sid, readPriceFile(fullpath)) for (sid, fullpath) in priceFiles(path))
+        if not frames:
+            raise ValueError("No <sid>.csv or <sid>.parquet price files found in %s" % path)
+        return cls.fromFrames(frames, readSymbols(path))
+
+
+def priceFiles(path):
+    """ (sid, path) of every <sid>.csv / <sid>.parquet file in a directory, in sid order like the columns of
+    PriceData.fromFrames """
+    files = []
+    for filename in os.listdir(path):
+        (name, ext) = os.path.splitext(filename)
+        if name.isdigit() and ext in (".csv", ".parquet"):
+            files.append((int(name), os.path.join(path, filename)))
+    return sorted(files)
+
+
+def readPriceFile(fullpath):
+    """ One security's bars as a float DataFrame indexed by date """
+    if fullpath.endswith(".csv"):
+        frame = pandas.read_csv(fullpath, parse_dates=["date"], index_col="date")
+    else:
+        frame = pandas.read_parquet(fullpath)
+        if "date" in frame.columns:
+            frame = frame.set_index("date")
+        frame.index = pandas.DatetimeIndex(frame.index)
+
+    # Quantopian's price is the close, so fall back to it when there is no explicit price column
+    if "price" not in frame.columns and "close" in frame.columns:
+        frame["price"] = frame["close"]
+    return frame.sort_index().astype(float)
+
+
+def readSymbols(path):
+    """ Mapping of sid to symbol from the directory's symbols.csv, if it has one """
+    fullpath = os.path.join(path, "symbols.csv")
+    if not os.path.exists(fullpath):
+        return {}
+    symbolTable = pandas.read_csv(fullpath)
+    return dict(zip(symbolTable["sid"].astype(int), symbolTable["symbol"]))
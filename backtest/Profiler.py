@@ -0,0 +1,133 @@
+import csv
+import json
+import types
+import functools
+from array import array
+from time import perf_counter
+import numpy
+
+
+# API globals that are plain lookups, not worth a timer
+UNTIMED = frozenset(["sid", "symbol", "log"])
+
+
+def stockOf(args):
+    """ The security (or pair of securities) a call is about, taken from its first argument that is one """
+    for arg in args:
+        if isinstance(getattr(arg, "sid", None), int):
+            return repr(arg)
+        if isinstance(arg, tuple) and arg and all(isinstance(getattr(a, "sid", None), int) for a in arg):
+            return repr(arg)
+    return None
+
+
+class Profiler(object):
+    """ Per section timings of an algorithm. instrument() swaps every function, class method and API global in an
+    algorithm namespace for a timed wrapper, so a backtest that isn't profiled runs the untouched code. Sections
+    are timed inclusively (a function's time includes whatever it calls) and kept per call, per bar (the time
+    spent in a section over one handle_data) and per stock (calls with a security or pair as an argument). """
+
+    def __init__(self):
+        self.calls = {}        # section -> array of call durations
+        self.bars = {}         # section -> array of per bar totals, for the bars the section ran in
+        self.stocks = {}       # (section, stock) -> [calls, total]
+        self.current = {}      # section -> total so far in the current bar
+        self.n_bars = 0
+
+    def add(self, section, elapsed, args):
+        if section not in self.calls:
+            self.calls[section] = array("d")
+        self.calls[section].append(elapsed)
+        self.current[section] = self.current.get(section, 0.0) + elapsed
+
+        stock = stockOf(args)
+        if stock is not None:
+            totals = self.stocks.setdefault((section, stock), [0, 0.0])
+            totals[0] += 1
+            totals[1] += elapsed
+
+    def wrap(self, section, function):
+        """ Timed version of function, recorded under section """
+        add = self.add
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            began = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                add(section, perf_counter() - began, args)
+
+        return timed
+
+    def instrument(self, namespace):
+        """ Time every function, method of a class defined by the algorithm, and API global in namespace. Calls
+        between the algorithm's own functions go through the namespace, so they are timed too. """
+        for (name, value) in list(namespace.items()):
+            if name.startswith("__") or name in UNTIMED:
+                continue
+            if isinstance(value, type) and value.__module__ == namespace.get("__name__"):
+                for (attribute, method) in list(vars(value).items()):
+                    if isinstance(method, types.FunctionType):
+                        setattr(value, attribute, self.wrap("%s.%s" % (name, attribute), method))
+            elif isinstance(value, (types.FunctionType, types.MethodType)):
+                namespace[name] = self.wrap(name, value)
+        return namespace
+
+    def beginBar(self):
+        self.current = {}
+
+    def endBar(self):
+        """ Fold the current bar's section totals into the per bar histograms """
+        for (section, total) in self.current.items():
+            if section not in self.bars:
+                self.bars[section] = array("d")
+            self.bars[section].append(total)
+        self.n_bars += 1
+
+    def summary(self):
+        """ Mapping of section to call count, total seconds, p50/p99 per call and per bar (in ms), and the calls and
+        total seconds per stock """
+        summary = {}
+        for (section, calls) in self.calls.items():
+            calls = numpy.frombuffer(calls, dtype=float)
+            bars = numpy.frombuffer(self.bars[section], dtype=float) if section in self.bars else numpy.zeros(1)
+            summary[section] = {"calls": len(calls),
+                                "total_s": float(calls.sum()),
+                                "call_p50_ms": float(numpy.percentile(calls, 50) * 1000),
+                                "call_p99_ms": float(numpy.percentile(calls, 99) * 1000),
+                                "bar_p50_ms": float(numpy.percentile(bars, 50) * 1000),
+                                "bar_p99_ms": float(numpy.percentile(bars, 99) * 1000),
+                                "bars": len(bars),
+                                "stocks": {}}
+        for ((section, stock), (calls, total)) in self.stocks.items():
+            summary[section]["stocks"][stock] = {"calls": calls, "total_s": total}
+        return summary
+
+    def write(self, path):
+        """ Export the summary as JSON, or as CSV (one row per section, plus one per section and stock) when path
+        ends in .csv """
+        summary = self.summary()
+        if not path.endswith(".csv"):
+            with open(path, "w") as f:
+                json.dump({"bars": self.n_bars, "sections": summary}, f, indent=2, sort_keys=True)
+            return
+
+        columns = ["calls", "total_s", "call_p50_ms", "call_p99_ms", "bar_p50_ms", "bar_p99_ms"]
+        with open(path, "w") as f:
+            writer = csv.writer(f)
+            writer.writerow(["section", "stock"] + columns)
+            for section in sorted(summary, key=lambda section: -summary[section]["total_s"]):
+                writer.writerow([section, ""] + [summary[section][column] for column in columns])
+                for (stock, totals) in sorted(summary[section]["stocks"].items()):
+                    writer.writerow([section, stock, totals["calls"], totals["total_s"]] + [""] * 4)
+
+    def report(self, top=15):
+        """ Lines for the sections with the most total time """
+        summary = self.summary()
+        lines = ["%-36s %8s %10s %9s %9s %9s %9s" % ("section", "calls", "total s", "call p50", "call p99", "bar p50", "bar p99")]
+        for section in sorted(summary, key=lambda section: -summary[section]["total_s"])[:top]:
+            s = summary[section]
+            lines.append("%-36s %8d %10.3f %9.3f %9.3f %9.3f %9.3f" % (section, s["calls"], s["total_s"], s["call_p50_ms"],
+                                                                     s["call_p99_ms"], s["bar_p50_ms"], s["bar_p99_ms"]))
+        return lines
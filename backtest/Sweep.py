@@ -0,0 +1,144 @@
+import ast
+import sys
+import argparse
+import itertools
+import logging
+import multiprocessing
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from backtest.PriceData import PriceData
+from backtest.Harness import Backtest, Context, loadAlgorithm, performanceSummary
+from backtest.BarAggregator import periodsPerYear
+from backtest.PairScreener import readPairs
+
+
+# Per worker state: the price data, loaded once per process (or inherited from the parent under fork)
+workerState = {}
+
+COLUMNS = ("sharpe", "max_drawdown", "hit_rate", "total_return", "trades")
+
+
+def initWorker(dataPath, prices):
+    """ Give a worker process the price data, loading it only if it wasn't inherited from the parent """
+    workerState["prices"] = prices if prices is not None else PriceData.load(dataPath)
+
+
+def gridConfigs(grid):
+    """ Every combination of a grid, given as a mapping of param name to a list of values """
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+def randomConfigs(ranges, samples, seed=None):
+    """ samples configurations drawn uniformly from a mapping of param name to (low, high). Integer bounds give
+    integer draws. """
+    rng = random.Random(seed)
+    configs = []
+    for i in range(samples):
+        config = {}
+        for (name, (low, high)) in sorted(ranges.items()):
+            if isinstance(low, int) and isinstance(high, int):
+                config[name] = rng.randint(low, high)
+            else:
+                config[name] = rng.uniform(low, high)
+        configs.append(config)
+    return configs
+
+
+def sweepConfigs(grid, ranges, samples, seed=None):
+    """ The grid's configurations, each crossed with samples random draws of the ranged params if there are any.
+    Every grid point gets its own draws, all from the one seeded generator. """
+    configs = gridConfigs(grid)
+    if ranges:
+        drawn = iter(randomConfigs(ranges, samples * len(configs), seed))
+        configs = [dict(config, **next(drawn)) for config in configs for i in range(samples)]
+    return configs
+
+
+def runConfig(task):
+    """ Backtest one parameter configuration in a worker, returning its params and performance summary """
+    (algorithmPath, config, start, end, attributes, options) = task
+    backtest = Backtest(workerState["prices"], **options)
+    context = Context()
+    for (name, value) in attributes.items():
+        setattr(context, name, value)
+    context.paramOverrides = config
+    portfolioValues = backtest.run(loadAlgorithm(algorithmPath, backtest.api()), start=start, end=end, context=context)
+
+    summary = performanceSummary(portfolioValues, backtest.closedTrades, periodsPerYear(backtest.frequency))
+    summary["params"] = config
+    return summary
+
+
+def sweep(algorithmPath, dataPath, configs, start=None, end=None, processes=None, attributes=None, **options):
+    """ Backtest an algorithm once per parameter configuration across a process pool. Each configuration is handed
+    to the algorithm as context.paramOverrides, which initialize applies on top of every stock's params.
+    attributes - extra context attributes for every run, e.g. screenedPairs for the pairs algorithm. The price
+    data is loaded once: under fork the workers share the parent's copy read only, otherwise each worker loads it
+    once in its initializer rather than once per task. Returns the summaries, best Sharpe ratio first. """
+    if "fork" in multiprocessing.get_all_start_methods():
+        mpContext = multiprocessing.get_context("fork")
+        initargs = (dataPath, PriceData.load(dataPath))
+    else:
+        mpContext = multiprocessing.get_context()
+        initargs = (dataPath, None)
+
+    tasks = [(algorithmPath, config, start, end, attributes or {}, options) for config in configs]
+    with ProcessPoolExecutor(processes, mp_context=mpContext, initializer=initWorker, initargs=initargs) as pool:
+        results = list(pool.map(runConfig, tasks))
+
+    return sorted(results, key=lambda summary: summary["sharpe"], reverse=True)
+
+
+def writeResults(results, path):
+    """ Write sweep results as a csv table with one row per configuration """
+    with open(path, "w") as f:
+        f.write("params,%s\n" % ",".join(COLUMNS))
+        for summary in results:
+            f.write("\"%s\",%s\n" % (repr(summary["params"]).replace("\"", "'"),
+                                     ",".join("%f" % summary.get(column, 0.0) for column in COLUMNS)))
+
+
+def parseAssignment(text):
+    """ Split a name=value command line argument """
+    (name, value) = text.split("=", 1)
+    return (name.strip(), value.strip())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backtest an algorithm over a grid or random sample of parameters in parallel")
+    parser.add_argument("algorithm", help="path to the algorithm file, e.g. part3/KalmanFilter1.py")
+    parser.add_argument("--data", required=True, help="directory of <sid>.csv / <sid>.parquet price files")
+    parser.add_argument("--start", help="first date to trade")
+    parser.add_argument("--end", help="stop before this date")
+    parser.add_argument("--param", action="append", default=[], help="grid values, e.g. --param \"thresholdEnter=[1.5, 2.0]\"")
+    parser.add_argument("--range", action="append", default=[], help="random search bounds, e.g. --range Q=0.001:0.1")
+    parser.add_argument("--samples", type=int, default=20, help="configurations to draw with --range")
+    parser.add_argument("--seed", type=int, help="random seed for --range")
+    parser.add_argument("--pairs", help="csv of pairs to trade, as written by backtest.PairScreener --output (the pairs algorithm has none of its own)")
+    parser.add_argument("--processes", type=int, help="worker processes (defaults to one per core)")
+    parser.add_argument("--capital", type=float, default=100000)
+    parser.add_argument("--commission", type=float, default=0.0, help="per share")
+    parser.add_argument("--slippage", type=float, default=0.0, help="fraction of the fill price")
+    parser.add_argument("--output", default="sweep.csv", help="csv to write the results table to")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+
+    grid = dict((name, list(ast.literal_eval(value))) for (name, value) in map(parseAssignment, args.param))
+    ranges = dict((name, tuple(ast.literal_eval(bound) for bound in value.split(":", 1)))
+                  for (name, value) in map(parseAssignment, args.range))
+    configs = sweepConfigs(grid, ranges, args.samples, args.seed)
+    attributes = {"screenedPairs": readPairs(args.pairs)} if args.pairs else None
+
+    results = sweep(args.algorithm, args.data, configs, start=args.start, end=args.end, processes=args.processes,
+                    attributes=attributes, capital_base=args.capital, commission=args.commission, slippage=args.slippage)
+    writeResults(results, args.output)
+
+    for summary in results:
+        print("%s %s" % (summary["params"], " ".join("%s=%f" % (column, summary.get(column, 0.0)) for column in COLUMNS)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
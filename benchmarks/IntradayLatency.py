@@ -0,0 +1,76 @@
+import os
+import sys
+import argparse
+import logging
+import numpy
+import pandas
+
+from backtest.PriceData import PriceData
+from backtest.Harness import Backtest, Context, loadAlgorithm
+from backtest.BarAggregator import MINUTES_PER_SESSION
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ALGORITHMS = {"kalman1": os.path.join(ROOT, "part3", "KalmanFilter1.py"),
+              "kalman2": os.path.join(ROOT, "part3", "KalmanFilter2.py"),
+              "pairs": os.path.join(ROOT, "part1", "PairsAlgoPortfolio.py")}
+
+# The sids the algorithms hard code, which the synthetic universe has to include
+BASE_SIDS = [8554, 8347, 23112]
+
+
+def minuteBars(n_symbols, sessions, seed=0):
+    """ Synthetic 1 minute bars for n_symbols over sessions trading days of 390 minutes, as a PriceData. Prices are
+    geometric random walks, with every other symbol tracking its neighbour so pairs have something to trade. """
+    rng = numpy.random.RandomState(seed)
+    days = pandas.bdate_range("2015-01-05", periods=sessions)
+    minutes = pandas.timedelta_range("9:31:00", periods=MINUTES_PER_SESSION, freq="1min")
+    dates = numpy.array([day + minute for day in days for minute in minutes], dtype='datetime64[ns]')
+
+    returns = rng.normal(0, 0.0005, size=(len(dates), n_symbols))
+    followers = returns[:, 1::2]
+    followers[...] = returns[:, 0::2][:, :followers.shape[1]] + rng.normal(0, 0.0001, size=followers.shape)
+    prices = 50 * numpy.exp(numpy.cumsum(returns, axis=0))
+
+    sids = BASE_SIDS + list(range(100000, 100000 + n_symbols - len(BASE_SIDS)))
+    return PriceData(dates, sids, {"price": prices})
+
+
+def run(algorithm, prices, frequency="1m", warmupSessions=1, latencyBudget=None):
+    """ Backtest an algorithm over the bars after warmupSessions, trading every symbol. Returns the Backtest. """
+    backtest = Backtest(prices, frequency=frequency, latencyBudget=latencyBudget)
+    context = Context()
+    if algorithm == "pairs":
+        context.screenedPairs = list(zip(prices.sids[0::2], prices.sids[1::2]))
+    else:
+        context.extraSids = prices.sids[len(BASE_SIDS):]
+
+    start = prices.dates[MINUTES_PER_SESSION * warmupSessions]
+    backtest.run(loadAlgorithm(ALGORITHMS[algorithm], backtest.api()), start=start, context=context)
+    return backtest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per bar handle_data latency of the strategies on 1 minute bars")
+    parser.add_argument("--algorithm", choices=sorted(ALGORITHMS), action="append", help="algorithm(s) to time (defaults to all)")
+    parser.add_argument("--symbols", type=int, default=120)
+    parser.add_argument("--sessions", type=int, default=3, help="trading days of minute bars, the first one only warms up history")
+    parser.add_argument("--frequency", default="1m", help="bar size to run handle_data on")
+    parser.add_argument("--latency-budget", type=float, default=50.0, help="per bar budget in ms")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+
+    prices = minuteBars(args.symbols, args.sessions)
+    print("%d symbols, %d minute bars, handle_data on %s bars, budget %.1f ms" % (args.symbols, len(prices), args.frequency, args.latency_budget))
+    print("%-8s %8s %9s %9s %9s %9s %9s" % ("", "bars", "p50 ms", "p99 ms", "max ms", "bars/s", "over"))
+    for algorithm in args.algorithm or sorted(ALGORITHMS):
+        backtest = run(algorithm, prices, args.frequency, latencyBudget=args.latency_budget / 1000.0)
+        latencies = backtest.latencies * 1000
+        print("%-8s %8d %9.3f %9.3f %9.3f %9.0f %9d" % (algorithm, len(latencies), numpy.percentile(latencies, 50),
+                                                    numpy.percentile(latencies, 99), latencies.max(),
+                                                    len(latencies) / (latencies.sum() / 1000), backtest.overBudget))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+import sys
+import time
+import asyncio
+import argparse
+
+from backtest.Execution import AsyncExecution, FakeBroker
+
+
+def sequential(broker, orders):
+    """ The synchronous baseline: one connection, every order waiting for its acknowledgement and fills before the
+    next one goes out, like order() being a blocking call to the broker """
+    async def run():
+        connection = await broker.connect()
+        for (orderId, sid, amount) in orders:
+            (filled, delivery) = await connection.submit(orderId, sid, amount, lambda *fill: None)
+            await delivery
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+
+def fannedOut(broker, orders, poolSize, batch):
+    """ The orders sent batch at a time (e.g. one bar's worth) through an AsyncExecution, waiting for the fills of
+    each batch """
+    execution = AsyncExecution(broker, poolSize)
+    try:
+        for start in range(0, len(orders), batch):
+            execution.send(orders[start:start + batch])
+            execution.wait()
+        return len(execution.drain())
+    finally:
+        execution.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Orders per second through the asyncio execution layer against the fake broker")
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=2.0, help="simulated round-trip latency in ms")
+    parser.add_argument("--jitter", type=float, default=1.0, help="up to this many ms of extra latency")
+    parser.add_argument("--partial-fills", type=float, default=0.1)
+    parser.add_argument("--batch", type=int, default=200, help="orders per bar")
+    parser.add_argument("--pool", type=int, action="append", help="connection pool size(s) to try (defaults to 1, 8 and 64)")
+    parser.add_argument("--sequential-orders", type=int, default=200, help="orders for the much slower sequential baseline")
+    args = parser.parse_args(argv)
+
+    orders = [("%08d" % i, 8554, 100 if i % 2 else -100) for i in range(args.orders)]
+
+    def broker():
+        return FakeBroker(lambda sid: 50.0, latency=args.latency / 1000.0, jitter=args.jitter / 1000.0, partialFills=args.partial_fills)
+
+    print("%d orders, %.1f ms latency (+%.1f jitter), %d orders per bar" % (args.orders, args.latency, args.jitter, args.batch))
+    print("%-24s %12s %10s" % ("", "orders/s", "fills"))
+
+    began = time.perf_counter()
+    sequential(broker(), orders[:args.sequential_orders])
+    print("%-24s %12.0f %10s" % ("sequential", args.sequential_orders / (time.perf_counter() - began), ""))
+
+    for poolSize in args.pool or [1, 8, 64]:
+        began = time.perf_counter()
+        fills = fannedOut(broker(), orders, poolSize, args.batch)
+        print("%-24s %12.0f %10d" % ("async, %d connections" % poolSize, args.orders / (time.perf_counter() - began), fills))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import logging
+import tracemalloc
+import numpy
+import pandas
+
+from backtest.PriceData import PriceData
+from backtest.Harness import Backtest, Context, loadAlgorithm
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ALGORITHMS = {"pairs": os.path.join(ROOT, "part1", "PairsAlgoPortfolio.py"),
+              "forest": os.path.join(ROOT, "part2", "RandomForestPortfolio.py"),
+              "kalman1": os.path.join(ROOT, "part3", "KalmanFilter1.py"),
+              "kalman2": os.path.join(ROOT, "part3", "KalmanFilter2.py")}
+
+# The sids the algorithms hard code, which the synthetic universe has to include
+BASE_SIDS = [8554, 8347, 23112, 4283, 5885]
+
+# Bars of history in the synthetic daily data, enough for the forest's 5 years of training data
+HISTORY_DAYS = 1300
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def dailyBars(n_symbols, n_days, seed=0):
+    """ Synthetic daily bars for n_symbols, as a PriceData. Prices are geometric random walks, with every other symbol
+    tracking its neighbour so pairs have something to trade. """
+    rng = numpy.random.RandomState(seed)
+    returns = rng.normal(0, 0.01, size=(n_days, n_symbols))
+    followers = returns[:, 1::2]
+    followers[...] = returns[:, 0::2][:, :followers.shape[1]] + rng.normal(0, 0.002, size=followers.shape)
+    prices = 50 * numpy.exp(numpy.cumsum(returns, axis=0))
+
+    sids = BASE_SIDS + list(range(100000, 100000 + max(0, n_symbols - len(BASE_SIDS))))
+    return PriceData(pandas.bdate_range("2005-01-03", periods=n_days).values, sids[:n_symbols], {"price": prices})
+
+
+def randomWalk(length, seed=0):
+    return 50 * numpy.exp(numpy.cumsum(numpy.random.RandomState(seed).normal(0, 0.01, length)))
+
+
+def functions(name):
+    """ Namespace of an algorithm with just enough of the API for its helper functions to run outside a backtest """
+    return loadAlgorithm(ALGORITHMS[name], {"log": logging.getLogger("benchmark")})
+
+
+###
+### Cases: each takes its sweep parameters and returns (callable running one iteration, units of work per iteration)
+###
+
+def benchTestCoint(window):
+    test_coint = functions("pairs")["test_coint"]
+    x = randomWalk(window, 1)
+    y = x + numpy.random.RandomState(2).normal(0, 0.1, window)
+    return (lambda: test_coint(pair=(x, y)), 1)
+
+
+def benchRollingCointegration(pairs, window, bars=50):
+    namespace = functions("pairs")
+    engine = namespace["RollingCointegration"](pairs, window)
+    x = numpy.array([randomWalk(window * 2 + bars, i) for i in range(pairs)])
+    y = x + numpy.random.RandomState(pairs).normal(0, 0.1, x.shape)
+    seedBars = x.shape[1] - bars
+
+    def run():
+        engine.seed(x[:, :seedBars], y[:, :seedBars])
+        for t in range(seedBars, x.shape[1]):
+            engine.update(x[:, t], y[:, t])
+            engine.cointegrated()
+
+    return (run, bars)
+
+
+def forestContext(historicalDays):
+    context = Context()
+    context.params = {"stock": {"historicalDays": historicalDays, "predictionDays": 5, "percentChange": 0.02}}
+    return context
+
+
+def benchGenerateModelData(historicalDays, length=1250):
+    generateModelData = functions("forest")["generateModelData"]
+    (context, prices) = (forestContext(historicalDays), randomWalk(length))
+    return (lambda: generateModelData(context, "stock", prices), 1)
+
+
+def benchGeneratePercentChanges(length):
+    generatePercentChanges = functions("forest")["generatePercentChanges"]
+    prices = randomWalk(length)
+    return (lambda: generatePercentChanges(prices), 1)
+
+
+def benchProcessInput(window):
+    KalmanFilter = functions("kalman1")["KalmanFilter"]
+    prices = randomWalk(window + 1)
+    return (lambda: KalmanFilter(window + 1).processInput(prices), 1)
+
+
+def benchPykalmanFilter(window):
+    from pykalman import KalmanFilter
+    kf = KalmanFilter(initial_state_mean=0, n_dim_obs=1)
+    prices = randomWalk(window)
+    return (lambda: kf.filter(prices), 1)
+
+
+def benchHandleData(algorithm, symbols, models=None, window=None, bars=60):
+    """ Full handle_data bars of an algorithm trading symbols stocks (symbols / 2 pairs for the pairs algorithm)
+    with models historicalDays models per stock or a window_length of window """
+    prices = dailyBars(max(symbols, len(BASE_SIDS)), HISTORY_DAYS + bars)
+    overrides = {}
+    if models is not None:
+        overrides["historicalDays"] = [7, 15, 30, 60, 90][:models]
+    if window is not None:
+        overrides["window_length"] = window
+
+    def run():
+        backtest = Backtest(prices)
+        context = Context()
+        context.paramOverrides = overrides
+        if algorithm == "pairs":
+            context.screenedPairs = list(zip(prices.sids[0:symbols:2], prices.sids[1:symbols:2]))
+        elif algorithm != "forest":
+            context.extraSids = [s for s in prices.sids[:symbols] if s not in BASE_SIDS[:3]]
+        backtest.run(loadAlgorithm(ALGORITHMS[algorithm], backtest.api()), start=prices.dates[HISTORY_DAYS], context=context)
+        return backtest.latencies.sum()
+
+    return (run, bars)
+
+
+# (case name, function, sweep grid), and the smaller grid used with --quick
+CASES = [("test_coint", benchTestCoint, {"window": [60, 120, 250]}, {"window": [60]}),
+         ("RollingCointegration", benchRollingCointegration, {"pairs": [10, 100], "window": [14, 60]}, {"pairs": [10], "window": [14]}),
+         ("generateModelData", benchGenerateModelData, {"historicalDays": [10, 30, 60]}, {"historicalDays": [30]}),
+         ("generatePercentChanges", benchGeneratePercentChanges, {"length": [250, 1250, 5000]}, {"length": [1250]}),
+         ("KalmanFilter.processInput", benchProcessInput, {"window": [7, 30, 250]}, {"window": [30]}),
+         ("pykalman.filter", benchPykalmanFilter, {"window": [7, 30, 250]}, {"window": [30]}),
+         ("handle_data", benchHandleData,
+          [{"algorithm": ["kalman1", "kalman2"], "symbols": [3, 30, 120], "models": [1, 3]},
+           {"algorithm": ["pairs"], "symbols": [6, 30, 120], "window": [14, 30]},
+           {"algorithm": ["forest"], "symbols": [3]}],
+          [{"algorithm": ["kalman1", "kalman2"], "symbols": [30], "models": [3]},
+           {"algorithm": ["pairs"], "symbols": [30], "window": [14]}])]
+
+
+def configurations(grid):
+    """ Every combination of one grid, or of each of a list of grids """
+    for part in (grid if isinstance(grid, list) else [grid]):
+        names = sorted(part)
+        for values in itertools.product(*[part[name] for name in names]):
+            yield dict(zip(names, values))
+
+
+def measure(function, params, repeat, minTime=0.2):
+    """ Best throughput (units of work per second) over repeat rounds, each running the case for at least minTime
+    seconds, and the peak traced memory of one more iteration. A case whose iteration returns a number reports that
+    as its own timing (e.g. time spent in handle_data only). """
+    (run, units) = function(**params)
+    best = 0.0
+    for r in range(repeat):
+        (elapsed, done) = (0.0, 0)
+        while elapsed < minTime or done == 0:
+            began = time.perf_counter()
+            own = run()
+            spent = time.perf_counter() - began
+            elapsed += own if isinstance(own, float) else spent
+            done += units
+            if spent > minTime:
+                break
+        best = max(best, done / elapsed)
+
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"rate": best, "peak_kb": peak / 1024.0}
+
+
+def label(name, params):
+    return "%s[%s]" % (name, ",".join("%s=%s" % (key, params[key]) for key in sorted(params)))
+
+
+def compare(results, baseline, tolerance):
+    """ Lines comparing results with a baseline, and the labels that regressed: throughput down or peak memory up
+    by more than tolerance """
+    (lines, regressions) = ([], [])
+    for (key, result) in results.items():
+        if key not in baseline:
+            continue
+        rate = result["rate"] / baseline[key]["rate"]
+        memory = result["peak_kb"] / max(baseline[key]["peak_kb"], 1.0)
+        regressed = rate < 1 - tolerance or memory > 1 + tolerance
+        lines.append("%-62s rate x%.2f  memory x%.2f%s" % (key, rate, memory, "  REGRESSION" if regressed else ""))
+        if regressed:
+            regressions.append(key)
+    return (lines, regressions)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the strategies' hot functions and handle_data on synthetic prices")
+    parser.add_argument("--case", action="append", help="only run cases whose name starts with this")
+    parser.add_argument("--quick", action="store_true", help="one configuration per case")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", nargs="?", const=BASELINE, help="store the results as the baseline (defaults to benchmarks/baseline.json)")
+    parser.add_argument("--compare", nargs="?", const=BASELINE, help="compare with a stored baseline, exiting with 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.4, help="allowed fractional slowdown / memory growth (timings on a shared machine easily vary by 30%%)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    logging.getLogger("benchmark").setLevel(logging.WARNING)
+
+    results = {}
+    print("%-62s %14s %12s" % ("case", "units/s", "peak KB"))
+    for (name, function, grid, quickGrid) in CASES:
+        if args.case and not any(name.startswith(prefix) for prefix in args.case):
+            continue
+        for params in configurations(quickGrid if args.quick else grid):
+            key = label(name, params)
+            results[key] = measure(function, params, args.repeat)
+            print("%-62s %14.1f %12.1f" % (key, results[key]["rate"], results[key]["peak_kb"]))
+            sys.stdout.flush()
+
+    if args.save:
+        # Keep entries for cases that weren't run this time
+        stored = {}
+        if os.path.exists(args.save):
+            with open(args.save) as f:
+                stored = json.load(f)
+        stored.update(results)
+        with open(args.save, "w") as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            (lines, regressions) = compare(results, json.load(f), args.tolerance)
+        print("\n".join(lines))
+        if regressions:
+            print("%d regression(s) against %s" % (len(regressions), args.compare))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,7 @@
 import datetime as dt
 import statsmodels.tsa.stattools as ts
 import statsmodels.api as sm
+from statsmodels.tsa.adfvalues import mackinnoncrit
 import numpy as np
 
 
@@ -14,6 +15,272 @@ def test_coint(pair):
     result = ts.coint(pair[1], pair[0])
     return result[0] >= result[2][2]
 
+class RollingCointegration(object):
+    """ Incremental version of test_coint for a batch of pairs that share a window length. Gives the same decision
+    as statsmodels' coint (Engle-Granger with an AIC chosen ADF lag, 10% critical value), but keeps running sums
+    instead of refitting every regression from scratch each bar.
+
+    The hedge ratio OLS only needs sums of x, y, x^2, xy and y^2. The ADF regressions are all on the residual
+    e = y - a - b*x, which is linear in a vector u_t of raw lagged levels and differences, so their cross products
+    are T' (sum of u_t u_t') T for a small matrix T built from the current hedge ratio. The sums of u_t u_t' don't
+    depend on the hedge ratio and can be rolled forward one bar at a time. """
+
+    def __init__(self, n_pairs, window, refresh=None):
+        """ window - number of bars in the test, like the length of the series passed to test_coint.
+        refresh - recompute the running sums from scratch every this many bars to stop rounding error building up
+        (defaults to window) """
+        self.n_pairs = n_pairs
+        self.window = window
+        self.refresh = refresh or window
+
+        # Same lag search and critical value as adfuller / coint use for a series of this length
+        self.maxlag = min(window // 2 - 1, int(np.ceil(12.0 * np.power(window / 100.0, 1 / 4.0))))
+        self.crit = mackinnoncrit(N=2, regression="c", nobs=window - 1)[2]
+
+        # u_t = [y_{t-1}, x_{t-1}, 1, dy_t, dx_t, dy_{t-1}, dx_{t-1}, ..., dy_{t-maxlag}, dx_{t-maxlag}]
+        self.dim = 3 + 2 * (self.maxlag + 1)
+
+        # Last window + maxlag + 1 prices of each pair, most recent last (the extra bars feed the lagged differences)
+        self.size = window + self.maxlag + 1
+        self.x = np.zeros((n_pairs, self.size))
+        self.y = np.zeros((n_pairs, self.size))
+        self.updates = 0
+
+    def regressors(self, positions):
+        """ Build u_t for every pair at the given buffer positions, giving a (n_pairs x len(positions) x dim) array """
+        positions = np.asarray(positions)
+        u = np.empty((self.n_pairs, len(positions), self.dim))
+        u[:, :, 0] = self.y[:, positions - 1]
+        u[:, :, 1] = self.x[:, positions - 1]
+        u[:, :, 2] = 1.0
+        for j in range(self.maxlag + 1):
+            u[:, :, 3 + 2 * j] = self.y[:, positions - j] - self.y[:, positions - j - 1]
+            u[:, :, 4 + 2 * j] = self.x[:, positions - j] - self.x[:, positions - j - 1]
+        return u
+
+    def recompute(self):
+        """ Rebuild every running sum from the price buffers """
+        xw = self.x[:, -self.window:]
+        yw = self.y[:, -self.window:]
+        self.sums = np.array([xw.sum(axis=1), yw.sum(axis=1), (xw * xw).sum(axis=1), (xw * yw).sum(axis=1), (yw * yw).sum(axis=1)])
+
+        # The ADF regressions run over t = 1 .. window-1 of the window, and S[:, k-1] sums u_t u_t' over t >= k,
+        # for every start k = 1 .. maxlag+1 that the lag search or the final fit might use
+        u = self.regressors(np.arange(self.maxlag + 2, self.size))
+        products = u[:, :, :, np.newaxis] * u[:, :, np.newaxis, :]
+        suffix = np.cumsum(products[:, ::-1], axis=1)[:, ::-1]
+        self.S = suffix[:, :self.maxlag + 1].copy()
+        self.updates = 0
+
+    def seed(self, x, y):
+        """ Start off from (n_pairs x T) matrices of historical prices, most recent last, with T >= window + maxlag + 1 """
+        if x.shape[1] < self.size:
+            raise ValueError("Need at least %d bars of history to seed a %d bar cointegration test" % (self.size, self.window))
+        self.x[...] = x[:, -self.size:]
+        self.y[...] = y[:, -self.size:]
+        self.recompute()
+
+    def update(self, x, y):
+        """ Slide every pair's window forward by one bar, x and y - vectors of today's prices """
+        # Bars leaving the hedge ratio window, and the rows t = 1 .. maxlag+1 leaving the ADF sums
+        leaving = self.regressors(np.arange(self.maxlag + 2, 2 * self.maxlag + 3))
+        xOut = self.x[:, -self.window].copy()
+        yOut = self.y[:, -self.window].copy()
+
+        self.x[:, :-1] = self.x[:, 1:]
+        self.y[:, :-1] = self.y[:, 1:]
+        self.x[:, -1] = x
+        self.y[:, -1] = y
+
+        self.updates += 1
+        if self.updates >= self.refresh:
+            self.recompute()
+            return
+
+        self.sums += np.array([x - xOut, y - yOut, x * x - xOut * xOut, x * y - xOut * yOut, y * y - yOut * yOut])
+
+        entering = self.regressors([self.size - 1])[:, 0]
+        self.S += (entering[:, :, np.newaxis] * entering[:, np.newaxis, :])[:, np.newaxis]
+        self.S -= leaving[:, :, :, np.newaxis] * leaving[:, :, np.newaxis, :]
+
+    def tstat(self):
+        """ Engle-Granger ADF t-statistic of every pair, -inf where x and y are (almost) perfectly colinear or either
+        of them is flat """
+        n = float(self.window)
+        (Sx, Sy, Sxx, Sxy, Syy) = self.sums
+
+        # Hedge ratio and intercept of y on x, plus the R^2 that coint checks for colinearity
+        Sxxc = Sxx - Sx * Sx / n
+        Sxyc = Sxy - Sx * Sy / n
+        Syyc = Syy - Sy * Sy / n
+
+        # A price that doesn't move over the window (e.g. history padded out before the first bar of data) has no
+        # hedge ratio to speak of, so the pair is reported as not cointegrated instead of dividing by its variance
+        flat = (Sxxc <= np.sqrt(np.finfo(float).eps) * Sxx) | (Syyc <= np.sqrt(np.finfo(float).eps) * Syy)
+        Sxxc[flat] = 1.0
+        Syyc[flat] = 1.0
+        b = Sxyc / Sxxc
+        a = (Sy - b * Sx) / n
+        rsquared = b * Sxyc / Syyc
+
+        # Map u_t onto [e_{t-1}, de_t, de_{t-1}, ..., de_{t-maxlag}] for each pair's hedge ratio
+        T = np.zeros((self.n_pairs, self.dim, self.maxlag + 2))
+        T[:, 0, 0] = 1.0
+        T[:, 1, 0] = -b
+        T[:, 2, 0] = -a
+        for j in range(self.maxlag + 1):
+            T[:, 3 + 2 * j, 1 + j] = 1.0
+            T[:, 4 + 2 * j, 1 + j] = -b
+        G = np.matmul(np.matmul(T.transpose(0, 2, 1)[:, np.newaxis], self.S), T[:, np.newaxis])
+
+        def fit(moments, lags):
+            """ OLS of de_t on e_{t-1} and lags lagged differences, from cross products. Returns (coefs, pinv, SSR) """
+            cols = [0] + list(range(2, lags + 2))
+            ZZ = moments[:, cols][:, :, cols]
+            Zy = moments[:, cols, 1]
+            ZZinv = np.linalg.pinv(ZZ)
+            beta = np.einsum('pij,pj->pi', ZZinv, Zy)
+            # Clip at a tiny positive SSR, since an exact fit can come out fractionally negative from cross products
+            return (beta, ZZinv, np.maximum(moments[:, 1, 1] - (beta * Zy).sum(axis=1), np.finfo(float).tiny))
+
+        # Pick the lag with the smallest AIC, all fitted on the same sample of window-1-maxlag rows
+        nobs = n - 1 - self.maxlag
+        aic = np.empty((self.maxlag + 1, self.n_pairs))
+        for lags in range(self.maxlag + 1):
+            ssr = fit(G[:, self.maxlag], lags)[2]
+            aic[lags] = nobs * (np.log(2 * np.pi) + np.log(ssr / nobs) + 1) + 2 * (lags + 1)
+        bestlag = aic.argmin(axis=0)
+
+        # Refit with the chosen lag on the longest sample it allows and take the t-stat of e_{t-1}
+        tstat = np.empty(self.n_pairs)
+        for lags in np.unique(bestlag):
+            (beta, ZZinv, ssr) = fit(G[:, lags], lags)
+            dof = n - 1 - lags - (lags + 1)
+
+            # With no residual degrees of freedom the standard error is infinite, and statsmodels reports a t-stat of 0
+            if dof > 0:
+                variance = ssr / dof * ZZinv[:, 0, 0]
+                variance[flat] = 1.0
+                tstat[bestlag == lags] = (beta[:, 0] / np.sqrt(variance))[bestlag == lags]
+            else:
+                tstat[bestlag == lags] = 0.0
+
+        tstat[(rsquared >= 1 - 100 * np.sqrt(np.finfo(float).eps)) | flat] = -np.inf
+        return tstat
+
+    def cointegrated(self):
+        """ Same decision as test_coint, for every pair """
+        return self.tstat() >= self.crit
+
+
+class RollingSpreadStats(object):
+    """ Rolling mean and variance of every pair's spread over its own window length, the same numbers as np.mean /
+    np.std of the last window prices, kept up to date in O(1) per bar. Each bar adds the new spread and drops the
+    one leaving the window in a single windowed Welford step, so the cost doesn't grow with the window. """
+
+    def __init__(self, windows, refresh=None):
+        """ windows - window length of each pair.
+        refresh - recompute from the buffer every this many bars to stop rounding error building up (defaults to
+        the longest window) """
+        self.windows = np.asarray(windows, dtype=int)
+        self.n_pairs = len(self.windows)
+        # With no pairs everything below works on empty arrays, it only needs a nonzero buffer length
+        self.size = int(self.windows.max()) if self.n_pairs else 1
+        self.refresh = refresh or self.size
+        self.rows = np.arange(self.n_pairs)
+
+        # Ring buffer of the last size spreads per pair. Every spread is written twice, size apart, so the current
+        # window is always the contiguous view buffer[:, pos:pos + size], oldest first
+        self.buffer = np.zeros((self.n_pairs, 2 * self.size))
+        self.pos = 0
+
+        self.mean = np.zeros(self.n_pairs)
+        self.M2 = np.zeros(self.n_pairs)  # Sum of squared deviations from the mean
+        self.updates = 0
+
+    def recompute(self):
+        """ Rebuild the mean and sum of squares from the buffer """
+        window = self.buffer[:, self.pos:self.pos + self.size]
+        inWindow = np.arange(self.size) >= self.size - self.windows[:, np.newaxis]
+        self.mean = np.where(inWindow, window, 0.0).sum(axis=1) / self.windows
+        self.M2 = (np.where(inWindow, window - self.mean[:, np.newaxis], 0.0) ** 2).sum(axis=1)
+        self.updates = 0
+
+    def seed(self, spreads):
+        """ Start off from a (n_pairs x T) matrix of historical spreads, most recent last, with T >= the longest window """
+        if spreads.shape[1] < self.size:
+            raise ValueError("Need at least %d bars of history to seed the spread statistics" % self.size)
+        self.buffer[:, :self.size] = spreads[:, -self.size:]
+        self.buffer[:, self.size:] = spreads[:, -self.size:]
+        self.pos = 0
+        self.recompute()
+
+    def update(self, spread):
+        """ Slide every pair's window forward by one bar, spread - vector of today's spreads """
+        # Each pair's oldest spread, which leaves its window
+        leaving = self.buffer[self.rows, self.pos + self.size - self.windows]
+
+        self.buffer[:, self.pos] = spread
+        self.buffer[:, self.pos + self.size] = spread
+        self.pos = (self.pos + 1) % self.size
+
+        self.updates += 1
+        if self.updates >= self.refresh:
+            self.recompute()
+            return
+
+        oldMean = self.mean
+        self.mean = oldMean + (spread - leaving) / self.windows
+        self.M2 += (spread - leaving) * (spread - self.mean + leaving - oldMean)
+
+    def std(self):
+        """ Population standard deviation of every pair's window, like np.std """
+        return np.sqrt(np.maximum(self.M2, 0.0) / self.windows)
+
+
+class HedgeRatioKalmanFilter(object):
+    """ Matrix form of the part3 KalmanFilter, batched over pairs. Each pair has a 2-state filter tracking
+    y = slope * x + intercept, where the state follows a random walk with covariance Q * I and y is observed
+    with variance R. Every bar costs O(1) per pair, and all pairs advance together. The innovation of y against
+    the filter's prediction and its variance give a z-score without any rolling window. """
+
+    def __init__(self, n_pairs, init_xhat=0.0, init_P=1.0, Q=1e-4, R=1e-3):
+        """ Parameters can be scalars or one value per pair. init_xhat is the starting (slope, intercept) and init_P
+        the starting variance of each. """
+        self.n_pairs = n_pairs
+        self.Q = np.broadcast_to(np.asarray(Q, dtype=float), (n_pairs,))  # Process variance per pair
+        self.R = np.broadcast_to(np.asarray(R, dtype=float), (n_pairs,))  # Measurement variance per pair
+
+        # Aposteri estimate of (slope, intercept) and its error covariance, one per pair
+        self.xhat = np.empty((n_pairs, 2))
+        self.xhat[...] = init_xhat
+        self.P = np.eye(2) * np.broadcast_to(np.asarray(init_P, dtype=float), (n_pairs,))[:, np.newaxis, np.newaxis]
+
+        # Innovation of the last step and its variance
+        self.innovation = np.zeros(n_pairs)
+        self.innovationVar = np.ones(n_pairs)
+
+    def step(self, x, y):
+        """ Do one process and update step for every pair, x and y - vectors of today's prices """
+        H = np.stack([x, np.ones(self.n_pairs)], axis=1)
+
+        # time update
+        Pminus = self.P + self.Q[:, np.newaxis, np.newaxis] * np.eye(2)
+
+        # measurement update
+        PH = np.einsum('pij,pj->pi', Pminus, H)
+        self.innovationVar = (H * PH).sum(axis=1) + self.R
+        self.innovation = y - (H * self.xhat).sum(axis=1)
+        K = PH / self.innovationVar[:, np.newaxis]
+        self.xhat += K * self.innovation[:, np.newaxis]
+        self.P = Pminus - K[:, :, np.newaxis] * PH[:, np.newaxis, :]
+
+    def seed(self, x, y):
+        """ Run the filters over (n_pairs x T) matrices of historical prices, most recent last """
+        for k in range(x.shape[1]):
+            self.step(x[:, k], y[:, k])
+
+
 def initialize(context):
     # Initialize stock universe with the following stocks:  
     context.stocks = [
@@ -28,6 +295,14 @@ def initialize(context):
                     # (sid(8554), sid(2174))    # SPY and DIA 
                 ]
 
+    # When run locally through backtest.PairScreener, trade the pairs it found instead of the hand picked ones
+    if getattr(context, "screenedPairs", None):
+        context.stocks = [(sid(x), sid(y)) for (x, y) in context.screenedPairs]
+
+    # Every stock that appears in a pair, and its column in the history matrix
+    context.universe = sorted(set(stock for pair in context.stocks for stock in pair))
+    context.column = dict((stock, i) for (i, stock) in enumerate(context.universe))
+
 
     
     context.spreads = []  
@@ -37,36 +312,72 @@ def initialize(context):
     
     context.coint_window_length = 60
     
-    context.params = dict((pair, {"thresholdEnter": 2.0, "thresholdExit": 2.0, "window_length": 14, "stopLossOrder": False}) for pair in context.stocks)
+    # Bar size handle_data runs on: daily like Quantopian's daily backtests, or what the local harness runs on
+    # (e.g. '1m' minute bars, see backtest.Harness --frequency)
+    context.frequency = getattr(context, "barFrequency", '1d')
+    
+    context.params = dict((pair, {"thresholdEnter": 2.0, "thresholdExit": 2.0, "window_length": 14, "stopLossOrder": False,
+                                  "hedgeQ": 1e-4, "hedgeR": 1e-3}) for pair in context.stocks)
     
     #context.params[(sid(863), sid(25165))]["window_length"] = 14
     #context.params[(sid(863), sid(25165))]["thresholdExit"] = 2.0
     #context.params[(sid(863), sid(25165))]["stopLossOrder"] = True
     #context.params[(sid(1638), sid(1637))]["stopLossOrder"] = True
 
+    # Overrides from a local parameter sweep (see backtest.Sweep), applied to every pair
+    for params in context.params.values():
+        params.update(getattr(context, "paramOverrides", {}))
+
     context.wasCointegrated = dict((pair, False) for pair in context.stocks)
     context.cointegrated = dict((pair, False) for pair in context.stocks)
     context.invested = dict((pair, 0) for pair in context.stocks)
+
+    # Rolling cointegration tests, one batch per distinct window_length: window -> (pairs, RollingCointegration)
+    context.coint = {}
+    for window in set(context.params[pair]["window_length"] for pair in context.stocks):
+        pairs = [pair for pair in context.stocks if context.params[pair]["window_length"] == window]
+        context.coint[window] = (pairs, RollingCointegration(len(pairs), window))
+    context.cointSeeded = False
+
+    # Bars of history the first bar seeds from: the cointegration tests need maxlag + 1 bars on top of their window
+    context.historyBars = max([context.coint_window_length] + [engine.size for (pairs, engine) in context.coint.values()])
+
+    # Trade each pair's spread x - y against its rolling mean / sd over window_length (False), or track a dynamic
+    # hedge ratio with a kalman filter and trade on how far y is from the filter's prediction (True)
+    context.kalmanHedge = getattr(context, "kalmanHedge", False)
+    context.hedgeFilter = HedgeRatioKalmanFilter(len(context.stocks),
+                                                 Q=[context.params[pair]["hedgeQ"] for pair in context.stocks],
+                                                 R=[context.params[pair]["hedgeR"] for pair in context.stocks])
+    context.hedgeSeeded = False
+
+    # Rolling mean / sd of each pair's spread over its window_length
+    context.spreadStats = RollingSpreadStats([context.params[pair]["window_length"] for pair in context.stocks])
+    context.spreadSeeded = False
     
 
 def handle_data(context, data):
-    # Grab historical data on all stocks
-    historical_data = history(context.coint_window_length, '1d', 'price')
+    # Grab historical data on all stocks, as one (days x stocks) matrix laid out like context.universe
+    historical_data = history(context.historyBars, context.frequency, 'price')[context.universe].values
+
+    # Roll every pair's cointegration test forward to this bar
+    cointegrated = updateCointegration(context, data, historical_data)
+    if context.kalmanHedge:
+        updateHedgeRatios(context, data, historical_data)
+    else:
+        updateSpreadStats(context, data, historical_data)
+        spreadMeans = context.spreadStats.mean
+        spreadSDs = context.spreadStats.std()
 
     # Loop over all stocks in our portfolio
-    for pair in context.stocks:
+    for (i, pair) in enumerate(context.stocks):
         # Keep track of the current pair
         (context.currX, context.currY) = pair
 
         # Keep track of previous cointegrated state
         context.wasCointegrated[pair] = context.cointegrated
         
-        window_length = context.params[pair]["window_length"]
-        xTimeseries = historical_data[context.currX][-window_length:]
-        yTimeseries = historical_data[context.currY][-window_length:]
-
         # DEtermine if the pair is cointegrated at this point
-        context.cointegrated[pair] = test_coint(pair=(xTimeseries, yTimeseries))
+        context.cointegrated[pair] = cointegrated[pair]
         
         # Check if the pair is still cointegrated ...    
         if not context.cointegrated[pair]:
@@ -83,13 +394,20 @@ def handle_data(context, data):
         currXPrice = data[context.currX].price
         currYPrice = data[context.currY].price
         currRatio = currXPrice / currYPrice
-        currSpread = currXPrice - currYPrice
-        record(currSpread=currSpread)
 
-        # Historical spread from last window_size days, as well as the historical spread mean and sd
-        spread = xTimeseries - yTimeseries
-        spreadMean = np.mean(spread)
-        spreadSD = np.std(spread)
+        if context.kalmanHedge:
+            # How far y came in below the filter's prediction from x (positive when x is rich, like x - y), with
+            # the filter's innovation variance taking the place of the rolling statistics
+            currSpread = -context.hedgeFilter.innovation[i]
+            spreadMean = 0.0
+            spreadSD = np.sqrt(context.hedgeFilter.innovationVar[i])
+        else:
+            currSpread = currXPrice - currYPrice
+
+            # Historical spread mean and sd over the last window_length days, rolled forward above
+            spreadMean = spreadMeans[i]
+            spreadSD = spreadSDs[i]
+        record(currSpread=currSpread)
         record(spreadMeanPlus=spreadMean+(2.0*spreadSD))
         record(spreadMeanMinus=spreadMean-(2.0*spreadSD))
 
@@ -98,6 +416,48 @@ def handle_data(context, data):
         place_orders(context, data, currSpread, spreadMean, spreadSD)
 
 
+def updateCointegration(context, data, historical_data):
+    """ Feed today's prices to the rolling cointegration tests, starting them off from history on the first bar.
+    Returns a mapping of pair to the same decision test_coint would make on its last window_length bars. """
+    cointegrated = {}
+    for (pairs, engine) in context.coint.values():
+        xStocks = [x for (x, y) in pairs]
+        yStocks = [y for (x, y) in pairs]
+
+        if context.cointSeeded:
+            engine.update(np.array([data[x].price for x in xStocks]), np.array([data[y].price for y in yStocks]))
+        else:
+            engine.seed(historical_data[:, [context.column[x] for x in xStocks]].T, historical_data[:, [context.column[y] for y in yStocks]].T)
+
+        cointegrated.update(zip(pairs, engine.cointegrated()))
+
+    context.cointSeeded = True
+    return cointegrated
+
+
+def updateHedgeRatios(context, data, historical_data):
+    """ Advance every pair's hedge ratio filter by today's prices, running it over history on the first bar """
+    xColumns = [context.column[x] for (x, y) in context.stocks]
+    yColumns = [context.column[y] for (x, y) in context.stocks]
+
+    if context.hedgeSeeded:
+        context.hedgeFilter.step(np.array([data[x].price for (x, y) in context.stocks]), np.array([data[y].price for (x, y) in context.stocks]))
+    else:
+        context.hedgeFilter.seed(historical_data[:, xColumns].T, historical_data[:, yColumns].T)
+        context.hedgeSeeded = True
+
+
+def updateSpreadStats(context, data, historical_data):
+    """ Add today's spread x - y of every pair to its rolling statistics, starting them off from history on the first bar """
+    if context.spreadSeeded:
+        context.spreadStats.update(np.array([data[x].price - data[y].price for (x, y) in context.stocks]))
+    else:
+        xColumns = [context.column[x] for (x, y) in context.stocks]
+        yColumns = [context.column[y] for (x, y) in context.stocks]
+        context.spreadStats.seed((historical_data[:, xColumns] - historical_data[:, yColumns]).T)
+        context.spreadSeeded = True
+
+
 # def compute_zscore(context, data):  
 #     #spread = data[context.currX].price / data[context.currY].price
 #     spread = data[context.currX].price - data[context.currY].price  
@@ -117,7 +477,7 @@ def place_orders(context, data, currSpread, spreadMean, spreadSD):
     exitThreshold = context.params[pair]['thresholdExit']
     
     if currSpread >= spreadMean + enterThreshold * spreadSD and invested == 0:  
-        log.info("Condition 1: Shorting %s, Longing %s" % (context.currX, context.currY))
+        log.info("Condition 1: Shorting {}, Longing {}", context.currX, context.currY)
 
         context.params[pair].update({"transactionMean": spreadMean, "transactionSD": spreadSD})
 
@@ -133,7 +493,7 @@ def place_orders(context, data, currSpread, spreadMean, spreadSD):
         context.invested[pair] = 1  
     #elif zscore <= -context.zThreshold and context.invested == 0:
     elif currSpread <= spreadMean - enterThreshold * spreadSD and invested == 0:
-        log.info("Condition 2: Shorting %s, Longing %s" % (context.currY, context.currX))
+        log.info("Condition 2: Shorting {}, Longing {}", context.currY, context.currX)
 
         context.params[pair].update({"transactionMean": spreadMean, "transactionSD": spreadSD})
 
@@ -1,6 +1,158 @@
 from sklearn.ensemble import RandomForestClassifier
 from numpy import std, mean
+from numpy.lib.stride_tricks import as_strided
+import numpy
+import copy
+import weakref
+import multiprocessing
 from datetime import timedelta
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+
+class ModelScheduler(object):
+    """ Fits classifiers in a worker pool so a retrain never stalls handle_data. The caller keeps predicting with
+    the model it already has and swaps in the new one once ready() hands it back. With a cache (see
+    backtest.ModelCache) a model that was already fitted on the same stock, params and data is reused instead. """
+
+    def __init__(self, workers=None, processes=True, cache=None):
+        """ workers - size of the pool (defaults to one per core). processes - fit in worker processes, which
+        sidesteps the GIL, or in threads when False. Already running in a worker process, e.g. under backtest.Sweep
+        or backtest.MultiStrategy --workers, whose pool keeps the cores busy, fits go to a single thread: a process
+        pool forked from inside a forked worker can hang on exit. """
+        if multiprocessing.parent_process() is not None:
+            (workers, processes) = (1, False)
+        self.executor = ProcessPoolExecutor(workers) if processes else ThreadPoolExecutor(workers)
+        self.cache = cache
+        self.pending = {}
+        # The algorithm has no teardown, so the pool goes once the run's context drops the scheduler
+        self.finalizer = weakref.finalize(self, self.executor.shutdown, wait=False, cancel_futures=True)
+
+    def close(self):
+        """ Shut the pool down, abandoning any fit still pending """
+        self.pending = {}
+        self.finalizer()
+
+    def key(self, *parts):
+        """ Cache key for a model, or None without a cache """
+        return self.cache.key(*parts) if self.cache is not None else None
+
+    def submit(self, stock, trainingData, key=None, n_estimators=100, previous=None, newTrees=0):
+        """ Start fitting a new classifier for stock in the background. trainingData - callable returning
+        (trainingX, trainingY), only called when there is no cached model under key. With a previous model and
+        newTrees, grow it instead of starting over (see growForest), unless the training set has different classes """
+        cached = self.cache.get(key) if key is not None else None
+        if cached is not None:
+            future = Future()
+            future.set_result(cached)
+        else:
+            (trainingX, trainingY) = trainingData()
+            if previous is not None and newTrees and numpy.array_equal(numpy.unique(trainingY), previous.classes_):
+                clf = growForest(previous, n_estimators, newTrees)
+            else:
+                clf = RandomForestClassifier(n_estimators=n_estimators)
+            future = self.executor.submit(clf.fit, trainingX, trainingY)
+        self.pending[stock] = (future, key, cached is None)
+
+    def busy(self, stock):
+        return stock in self.pending
+
+    def ready(self, stock, wait=False):
+        """ Return stock's newly fitted classifier if its fit has finished (or block until it has when wait is
+        set), otherwise None """
+        if stock not in self.pending:
+            return None
+        (future, key, fitted) = self.pending[stock]
+        if not (wait or future.done()):
+            return None
+        del self.pending[stock]
+
+        model = future.result()
+        if fitted and key is not None:
+            self.cache.put(key, model)
+        return model
+
+
+def growForest(previous, n_estimators, newTrees):
+    """ Unfitted copy of a fitted forest that keeps all but its newTrees oldest trees, so fitting it (warm_start)
+    only grows newTrees fresh ones: a retrain costs newTrees / n_estimators of a full fit. previous is left as is,
+    so it can keep predicting until the new forest is ready. """
+    clf = copy.copy(previous)
+    clf.estimators_ = previous.estimators_[min(newTrees, len(previous.estimators_)):]
+    clf.set_params(warm_start=True, n_estimators=n_estimators)
+    return clf
+
+
+class TrainingWindow(object):
+    """ Walk-forward training set of one stock: the rows generateModelData builds from the last years*250 prices,
+    kept current by appending the rows for new bars and dropping the ones that fell out of the window instead of
+    rebuilding all of them. """
+
+    def __init__(self, trainingX, trainingY, bar):
+        """ bar - the bar count (context.bar) the training set is up to date with """
+        self.size = len(trainingY)
+        self.X = trainingX
+        self.y = trainingY
+        self.bar = bar
+
+    def advance(self, trainingX, trainingY, bar):
+        """ Add the rows for the bars since the last update, oldest first, and drop as many from the front """
+        self.X = numpy.concatenate([self.X, trainingX])[-self.size:]
+        self.y = numpy.concatenate([self.y, trainingY])[-self.size:]
+        self.bar = bar
+
+
+class ReturnStore(object):
+    """ Percent changes of every stock's price, computed once per bar as it arrives and shared by training and
+    prediction. Kept in a ring buffer of the last capacity bars, with every row written twice capacity rows apart,
+    so the last N changes of any stocks are always a zero-copy view whatever N is. """
+
+    def __init__(self, n_stocks, capacity):
+        self.capacity = capacity
+        self.buffer = numpy.full((2 * capacity, n_stocks), numpy.nan)
+        self.pos = 0
+        self.count = 0
+        self.lastPrices = None
+
+    def seed(self, prices):
+        """ Start off from a (bars x stocks) matrix of historical prices, oldest first """
+        prices = numpy.asarray(prices, dtype=numpy.float64)
+        for change in generatePercentChanges(prices)[-self.capacity:]:
+            self.append(change)
+        self.lastPrices = prices[-1].copy()
+
+    def update(self, prices):
+        """ Take the newest price of every stock """
+        prices = numpy.asarray(prices, dtype=numpy.float64)
+        self.append((prices - self.lastPrices) / self.lastPrices)
+        self.lastPrices = prices
+
+    def append(self, change):
+        self.buffer[self.pos] = change
+        self.buffer[self.pos + self.capacity] = change
+        self.pos = (self.pos + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def window(self, length, column=None):
+        """ View of the last length changes (fewer if there aren't that many yet), oldest first, for every stock or
+        just the one in column """
+        end = self.pos + self.capacity
+        view = self.buffer[end - min(length, self.count):end]
+        return view if column is None else view[:, column]
+
+
+class StockState(object):
+    """ Trading state of one stock. Open transactions are queued in the order they were made, which with a fixed
+    predictionDays per stock is also the order they come due in, so cleanup only ever looks at the front. """
+    __slots__ = ("warmup", "warmupedLast", "model", "transactions", "training")
+
+    def __init__(self):
+        self.warmup = True
+        self.warmupedLast = None
+        self.model = None
+        self.transactions = deque()  # (datetime, size) of every open transaction, oldest first
+        self.training = None         # TrainingWindow, when retraining walk-forward
+
 
 def initialize(context):    
     # Portfolio
@@ -24,7 +176,9 @@ def initialize(context):
                                     "historicalDays": 30,   # Number of days to look at in the past when coming up with training data (i.e. input size to the classifier)
                                     "predictionDays": 5,    # Number of days into the future we want to attempt to predict
                                     "percentChange": .02,   # How much does the value need to change to consider it a positive or negative training example?
-                                    "orderSize": 2000       # How much to order when we have some prediction we want to bet on
+                                    "orderSize": 2000,      # How much to order when we have some prediction we want to bet on
+                                    "retrainDays": 356,     # Retrain the model every this many days
+                                    "retrainTrees": 0       # Walk-forward retrains: replace only this many of the oldest trees, trained on the training set rolled forward (0 refits from scratch)
                                 }) for stock in context.stocks)
 
     # Custom params
@@ -38,46 +192,73 @@ def initialize(context):
     context.params[sid(5885)]["historicalDays"] = 10
     context.params[sid(5885)]["percentChange"] = .02
     
-    context.params[sid(4521)]["orderSize"] = 5000
-    context.params[sid(4521)]["percentChange"] = .015
+    # context.params[sid(4521)]["orderSize"] = 5000
+    # context.params[sid(4521)]["percentChange"] = .015
     
     # context.params[sid(21090)]["historicalDays"] = 60
     # context.params[sid(21090)]["percentChange"] = .02
     
-    # State per stock
-    context.state = { stock:{"warmup": True, "transactions": {}, "model": None} for stock in context.stocks }
+    # Overrides from a local parameter sweep (see backtest.Sweep), applied to every stock
+    for params in context.params.values():
+        params.update(getattr(context, "paramOverrides", {}))
+
+    # State per stock, indexed like context.stocks
+    context.state = [StockState() for stock in context.stocks]
+
+    # Models are (re)trained in the background. After warmup the yearly retrains are spread out retrainStagger days
+    # apart across stocks, and at most maxRetrainsPerBar are started on any one bar
+    context.scheduler = ModelScheduler(workers=None, processes=True, cache=getattr(context, "modelCache", None))
+    context.retrainStagger = min(context.params[stock]["retrainDays"] for stock in context.stocks) // len(context.stocks)
+    context.maxRetrainsPerBar = 1
+    context.bar = 0
+
+    # Stocks whose models take the same input shape, predicted together: (historicalDays, stocks, history columns)
+    context.predictionGroups = []
+    for historicalDays in sorted(set(context.params[stock]["historicalDays"] for stock in context.stocks)):
+        columns = [i for (i, stock) in enumerate(context.stocks) if context.params[stock]["historicalDays"] == historicalDays]
+        context.predictionGroups.append((historicalDays, [context.stocks[i] for i in columns], columns))
+    context.maxHistoricalDays = max(context.params[stock]["historicalDays"] for stock in context.stocks)
+
+    # Price changes of every stock, covering the longest training window, seeded from history on the first bar
+    context.returns = ReturnStore(len(context.stocks), max(context.params[stock]["years"] * 250 for stock in context.stocks) - 1)
 
 
 def handle_data(context, data):
-    # For each stock
-    for stock in context.stocks:
-        # Handle any transactions we should sell off to make some moola
-        transactionStart = data[stock].datetime - timedelta(days=context.params[stock]["predictionDays"])
-        for ts in context.state[stock]["transactions"]:
-            if not context.state[stock]["transactions"][ts]["done"] and ts <= transactionStart:
-                log.info("bp: cleanup")
-                order(stock, -context.state[stock]["transactions"][ts]["size"])
-                context.state[stock]["transactions"][ts]["done"] = True
+    # Count bars, so walk-forward retrains know how many new rows their training sets need
+    context.bar += 1
 
-        
-        # Train or retrain model on historical data
-        # For now, we do this once at the beginning but this should be re-done periodically
-        if context.state[stock]["warmup"] or  ("warmupedLast" in context.state[stock] and context.state[stock]["warmupedLast"] + timedelta(days=356) < data[stock].datetime):
-            # Create model form historical data
-            context.state[stock]["model"] = generateModel(context, stock)
+    # Today's price changes, the only ones that need computing after the first bar
+    if context.bar == 1:
+        context.returns.seed(history(bar_count=context.returns.capacity + 1, frequency='1d', field='price')[context.stocks].values)
+    else:
+        context.returns.update([data[stock].price for stock in context.stocks])
 
-            # Update state
-            context.state[stock]["warmup"] = False
-            context.state[stock]["warmupedLast"] = data[stock].datetime  
+    # Kick off any training or retraining that is due
+    scheduleModels(context, data)
 
-        
-        # Calculate input to the RandomForestClassifier, which is a vector of length context.historicalDays
-        # made up of reverse percent change
-        priceChanges = generatePercentChanges(history(bar_count=context.params[stock]["historicalDays"], frequency='1d', field='price')[stock])
-        #log.info("Price Changes: %s" % priceChanges)
+    # Swap in freshly trained models as soon as they are ready, until then keep using the previous ones
+    # (the very first model has nothing to fall back on, so wait for it)
+    for (i, stock) in enumerate(context.stocks):
+        newModel = context.scheduler.ready(stock, wait=context.state[i].model is None)
+        if newModel is not None:
+            context.state[i].model = newModel
+
+    # See what the models think is going to happen in context.predictionDays, for every stock at once
+    predictions = predictAll(context)
 
-        # Pass this to the model and see what the model thinks is going to happen in context.predictionDays
-        prediction = context.state[stock]["model"].predict(priceChanges)[0]
+    # For each stock
+    for (i, stock) in enumerate(context.stocks):
+        params = context.params[stock]
+        transactions = context.state[i].transactions
+        now = data[stock].datetime
+
+        # Handle any transactions we should sell off to make some moola, which are all at the front of the queue
+        transactionStart = now - timedelta(days=params["predictionDays"])
+        while transactions and transactions[0][0] <= transactionStart:
+            log.info("bp: cleanup")
+            order(stock, -transactions.popleft()[1])
+
+        prediction = predictions[stock]
         
         # Output to quantopian
         if stock in context.recordKeys:
@@ -86,75 +267,143 @@ def handle_data(context, data):
         # Trade based on the model output and keep track of it (so we can sell later to lock in profit)
         if prediction == 1:
             log.info("bp: predict up")
-            order(stock, context.params[stock]["orderSize"])
-            context.state[stock]["transactions"][data[stock].datetime] = {"size": context.params[stock]["orderSize"], "done": False}
+            order(stock, params["orderSize"])
+            transactions.append((now, params["orderSize"]))
         elif prediction == -1:
             log.info("bp: predict down")
             # Short the stock since we think it'll go down in value
-            order(stock, -context.params[stock]["orderSize"])
-            context.state[stock]["transactions"][data[stock].datetime] = {"size": -context.params[stock]["orderSize"], "done": False}
+            order(stock, -params["orderSize"])
+            transactions.append((now, -params["orderSize"]))
+
+
+
+
 
+def predictAll(context):
+    ''' Predict every stock from one history matrix. Each group of stocks sharing historicalDays gets its input vectors
+    (the price changes over the last historicalDays prices, straight from context.returns) gathered in one NumPy operation,
+    and each distinct model is run once over all of its rows. Returns a mapping of stock to prediction. '''
+    changes = context.returns.window(context.maxHistoricalDays - 1)
 
+    predictions = {}
+    for (historicalDays, stocks, columns) in context.predictionGroups:
+        inputs = numpy.ascontiguousarray(changes[-(historicalDays - 1):, columns].T, dtype=numpy.float32)
 
+        # Rows that share a model are predicted together
+        rowsByModel = {}
+        for (row, column) in enumerate(columns):
+            model = context.state[column].model
+            rowsByModel.setdefault(id(model), (model, []))[1].append(row)
 
+        for (model, rows) in rowsByModel.values():
+            for (row, prediction) in zip(rows, predictForest(model, inputs[rows])):
+                predictions[stocks[row]] = prediction
 
-def generateModel(context, stock):
-    ''' Function oversees how ot generate a RFC model for a given stock. '''
-    # Get the historical data for this stock
-    historical_data = history(bar_count=context.params[stock]["years"] * 250, frequency='1d', field='price')[stock]
+    return predictions
 
-    # Calculate reverse price changes vector from price column (input) and
-    #   calculate the actual movement context.predictionDays later (output)
-    (trainingX, trainingY) = generateModelData(context, stock, historical_data)
 
-    # Train the classifier on our training set
-    clf = RandomForestClassifier(n_estimators=100)
-    clf.fit(trainingX, trainingY)
-    return(clf)
+
+def predictForest(model, inputs):
+    ''' Same as model.predict(inputs) for a fitted RandomForestClassifier, but without the per call input validation and
+    job dispatch that dominate the cost of predicting a handful of rows. inputs must be contiguous float32. '''
+    proba = model.estimators_[0].predict_proba(inputs, check_input=False)
+    for tree in model.estimators_[1:]:
+        proba += tree.predict_proba(inputs, check_input=False)
+    return model.classes_.take(numpy.argmax(proba, axis=1))
+
+
+
+def scheduleModels(context, data):
+    ''' Start training every stock in warmup and retraining those whose model is a year old, all in the background. '''
+    retrains = 0
+    due = []
+    for (i, stock) in enumerate(context.stocks):
+        state = context.state[i]
+        if context.scheduler.busy(stock):
+            continue
+
+        # Train or retrain model on historical data, spreading the yearly retrains out so they don't all land on one bar
+        if state.warmup:
+            state.warmupedLast = data[stock].datetime - timedelta(days=i * context.retrainStagger)
+        elif state.warmupedLast + timedelta(days=context.params[stock]["retrainDays"]) < data[stock].datetime and retrains < context.maxRetrainsPerBar:
+            state.warmupedLast = data[stock].datetime
+            retrains += 1
+        else:
+            continue
+        state.warmup = False
+        due.append(i)
+
+    if not due:
+        return
+
+    # Get the historical data for every stock being trained with a single history call
+    prices = history(bar_count=max(context.params[context.stocks[i]]["years"] * 250 for i in due), frequency='1d', field='price')[context.stocks].values
+
+    for i in due:
+        stock = context.stocks[i]
+        params = context.params[stock]
+        state = context.state[i]
+        historical_data = prices[-params["years"] * 250:, i]
+        priceChanges = context.returns.window(len(historical_data) - 1, i)
+
+        # Walk-forward retrain: roll the training set forward by the rows for the bars since it was last updated, and
+        # grow the current forest on it
+        newBars = context.bar - state.training.bar if state.training is not None else None
+        if params["retrainTrees"] and state.model is not None and newBars is not None and newBars < state.training.size:
+            size = newBars + params["historicalDays"] + params["predictionDays"]
+            (newX, newY) = generateModelData(context, stock, historical_data[-size:], priceChanges[-(size - 1):])
+            state.training.advance(newX, newY, context.bar)
+            context.scheduler.submit(stock, lambda: (state.training.X, state.training.y),
+                                     previous=state.model, newTrees=params["retrainTrees"])
+            continue
+
+        # The model only depends on the stock, the params that shape its training set and the training window,
+        # so a model fitted on exactly those before can be pulled from the cache
+        key = context.scheduler.key(repr(stock), dict((name, params[name]) for name in ("years", "historicalDays", "predictionDays", "percentChange")), historical_data)
+        if params["retrainTrees"]:
+            # Keep the training set around to roll forward on later retrains
+            state.training = TrainingWindow(*generateModelData(context, stock, historical_data, priceChanges), bar=context.bar)
+            context.scheduler.submit(stock, lambda: (state.training.X, state.training.y), key)
+        else:
+            context.scheduler.submit(stock, lambda: generateModelData(context, stock, historical_data, priceChanges), key)
 
 
 
 def generatePercentChanges(prices):
     ''' Given a price vector, generate a vector of forward price changes. '''
-    priceChanges = []
+    prices = numpy.asarray(prices, dtype=numpy.float64)
 
     # Calculate the forward change in price for each pair of days
-    for i in range(len(prices)-1):
-        priceChanges.append((prices[i+1] - prices[i]) / prices[i])
+    return (prices[1:] - prices[:-1]) / prices[:-1]
 
-    return priceChanges
 
 
-
-def generateModelData(context, stock, historical_data):
+def generateModelData(context, stock, historical_data, priceChanges=None):
     ''' Given a stock and it's historical data, generate training examples. Each training example is made up of historicalDays
-    worth of price changes, and the output variable indicating whether or not the price increased (1), decreased (-1) or no change (0) '''
-    inputPriceChanges = []
-    outputPrediction = []
+    worth of price changes, and the output variable indicating whether or not the price increased (1), decreased (-1) or no change (0).
+    priceChanges - the price changes of historical_data if they are already known, e.g. a context.returns window '''
+    historicalDays = context.params[stock]["historicalDays"]
+    predictionDays = context.params[stock]["predictionDays"]
+    percentChange = context.params[stock]["percentChange"]
 
     # Generate price changes from historical prices
-    priceChanges = generatePercentChanges(historical_data)
-
-    for i in range(len(historical_data) - context.params[stock]["historicalDays"] - context.params[stock]["predictionDays"]):
-        # Generate the input training vector from the historicalDays and append to list of training samples
-        inputPriceChanges.append( list(priceChanges[i:i + context.params[stock]["historicalDays"] - 1]) )
-
-        # What is this training example's output? Check for a sufficient change in price in either direction
-        output = 0
-        if historical_data[i + context.params[stock]["historicalDays"] + context.params[stock]["predictionDays"]] > (1+context.params[stock]["percentChange"]) * historical_data[i + context.params[stock]["historicalDays"]]:
-            output = 1
-        elif historical_data[i + context.params[stock]["historicalDays"] + context.params[stock]["predictionDays"]] < (1-context.params[stock]["percentChange"]) *  historical_data[i + context.params[stock]["historicalDays"]]:
-            output = -1
-        outputPrediction.append( output )
-
-        # Debugging
-        if output != 0: 
-            pass
-            # log.info("Input tuple: % " % priceChanges[i:i + context.historicalDays - 1])
-            # log.info("Output val: %s" % output)
-            # log.info("currDay: %f" % historical_data[i + context.historicalDays + context.predictionDays])
-            # log.info("gt: %f" % ((1+context.percentChange) * historical_data[i + context.historicalDays]))
+    prices = numpy.asarray(historical_data, dtype=numpy.float64)
+    if priceChanges is None:
+        priceChanges = generatePercentChanges(prices)
+    rows = max(len(prices) - historicalDays - predictionDays, 0)
+
+    # Training vector i is priceChanges[i:i + historicalDays - 1]. Lay them all out as a zero-copy sliding window
+    # over priceChanges, then copy once into the contiguous float32 matrix the classifier trains on
+    windows = as_strided(priceChanges, shape=(rows, historicalDays - 1), strides=(priceChanges.strides[0], priceChanges.strides[0]))
+    inputPriceChanges = numpy.ascontiguousarray(windows, dtype=numpy.float32)
+
+    # What is each training example's output? Check for a sufficient change in price in either direction
+    currPrices = prices[historicalDays:historicalDays + rows]
+    futurePrices = prices[historicalDays + predictionDays:historicalDays + predictionDays + rows]
+    outputPrediction = numpy.zeros(rows, dtype=numpy.float32)
+    outputPrediction[futurePrices > (1+percentChange) * currPrices] = 1
+    outputPrediction[futurePrices < (1-percentChange) * currPrices] = -1
     
     # Return the training set
-    log.info("training: %s" % outputPrediction)
-    return (inputPriceChanges, outputPrediction)
\ No newline at end of file
+    log.info("training: {} examples, {} up, {} down", rows, numpy.count_nonzero(outputPrediction == 1), numpy.count_nonzero(outputPrediction == -1))
+    return (inputPriceChanges, outputPrediction)
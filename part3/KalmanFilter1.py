@@ -1,16 +1,35 @@
 import numpy
-import pandas
+from scipy.signal import lfilter
+
+
+def steadyStateGain(Q, R):
+    """ Solve the scalar Riccati equation M = M*R / (M + R) + Q for the steady state apriori error M, returning
+    the gain K = M / (M + R) the filter converges to. Works elementwise on arrays of Q / R. """
+    Q = numpy.asarray(Q, dtype=float)
+    R = numpy.asarray(R, dtype=float)
+    Pminus = (Q + numpy.sqrt(Q * Q + 4 * Q * R)) / 2
+    return Pminus / (Pminus + R)
+
 
 class KalmanFilter(object):
     """ Class that implements a kalman filter. Based off of http://wiki.scipy.org/Cookbook/KalmanFiltering. """
 
-    def __init__(self, size, init_xhat=0.0, init_P = 1.0, Q=1e-5, R=0.1**2):
+    def __init__(self, size, init_xhat=0.0, init_P = 1.0, Q=1e-5, R=0.1**2, steadyState=False):
         """ Init the kalman filter. Only needs to know the size of the input measurements. All other parameters
-        are set to the defaults in the reference implementation. """
+        are set to the defaults in the reference implementation. With steadyState the gain is fixed at its
+        converged value (init_P is ignored) and the filter is a plain exponential smoother. """
         self.size = size
 
         self.Q = Q                              # Process variance
         self.R = R                              # estimate of Measurement variance, change to see effect
+        self.steadyState = steadyState
+
+        if self.steadyState:
+            # Only the estimates are needed, the gain never changes
+            self.K = steadyStateGain(Q, R)
+            self.xhat = numpy.zeros(self.size)
+            self.xhat[0] = init_xhat
+            return
 
         # Pre-allocate space for arrays
         self.xhat = numpy.zeros(self.size)      # Aposteri estimate of x
@@ -25,6 +44,10 @@ class KalmanFilter(object):
 
     def processInput(self, z):
         """ z - input measurements, must be of length self.size """
+        if self.steadyState:
+            # xhat[k] = (1 - K) * xhat[k-1] + K * z[k], run as a first order IIR filter
+            (self.xhat[1:], zf) = lfilter([self.K], [1, self.K - 1], z[1:self.size], zi=[(1 - self.K) * self.xhat[0]])
+            return
 
         # For each input measurement, do a process and update step
         for k in range(1, self.size):
@@ -42,18 +65,241 @@ class KalmanFilter(object):
         return self.xhat[-1]
 
 
+class BatchKalmanFilter(object):
+    """ Vectorized version of KalmanFilter that runs a whole grid of scalar filters at once. State is held as
+    (n_stocks x n_windows) arrays so every filter is advanced with a single predict/update step. """
+
+    def __init__(self, shape, init_xhat=0.0, init_P=1.0, Q=1e-5, R=0.1**2, steadyState=False):
+        """ Init the batch of filters. Parameters can be scalars or anything that broadcasts to shape, e.g. a
+        (n_stocks x 1) column holding each stock's custom Q / R. With steadyState every filter runs at its
+        converged gain from the start (see steadyStateError for how far that is from the full recursion). """
+        self.shape = shape
+
+        self.Q = numpy.broadcast_to(numpy.asarray(Q, dtype=float), shape)  # Process variance per filter
+        self.R = numpy.broadcast_to(numpy.asarray(R, dtype=float), shape)  # Measurement variance per filter
+
+        self.steadyState = steadyState
+        self.K = steadyStateGain(self.Q, self.R)                         # Steady state gain per filter
+
+        # Current aposteri estimate of x and its error estimate, one per filter
+        self.xhat = numpy.empty(shape)
+        self.P = numpy.empty(shape)
+        self.reset(init_xhat, init_P)
+
+    def reset(self, init_xhat=0.0, init_P=1.0):
+        """ Put every filter back to its intial guesses """
+        self.init_xhat = numpy.broadcast_to(numpy.asarray(init_xhat, dtype=float), self.shape)
+        self.init_P = numpy.broadcast_to(numpy.asarray(init_P, dtype=float), self.shape)
+        self.xhat[...] = self.init_xhat
+        # The steady state aposteri error is (1 - K) * M = K * R
+        self.P[...] = self.K * self.R if self.steadyState else self.init_P
+
+    def step(self, z, active=None):
+        """ Do one process and update step for every filter. z - measurements, broadcastable to self.shape (a
+        column of today's prices per stock). active - optional boolean mask of filters that take this measurement. """
+        if self.steadyState:
+            # Fixed gain, the error estimate stays where it is
+            xhat = self.xhat + self.K * (z - self.xhat)
+            if active is None:
+                self.xhat[...] = xhat
+            else:
+                numpy.copyto(self.xhat, xhat, where=active)
+            return
+
+        # time update
+        xhatminus = self.xhat
+        Pminus = self.P + self.Q
+
+        # measurement update
+        K = Pminus / (Pminus + self.R)
+        xhat = xhatminus + K * (z - xhatminus)
+        P = (1 - K) * Pminus
+
+        if active is None:
+            self.xhat[...] = xhat
+            self.P[...] = P
+        else:
+            numpy.copyto(self.xhat, xhat, where=active)
+            numpy.copyto(self.P, P, where=active)
+
+    def processWindows(self, prices, windowSizes):
+        """ prices - (n_stocks x T) matrix of measurements, most recent in the last column.
+        windowSizes - (n_stocks x n_windows) integer matrix, 0 for unused slots.
+
+        A filter with window m consumes the last m prices of its row, which is exactly what
+        KalmanFilter(size=m+1).processInput(prices[-m-1:]) does for a single stock. """
+        windowSizes = numpy.asarray(windowSizes)
+        steps = int(windowSizes.max())
+        if self.steadyState:
+            self.filterWindows(prices[:, -steps:], windowSizes)
+            return
+
+        # Walk forward through time, only switching a filter on once its window starts
+        for k in range(steps):
+            self.step(prices[:, k - steps, numpy.newaxis], active=windowSizes >= steps - k)
+
+    def filterWindows(self, prices, windowSizes):
+        """ Steady state version of processWindows. Each distinct gain runs once over the full history of every
+        stock that uses it with lfilter, starting from 0. A filter started m prices from the end at x0 then ends at
+        y[T] - a**m * y[T - m] + a**m * x0, where a = 1 - K, so every window size falls out of the same pass. """
+        (n_stocks, steps) = prices.shape
+        xhat = self.xhat.copy()
+        for gain in numpy.unique(self.K):
+            usesGain = self.K == gain
+            rows = numpy.flatnonzero(usesGain.any(axis=1))
+
+            # Smoothed history with a leading 0 for windows that cover the whole of it
+            smoothed = numpy.zeros((len(rows), steps + 1))
+            smoothed[:, 1:] = lfilter([gain], [1, gain - 1], prices[rows], axis=1)
+
+            decay = (1 - gain) ** windowSizes[rows]
+            start = numpy.take_along_axis(smoothed, steps - windowSizes[rows], axis=1)
+            windowed = smoothed[:, -1:] - decay * start + decay * xhat[rows]
+            xhat[rows] = numpy.where(usesGain[rows], windowed, xhat[rows])
+
+        self.xhat[...] = xhat
+
+    def steadyStateError(self, prices, windowSizes):
+        """ Accuracy check of the steady state mode against the full recursion: replay the same windows both ways
+        from the initial guesses and return the (n_stocks x n_windows) relative difference of the estimates """
+        exact = BatchKalmanFilter(self.shape, self.init_xhat, self.init_P, self.Q, self.R)
+        exact.processWindows(prices, windowSizes)
+        steady = BatchKalmanFilter(self.shape, self.init_xhat, self.init_P, self.Q, self.R, steadyState=True)
+        steady.processWindows(prices, windowSizes)
+
+        scale = numpy.maximum(numpy.abs(exact.xhat), numpy.finfo(float).tiny)
+        return numpy.abs(steady.xhat - exact.xhat) / scale
+
+    def predict(self):
+        """ Return the (n_stocks x n_windows) matrix of current predictions """
+        return self.xhat
+
+
+class StreamingKalmanFilter(BatchKalmanFilter):
+    """ Persistent batch of kalman filters that is fed one new price per stock each bar instead of being rebuilt.
+
+    By default the filters stay warm and every update is O(1). With rolling=True only the last max(windowSizes)
+    prices are kept, and each filter reports what a fresh filter replayed over its window would predict. """
+
+    def __init__(self, windowSizes, init_xhat=0.0, init_P=1.0, Q=1e-5, R=0.1**2, rolling=False, cache=None,
+                 steadyState=False):
+        """ windowSizes - (n_stocks x n_windows) integer matrix, 0 for unused slots.
+        cache - optional backtest.ModelCache to keep the rolling window weights in across runs. """
+        self.windowSizes = numpy.asarray(windowSizes)
+        BatchKalmanFilter.__init__(self, self.windowSizes.shape, init_xhat, init_P, Q, R, steadyState)
+
+        self.rolling = rolling
+        if self.rolling:
+            self.size = int(self.windowSizes.max())
+
+            # Ring buffer of the last size prices per stock. Every price is written twice, size apart, so the
+            # current window is always the contiguous view buffer[:, pos:pos + size]
+            self.buffer = numpy.zeros((self.shape[0], 2 * self.size))
+            self.pos = 0
+
+            # Replaying a window is linear in its prices, with gains that don't depend on them
+            if cache is not None:
+                key = cache.key("StreamingKalmanFilter", self.windowSizes, init_xhat, init_P, self.Q, self.R, steadyState)
+                (self.weights, self.offsets) = cache.getOrCreate(key, lambda: self.windowWeights(init_xhat, init_P))
+            else:
+                (self.weights, self.offsets) = self.windowWeights(init_xhat, init_P)
+
+    def windowWeights(self, init_xhat, init_P):
+        """ Work out weights and offsets so a fresh filter over the last m prices ends at
+        offsets + weights.dot(window), for every window at once. weights is (n_stocks x n_windows x size),
+        right aligned so shorter windows have zeros over the older prices. """
+        if self.steadyState:
+            # Closed form: the price j bars back is weighted K * (1 - K)**j, the initial guess (1 - K)**m
+            lags = numpy.arange(self.size - 1, -1, -1)
+            weights = self.K[..., numpy.newaxis] * (1 - self.K[..., numpy.newaxis]) ** lags
+            weights[lags >= self.windowSizes[..., numpy.newaxis]] = 0.0
+            offsets = (1 - self.K) ** self.windowSizes * init_xhat
+            return (weights, offsets)
+
+        weights = numpy.zeros(self.shape + (self.size,))
+        offsets = numpy.empty(self.shape)
+        offsets[...] = init_xhat
+        P = numpy.empty(self.shape)
+        P[...] = init_P
+
+        # Same recursion as BatchKalmanFilter.step, carried out on the coefficients of each price
+        for k in range(self.size):
+            active = self.windowSizes >= self.size - k
+            Pminus = P + self.Q
+            K = Pminus / (Pminus + self.R)
+
+            weights[active] *= (1 - K[active])[:, numpy.newaxis]
+            weights[..., k][active] = K[active]
+            offsets[active] *= (1 - K[active])
+            P[active] = (1 - K[active]) * Pminus[active]
+
+        return (weights, offsets)
+
+    def seed(self, prices):
+        """ Start the filters off from a (n_stocks x T) matrix of historical prices, most recent last """
+        if self.rolling:
+            for k in range(self.size):
+                self.push(prices[:, k - self.size])
+        else:
+            self.processWindows(prices, self.windowSizes)
+
+    def push(self, z):
+        """ Write one price per stock into the ring buffer """
+        self.buffer[:, self.pos] = z
+        self.buffer[:, self.pos + self.size] = z
+        self.pos = (self.pos + 1) % self.size
+
+    def update(self, z):
+        """ Take today's price for every stock, z - vector of length n_stocks """
+        z = numpy.asarray(z, dtype=float)
+        if self.rolling:
+            self.push(z)
+            window = self.buffer[:, self.pos:self.pos + self.size]
+            self.xhat[...] = self.offsets + numpy.einsum('swk,sk->sw', self.weights, window)
+        else:
+            self.step(z[:, numpy.newaxis])
+
+
+def voteSignals(predictions, slots, prices, percentChange):
+    """ Majority vote of every stock's models: 1 where more than half of them predict at least a percentChange rise
+    on the current price, -1 where more than half predict that big a fall, else 0. predictions - (n_stocks x
+    n_models) matrix, slots - mask of the models in use, prices / percentChange - one value per stock """
+    votesForUp = ((predictions >= ((1 + percentChange) * prices)[:, None]) & slots).sum(axis=1)
+    votesForDown = ((predictions <= ((1 - percentChange) * prices)[:, None]) & slots).sum(axis=1)
+    majority = slots.sum(axis=1) / 2.0
+    return numpy.where(votesForUp > majority, 1, numpy.where(votesForDown > majority, -1, 0))
+
+
+def orderBatch(stocks, amounts, stop_prices=None):
+    """ Place one order per stock for every nonzero amount, in one call to the local backtester's order_batch
+    (see backtest.Harness), or one order() each where that doesn't exist, like on Quantopian """
+    if "order_batch" in globals():
+        return order_batch(stocks, amounts, stop_prices=stop_prices)
+    return [order(stock, amount, stop_price=stop_prices[i] if stop_prices is not None else None) if amount else None
+            for (i, (stock, amount)) in enumerate(zip(stocks, amounts))]
+
+
+def paramColumn(context, name):
+    """ Collect a per stock parameter into a (n_stocks x 1) column, ready to broadcast against a BatchKalmanFilter """
+    return numpy.array([[context.params[stock][name]] for stock in context.stocks], dtype=float)
+
+
 def initialize(context):
     # Portfolio
     context.stocks = [sid(8554), sid(8347), sid(23112)]
     # context.stocks = [sid(7784)]
     
+    # Extra stocks to trade on the default params when run locally, e.g. by benchmarks.IntradayLatency
+    context.stocks += [sid(s) for s in getattr(context, "extraSids", [])]
+    
     # Parameters for each kalman  filter
     context.params = { stock:{ "init_xhat": 0.0, 
                                 "init_P": 1.0, 
                                 "Q": 1e-5, 
                                 "R": 0.1**2, 
                                 "orderSize": 5000, 
-                                "percentChange": 0.02} for stock in context.stocks }
+                                "percentChange": 0.02,
+                                "historicalDays": [7, 15, 30]} for stock in context.stocks }
     
     # Custom params per stock
     context.params[ sid(8554) ]["historicalDays"] = [7, 15, 30]
@@ -66,110 +312,115 @@ def initialize(context):
     context.params[ sid(23112) ]["orderSize"] = 10000
     context.params[ sid(23112) ]["R"] = 0.05**2
 
+    # Overrides from a local parameter sweep (see backtest.Sweep), applied to every stock
+    for params in context.params.values():
+        params.update(getattr(context, "paramOverrides", {}))
+
+    # Bar size handle_data runs on: daily like Quantopian's daily backtests, or what the local harness runs on
+    # (e.g. '1m' minute bars, see backtest.Harness --frequency)
+    context.frequency = getattr(context, "barFrequency", '1d')
+
+    # Keep the filters warm across bars (False) or only look at the last historicalDays prices like a freshly
+    # built filter would (True)
+    context.rollingWindow = getattr(context, "rollingWindow", False)
+    
+    # Run every filter at its steady state gain instead of recomputing the gain each step. From init_P = 1 the gain
+    # takes far longer than historicalDays to settle, so the mode starts each filter at the steady state error K * R
+    # instead (unless a sweep overrides init_P), where the full recursion runs at that gain too. It is only used if
+    # the estimates on the first bar's history stay within steadyStateTolerance (relative) of the full recursion.
+    context.steadyState = getattr(context, "steadyState", False)
+    context.steadyStateTolerance = getattr(context, "steadyStateTolerance", 0.01)
+    if context.steadyState and "init_P" not in getattr(context, "paramOverrides", {}):
+        for params in context.params.values():
+            params["init_P"] = float(steadyStateGain(params["Q"], params["R"]) * params["R"])
+    
     
+    # Layout of the filters: one row per stock, one column per model declared in historicalDays (0 = unused slot)
+    context.windowSizes = numpy.zeros((len(context.stocks), max(len(context.params[stock]["historicalDays"]) for stock in context.stocks)), dtype=int)
+    for (i, stock) in enumerate(context.stocks):
+        context.windowSizes[i, :len(context.params[stock]["historicalDays"])] = context.params[stock]["historicalDays"]
     
-    # Mapping of stock to its list of filters
-    context.models = {} 
+    # Persistent kalman filters covering every stock and every model size, based on each stock's custom params.
+    # Row i holds the filters of context.stocks[i]
+    context.models = StreamingKalmanFilter(context.windowSizes, 
+                                           init_xhat=paramColumn(context, "init_xhat"), 
+                                           init_P=paramColumn(context, "init_P"),
+                                           Q=paramColumn(context, "Q"), 
+                                           R=paramColumn(context, "R"),
+                                           rolling=context.rollingWindow,
+                                           cache=getattr(context, "modelCache", None),
+                                           steadyState=context.steadyState)
+    context.seeded = False
     
-    # State variables for each kalman filter
-    context.order_info = { stock:None for stock in context.stocks }
-    context.correct = { stock:0 for stock in context.stocks }
-    context.total = { stock:0 for stock in context.stocks }
+    # Per stock vote threshold, as a vector for the vote over every stock at once
+    context.percentChange = paramColumn(context, "percentChange")[:, 0]
+    
+    # State for each stock, as a struct of arrays indexed like context.stocks: the direction of the open prediction
+    # (1 up, -1 down, 0 none), the price it was made at and the shares ordered on it, plus the running tally of
+    # right / total predictions
+    context.predicted = numpy.zeros(len(context.stocks), dtype=int)
+    context.predictedPrice = numpy.zeros(len(context.stocks))
+    context.predictedAmount = numpy.zeros(len(context.stocks), dtype=int)
+    context.correct = numpy.zeros(len(context.stocks), dtype=int)
+    context.total = numpy.zeros(len(context.stocks), dtype=int)
 
 def handle_data(context, data):
-    # For each stock in out portfolio
-    for stock in context.stocks:
-        
-        ###
-        ### Handle prediction / order from previous day
-        ###
-        #
-        # If there was a previous order ...             
-        if context.order_info[stock]:
-            # We should cash in and hopefully get some profit!
-            order(stock, -context.order_info[stock]["orderSize"].amount)
-            
-            # Update total number of times we made a predicition
-            context.total[stock] = context.total[stock] + 1
-            
-            # Update number of times we were right about the predicition
-            if data[stock].price > context.order_info[stock]["price"] and context.order_info[stock]["predict"] == "up":
-                log.info("Right boss!")
-                context.correct[stock] = context.correct[stock] + 1
-            elif data[stock].price < context.order_info[stock]["price"] and context.order_info[stock]["predict"] == "down":
-                log.info("Right boss!")
-                context.correct[stock] = context.correct[stock] + 1
-            else:
-                log.info("Sooooorry!")
-            
-            # Calculate current accuracy and plot
-            accuracy = context.correct[stock] / float(context.total[stock])
-            record(accuracy=accuracy, correct=context.correct[stock], total=context.total[stock])
-            log.info("Current accuracy for stock %s: %f" % (stock, accuracy))
-        
-
-
-        ###        
-        ### Determine what to do this day
-        ###
-        
-        # Grab the maximum number of historical days we need to start the kalman filters
-        historical_data = history(bar_count=max(context.params[stock]["historicalDays"]), frequency='1d', field='price')[stock]
-        
-        # Append today's price
-        df = pandas.DataFrame([{0: data[stock].price}])
-        historical_data = historical_data.append(df)
+    # Start the filters off from history on the first bar, after that they only need today's price
+    if not context.seeded:
+        historical_data = history(bar_count=context.windowSizes.max(), frequency=context.frequency, field='price')[context.stocks]
         
-        # For each model we want to train on this stock
-        predictions = []
-        for modelSize in context.params[stock]["historicalDays"]:
-            # Create a mapping of modelSize to model
-            # ie. a kalman filter that has mapSize input, which is declared in historicalDays param
-            context.models[stock] = {}
-
-            # Create a kalman filter on modelSize number of data, based on this stock's custom params
-            context.models[stock][modelSize] = KalmanFilter(size=modelSize + 1, 
-                                                        init_xhat=context.params[stock]["init_xhat"], 
-                                                        init_P=context.params[stock]["init_P"],
-                                                        Q=context.params[stock]["Q"],
-                                                        R=context.params[stock]["R"])
-
-            # Process modelSize inputs
-            context.models[stock][modelSize].processInput(historical_data[0][-modelSize-1:])
-            
-            # Get tomorrow's predicition
-            currPrediction = context.models[stock][modelSize].predict()
-            predictions.append(currPrediction)
-            #log.info("Prediciton: %f" % currPrediction) 
+        # Fall back to the full recursion if the steady state gain is too far off over these windows
+        if context.steadyState:
+            error = context.models.steadyStateError(historical_data.values.T, context.windowSizes)
+            if error.max() > context.steadyStateTolerance:
+                log.warn("Steady state kalman gain is off by up to {:f}, using the full recursion", error.max())
+                context.models = StreamingKalmanFilter(context.windowSizes, 
+                                                       init_xhat=paramColumn(context, "init_xhat"), 
+                                                       init_P=paramColumn(context, "init_P"),
+                                                       Q=paramColumn(context, "Q"), 
+                                                       R=paramColumn(context, "R"),
+                                                       rolling=context.rollingWindow,
+                                                       cache=getattr(context, "modelCache", None))
         
-        # How many of the models say we are going to increase or decrease in value?
-        votesForUp = sum([ prediction >= (1 + context.params[stock]["percentChange"]) * data[stock].price for prediction in predictions ])
-        votesForDown = sum([ prediction <= (1 - context.params[stock]["percentChange"]) * data[stock].price for prediction in predictions ])
-        #log.info("Votes for up: %d" % votesForUp) 
-        #log.info("Votes for down: %d" % votesForDown) 
-        
-        # IF we have majority saying Up, then ...
-        if votesForUp > len(context.params[stock]["historicalDays"]) / 2:
-            # Long the stock since we think it'll go down up value
-            log.info("bp: predict up")
-            # order(stock, context.params[stock]["orderSize"])
-            currOrder = order_percent(stock, 0.5)
-            currOrderObj = get_order(currOrder)
-            log.info(currOrderObj)
-            context.order_info[stock] = {"predict": "up", 
-                                         "price": data[stock].price,
-                                        "orderSize": currOrderObj}
-        # If we have majority saying Down, then ...
-        elif votesForDown > len(context.params[stock]["historicalDays"]) / 2:
-            # Short the stock since we think it'll go down in value
-            log.info("bp: predict down")
-            # order(stock, -context.params[stock]["orderSize"])
-            currOrder = order_percent(stock, -0.5)
-            currOrderObj = get_order(currOrder)
-            log.info(currOrderObj)
-            context.order_info[stock] = {"predict": "down", 
-                                         "price": data[stock].price,
-                                        "orderSize": currOrderObj}
-        # Otherwise, don't do a thing (make sure to indicate we did not make an order)
-        else:
-            context.order_info[stock] = None
\ No newline at end of file
+        context.models.seed(historical_data.values.T)
+        context.seeded = True
+    
+    # Advance every (stock, historicalDays) kalman filter by one step
+    prices = numpy.array([data[stock].price for stock in context.stocks])
+    context.models.update(prices)
+    context.predictions = context.models.predict()
+    
+    
+    ###
+    ### Handle predictions / orders from previous day
+    ###
+    
+    # Score every open prediction at once: right if the price moved the way we said
+    settled = context.predicted != 0
+    right = settled & ((prices - context.predictedPrice) * context.predicted > 0)
+    context.total += settled
+    context.correct += right
+    if settled.any():
+        # Quantopian keeps the last value recorded per name each bar, i.e. the last stock's
+        last = numpy.flatnonzero(settled)[-1]
+        record(accuracy=context.correct[last] / float(context.total[last]), correct=context.correct[last], total=context.total[last])
+        log.info("Right boss! on {}, sooooorry! on {}, overall accuracy {:f}", right.sum(), settled.sum() - right.sum(), context.correct.sum() / float(context.total.sum()))
+    
+    
+    ###
+    ### Determine what to do this day
+    ###
+    
+    # Majority vote of each stock's models on tomorrow's predicitions: long half the portfolio if up, short if down
+    signals = voteSignals(context.predictions, context.windowSizes > 0, prices, context.percentChange)
+    amounts = (signals * 0.5 * context.portfolio.portfolio_value / prices).astype(int)
+    
+    # One order per stock: cash in yesterday's position and take today's as a single diff of the two
+    orderBatch(context.stocks, amounts - numpy.where(settled, context.predictedAmount, 0))
+    if signals.any():
+        log.info("bp: predict up on {} stocks, predict down on {}", numpy.count_nonzero(signals > 0), numpy.count_nonzero(signals < 0))
+    
+    # Remember what we did (predicted 0 means we did not make an order)
+    context.predicted[:] = signals
+    context.predictedPrice[signals != 0] = prices[signals != 0]
+    context.predictedAmount[signals != 0] = amounts[signals != 0]
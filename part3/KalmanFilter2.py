@@ -1,23 +1,127 @@
 import numpy
-import pandas
+from collections import deque
 from pykalman import KalmanFilter
 
 
+class StreamingKalmanFilter(object):
+    """ Persistent wrapper around a pykalman KalmanFilter that takes one new measurement per bar instead of
+    refiltering the whole window. By default the filter stays warm and every update is an O(1) filter_update.
+    With window set, only the last window measurements are kept and the prediction is what filter() over them
+    would return. """
+
+    def __init__(self, window=None, initial_state_mean=0.0, initial_state_covariance=1.0, transition_covariance=1.0, observation_covariance=1.0, cache=None):
+        """ Defaults match what pykalman picks for a 1-d KalmanFilter(initial_state_mean=0, n_dim_obs=1).
+        cache - optional backtest.ModelCache to keep the rolling window weights in across runs. """
+        self.kf = KalmanFilter(initial_state_mean=initial_state_mean, 
+                               initial_state_covariance=initial_state_covariance,
+                               transition_covariance=transition_covariance,
+                               observation_covariance=observation_covariance,
+                               n_dim_obs=1)
+        self.window = window
+        self.transition_covariance = transition_covariance
+        self.observation_covariance = observation_covariance
+
+        if self.window:
+            self.measurements = deque(maxlen=self.window)
+            params = (self.window, initial_state_mean, initial_state_covariance, transition_covariance, observation_covariance)
+            if cache is not None:
+                (self.weights, self.offset) = cache.getOrCreate(cache.key("StreamingKalmanFilter", params), lambda: self.windowWeights(*params))
+            else:
+                (self.weights, self.offset) = self.windowWeights(*params)
+        else:
+            self.mean = None
+            self.covariance = None
+
+    def windowWeights(self, size, initial_state_mean, initial_state_covariance, transition_covariance, observation_covariance):
+        """ filter() is linear in the measurements and its gains don't depend on them, so the last filtered state
+        mean over a window can be worked out once as offset + weights.dot(window) """
+        weights = numpy.zeros(size)
+        offset = initial_state_mean
+        Ppred = initial_state_covariance
+        for k in range(size):
+            # pykalman updates on the first measurement straight from the initial state, then predicts
+            K = Ppred / (Ppred + observation_covariance)
+            weights *= (1 - K)
+            offset *= (1 - K)
+            weights[k] = K
+            Ppred = (1 - K) * Ppred + transition_covariance
+
+        return (weights, offset)
+
+    def seed(self, measurements):
+        """ Start the filter off from a vector of historical measurements """
+        if self.window:
+            self.measurements.extend(measurements)
+        else:
+            (filtered_state_means, filtered_state_covariances) = self.kf.filter(measurements)
+            self.mean = filtered_state_means[-1, 0]
+            self.covariance = filtered_state_covariances[-1, 0, 0]
+
+    def update(self, measurement):
+        """ Take the newest measurement """
+        if self.window:
+            self.measurements.append(measurement)
+        else:
+            # Same predict / correct step as self.kf.filter_update for this 1-d random walk, without pykalman's
+            # per call argument checking, which costs far more than the step itself on minute bars
+            Ppred = self.covariance + self.transition_covariance
+            K = Ppred / (Ppred + self.observation_covariance)
+            self.mean = self.mean + K * (measurement - self.mean)
+            self.covariance = (1 - K) * Ppred
+
+    def predict(self):
+        """ Return the current filtered state mean """
+        if self.window:
+            return self.offset + self.weights[-len(self.measurements):].dot(self.measurements)
+        return self.mean
+
+
+def voteSignals(predictions, slots, prices, percentChange):
+    """ Majority vote of every stock's models: 1 where more than half of them predict at least a percentChange rise
+    on the current price, -1 where more than half predict that big a fall, else 0. predictions - (n_stocks x
+    n_models) matrix, slots - mask of the models in use, prices / percentChange - one value per stock """
+    votesForUp = ((predictions >= ((1 + percentChange) * prices)[:, None]) & slots).sum(axis=1)
+    votesForDown = ((predictions <= ((1 - percentChange) * prices)[:, None]) & slots).sum(axis=1)
+    majority = slots.sum(axis=1) / 2.0
+    return numpy.where(votesForUp > majority, 1, numpy.where(votesForDown > majority, -1, 0))
+
+
+def orderBatch(stocks, amounts, stop_prices=None):
+    """ Place one order per stock for every nonzero amount, in one call to the local backtester's order_batch
+    (see backtest.Harness), or one order() each where that doesn't exist, like on Quantopian """
+    if "order_batch" in globals():
+        return order_batch(stocks, amounts, stop_prices=stop_prices)
+    return [order(stock, amount, stop_price=stop_prices[i] if stop_prices is not None else None) if amount else None
+            for (i, (stock, amount)) in enumerate(zip(stocks, amounts))]
+
+
 def initialize(context):
     # Portfolio
     context.stocks = [sid(8554), sid(8347), sid(23112)]
     # context.stocks = [sid(8554), sid(8347)]
     
+    # Extra stocks to trade on the default params when run locally, e.g. by benchmarks.IntradayLatency
+    context.stocks += [sid(s) for s in getattr(context, "extraSids", [])]
+    
     # Parameters for each kalman  filter
     context.params = { stock:{ "init_xhat": 0.0, 
                                 "init_P": 1.0, 
                                 "Q": 1e-5, 
                                 "R": 0.1**2, 
                                 "orderSize": 1000, 
-                                "percentChange": 0.0015} for stock in context.stocks }
+                                "percentChange": 0.0015,
+                                "historicalDays": [7]} for stock in context.stocks }
     
     context.stopLoss = False
     
+    # Bar size handle_data runs on: daily like Quantopian's daily backtests, or what the local harness runs on
+    # (e.g. '1m' minute bars, see backtest.Harness --frequency)
+    context.frequency = getattr(context, "barFrequency", '1d')
+    
+    # Keep the filters warm across bars (False) or only look at the last historicalDays prices like a freshly
+    # built filter would (True)
+    context.rollingWindow = getattr(context, "rollingWindow", False)
+    
     # Custom params per stock
     context.params[ sid(8554) ]["historicalDays"] = [7]
     context.params[ sid(8347) ]["historicalDays"] = [7]
@@ -29,120 +133,93 @@ def initialize(context):
     # context.params[ sid(23112) ]["orderSize"] = 10000
     # context.params[ sid(23112) ]["R"] = 0.05**2
 
+    # Overrides from a local parameter sweep (see backtest.Sweep), applied to every stock
+    for params in context.params.values():
+        params.update(getattr(context, "paramOverrides", {}))
+
     
     
     # Mapping of stock to its list of filters
     context.models = {} 
     
-    # State variables for each kalman filter
-    context.order_info = { stock:None for stock in context.stocks }
-    context.correct = { stock:0 for stock in context.stocks }
-    context.total = { stock:0 for stock in context.stocks }
+    # Predictions of every stock's filters, one row per stock and one column per model declared in historicalDays,
+    # slots masking the columns each stock actually uses
+    nModels = [len(context.params[stock]["historicalDays"]) for stock in context.stocks]
+    context.predictions = numpy.zeros((len(context.stocks), max(nModels)))
+    context.slots = numpy.arange(max(nModels)) < numpy.array(nModels)[:, None]
+    
+    # Per stock vote threshold and order size, as vectors for the vote and the orders over every stock at once
+    context.percentChange = numpy.array([context.params[stock]["percentChange"] for stock in context.stocks])
+    context.orderSize = numpy.array([context.params[stock]["orderSize"] for stock in context.stocks], dtype=int)
+    
+    # State for each stock, as a struct of arrays indexed like context.stocks: the direction of the open prediction
+    # (1 up, -1 down, 0 none), the price it was made at and the shares ordered on it, plus the running tally of
+    # right / total predictions
+    context.predicted = numpy.zeros(len(context.stocks), dtype=int)
+    context.predictedPrice = numpy.zeros(len(context.stocks))
+    context.predictedAmount = numpy.zeros(len(context.stocks), dtype=int)
+    context.correct = numpy.zeros(len(context.stocks), dtype=int)
+    context.total = numpy.zeros(len(context.stocks), dtype=int)
 
 def handle_data(context, data):
-    # For each stock in out portfolio
-    for stock in context.stocks:
-        
-        ###
-        ### Handle prediction / order from previous day
-        ###
- 
-        # If there was a previous order ...             
-        if context.order_info[stock]:
-            # We should cash in and hopefully get some profit!
-            order(stock, -context.order_info[stock]["order"].amount)
-            
-            # Update total number of times we made a predicition
-            context.total[stock] = context.total[stock] + 1
-            
-            # Update number of times we were right about the predicition
-            if data[stock].price > context.order_info[stock]["price"] and context.order_info[stock]["predict"] == "up":
-                log.info("Right boss!")
-                context.correct[stock] = context.correct[stock] + 1
-            elif data[stock].price < context.order_info[stock]["price"] and context.order_info[stock]["predict"] == "down":
-                log.info("Right boss!")
-                context.correct[stock] = context.correct[stock] + 1
-            else:
-                log.info("Sooooorry!")
-            
-            # Calculate current accuracy and plot
-            accuracy = context.correct[stock] / float(context.total[stock])
-            record(accuracy=accuracy, correct=context.correct[stock], total=context.total[stock])
-            log.info("Current accuracy for stock %s: %f" % (stock, accuracy))
-        
-
-
-        ###        
-        ### Determine what to do this day
-        ###
-        
-        # Grab the maximum number of historical days we need to start the kalman filters
-        historical_data = history(bar_count=max(context.params[stock]["historicalDays"]), frequency='1d', field='price')[stock]
-        
-        # Append today's price
-        df = pandas.DataFrame([{0: data[stock].price}])
-        historical_data = historical_data.append(df)
-        
-        # For each model we want to train on this stock
-        predictions = []
-        for modelSize in context.params[stock]["historicalDays"]:
-            # Create a mapping of modelSize to model
-            # ie. a kalman filter that has mapSize input, which is declared in historicalDays param
+    # Grab the maximum number of historical days we need to start the kalman filters, for every stock at once, on
+    # the first bar
+    if not context.models:
+        historical_data = history(bar_count=max(max(context.params[stock]["historicalDays"]) for stock in context.stocks), frequency=context.frequency, field='price')[context.stocks].values
+    
+    prices = numpy.array([data[stock].price for stock in context.stocks])
+    
+    
+    ###
+    ### Handle predictions / orders from previous day
+    ###
+    
+    # Score every open prediction at once: right if the price moved the way we said
+    settled = context.predicted != 0
+    right = settled & ((prices - context.predictedPrice) * context.predicted > 0)
+    context.total += settled
+    context.correct += right
+    if settled.any():
+        # Quantopian keeps the last value recorded per name each bar, i.e. the last stock's
+        last = numpy.flatnonzero(settled)[-1]
+        record(accuracy=context.correct[last] / float(context.total[last]), correct=context.correct[last], total=context.total[last])
+        log.info("Right boss! on {}, sooooorry! on {}, overall accuracy {:f}", right.sum(), settled.sum() - right.sum(), context.correct.sum() / float(context.total.sum()))
+    
+    
+    ###
+    ### Determine what to do this day
+    ###
+    
+    # Tomorrow's predicition from every (stock, modelSize) filter, one row per stock
+    for (i, stock) in enumerate(context.stocks):
+        # Create a mapping of modelSize to model on the first bar, ie. a persistent kalman filter for each modelSize
+        # declared in historicalDays, and start them off from history
+        if stock not in context.models:
             context.models[stock] = {}
-
-            # Create a kalman filter on modelSize number of data, based on this stock's custom params
-            context.models[stock][modelSize] = KalmanFilter(initial_state_mean=0, n_dim_obs=1)
-            
-            # Process modelSize inputs
-            measurements = numpy.asarray(historical_data[0][-modelSize-1:])
-            
-            # Get tomorrow's predicition
-            (filtered_state_means, filtered_state_covariances) = context.models[stock][modelSize].filter(measurements)
-            currPrediction = filtered_state_means[-1]
-            log.info("currPredicition: %s" % currPrediction)
-            log.info("currPrice: %s" % data[stock].price)
-
-            predictions.append(currPrediction)
-            #log.info("Prediciton: %f" % currPrediction) 
-        
-        # How many of the models say we are going to increase or decrease in value?
-        votesForUp = sum([ prediction >= (1 + context.params[stock]["percentChange"]) * data[stock].price for prediction in predictions ])
-        votesForDown = sum([ prediction <= (1 - context.params[stock]["percentChange"]) * data[stock].price for prediction in predictions ])
-        #log.info("Votes for up: %d" % votesForUp) 
-        #log.info("Votes for down: %d" % votesForDown) 
+            for modelSize in context.params[stock]["historicalDays"]:
+                context.models[stock][modelSize] = StreamingKalmanFilter(window=modelSize + 1 if context.rollingWindow else None,
+                                                                         cache=getattr(context, "modelCache", None))
+                context.models[stock][modelSize].seed(historical_data[-modelSize:, i])
         
-        # IF we have majority saying Up, then ...
-        if votesForUp > len(context.params[stock]["historicalDays"]) / 2:
-            # Long the stock since we think it'll go down up value
-            log.info("bp: predict up")
-            currOrder = order(stock, context.params[stock]["orderSize"])
-            # currOrder = order_target_percent(stock, 0.2)
-            
-            # Stop loss
-            if context.stopLoss:
-                order(stock, -context.params[stock]["orderSize"], stop_price = 0.95 * data[stock].price)
-            
-            currOrderObj = get_order(currOrder)
-            log.info(currOrderObj)
-            context.order_info[stock] = {"predict": "up", 
-                                         "price": data[stock].price,
-                                        "order": currOrderObj}
-        # If we have majority saying Down, then ...
-        elif votesForDown > len(context.params[stock]["historicalDays"]) / 2:
-            # Short the stock since we think it'll go down in value
-            log.info("bp: predict down")
-            currOrder = order(stock, -context.params[stock]["orderSize"])
-            #currOrder = order_target_percent(stock, -0.2)
-            
-            # Stop loss
-            if context.stopLoss:
-                order(stock, context.params[stock]["orderSize"], stop_price = 0.95 * data[stock].price)
-            
-            currOrderObj = get_order(currOrder)
-            log.info(currOrderObj)
-            context.order_info[stock] = {"predict": "down", 
-                                         "price": data[stock].price,
-                                        "order": currOrderObj}
-        # Otherwise, don't do a thing (make sure to indicate we did not make an order)
-        else:
-            context.order_info[stock] = None
\ No newline at end of file
+        # For each model on this stock, feed in today's price
+        for (j, modelSize) in enumerate(context.params[stock]["historicalDays"]):
+            context.models[stock][modelSize].update(prices[i])
+            context.predictions[i, j] = context.models[stock][modelSize].predict()
+    
+    # Majority vote of each stock's models, then go long / short orderSize shares
+    signals = voteSignals(context.predictions, context.slots, prices, context.percentChange)
+    amounts = signals * context.orderSize
+    
+    # One order per stock: cash in yesterday's position and take today's as a single diff of the two
+    orderBatch(context.stocks, amounts - numpy.where(settled, context.predictedAmount, 0))
+    if signals.any():
+        log.info("bp: predict up on {} stocks, predict down on {}", numpy.count_nonzero(signals > 0), numpy.count_nonzero(signals < 0))
+    
+    # Stop loss
+    if context.stopLoss and signals.any():
+        orderBatch(context.stocks, -amounts, stop_prices=0.95 * prices)
+    
+    # Remember what we did (predicted 0 means we did not make an order)
+    context.predicted[:] = signals
+    context.predictedPrice[signals != 0] = prices[signals != 0]
+    context.predictedAmount[signals != 0] = amounts[signals != 0]
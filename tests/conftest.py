@@ -0,0 +1,26 @@
+import os
+import sys
+import logging
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from backtest.Harness import loadAlgorithm
+from benchmarks.Suite import ALGORITHMS
+
+
+def algorithm(name, **api):
+    """ Namespace of one of the algorithms (see benchmarks.Suite.ALGORITHMS), with a log and any other API globals
+    given, for testing its helpers outside a backtest """
+    api.setdefault("log", logging.getLogger("test"))
+    return loadAlgorithm(ALGORITHMS[name], api)
+
+
+def writePriceFiles(prices, directory):
+    """ Write a PriceData out as one <sid>.csv per security, the layout backtest.PriceData.load reads """
+    for sid in prices.sids:
+        with open(os.path.join(str(directory), "%d.csv" % sid), "w") as f:
+            f.write("date,price\n")
+            for (date, price) in zip(prices.dates, prices.fields["price"][:, prices.column[sid]]):
+                f.write("%s,%r\n" % (str(date)[:10], float(price)))
+    return str(directory)
@@ -0,0 +1,59 @@
+import numpy
+import pandas
+
+from backtest.BarAggregator import BarAggregator, bucketIds, inferFrequency
+from backtest.Harness import Backtest
+from benchmarks.IntradayLatency import minuteBars
+
+
+FIELDS = ["open", "high", "low", "price", "volume"]
+
+
+def minuteFields(minutes=120, seed=0):
+    rng = numpy.random.RandomState(seed)
+    dates = (numpy.datetime64("2015-01-05T09:31") + numpy.arange(minutes).astype("timedelta64[m]")).astype("datetime64[ns]")
+    price = 50 + numpy.cumsum(rng.normal(0, 0.1, (minutes, 2)), axis=0)
+    bars = {"open": price - 0.05, "high": price + 0.1, "low": price - 0.1, "price": price, "volume": rng.randint(1, 100, (minutes, 2)).astype(float)}
+    bars["price"][7, 1] = numpy.nan
+    return (dates, bars)
+
+
+def resampled(dates, bars, frequency):
+    """ The coarser bars, built with a pandas groupby over the buckets """
+    buckets = bucketIds(dates, frequency)
+    rules = {"open": "first", "high": "max", "low": "min", "price": "last", "volume": "sum"}
+    return dict((field, numpy.stack([pandas.DataFrame(bars[field][:, column]).groupby(buckets)[0].agg(rules[field]).values
+                                     for column in range(2)], axis=1)) for field in FIELDS)
+
+
+def test_streamed_bars_match_a_groupby():
+    (dates, bars) = minuteFields()
+    buckets = bucketIds(dates, "5m")
+    expected = resampled(dates, bars, "5m")
+
+    streamed = BarAggregator("5m", 2, FIELDS, capacity=100)
+    batch = BarAggregator("5m", 2, FIELDS, capacity=100)
+    batch.extend(bars, dates, buckets)
+    for t in range(len(dates)):
+        streamed.append(dict((field, bars[field][t]) for field in FIELDS), dates[t], buckets[t])
+
+    for field in FIELDS:
+        assert numpy.allclose(streamed.window(100, field), expected[field], equal_nan=True)
+        assert numpy.allclose(batch.window(100, field), expected[field], equal_nan=True)
+    assert numpy.array_equal(streamed.windowDates(100), batch.windowDates(100))
+
+
+def test_backtest_runs_on_coarser_bars():
+    prices = minuteBars(3, 2)
+    assert inferFrequency(prices.dates) == "1m"
+    backtest = Backtest(prices, frequency="30m")
+    closes = []
+
+    def handle_data(context, data):
+        closes.append(backtest.history(2, "30m", "price").values[-1].copy())
+    backtest.run({"initialize": lambda context: None, "handle_data": handle_data})
+
+    # One handle_data per half hour from 9:30 to 16:00, seeing each bar's last minute (9:59 for the first)
+    assert len(closes) == 28
+    assert numpy.array_equal(closes[0], prices.fields["price"][28])
+    assert numpy.array_equal(closes[-1], prices.fields["price"][-1])
@@ -0,0 +1,47 @@
+import numpy
+import pytest
+
+from backtest.ColumnarStore import ingest
+from backtest.Harness import Backtest, Context, loadAlgorithm
+from backtest.PriceData import PriceData
+from benchmarks.Suite import ALGORITHMS, dailyBars
+from conftest import writePriceFiles
+
+
+@pytest.fixture(scope="module")
+def stores(tmp_path_factory):
+    """ The same prices read from csv files and from a columnar store ingested from them """
+    directory = tmp_path_factory.mktemp("prices")
+    writePriceFiles(dailyBars(8, 150), directory)
+    ingest(str(directory), str(directory / "store"))
+    return (PriceData.load(str(directory)), PriceData.load(str(directory / "store")))
+
+
+def test_store_holds_the_csv_prices(stores):
+    (csv, mapped) = stores
+    assert mapped.mapped
+    assert mapped.sids == csv.sids
+    assert numpy.array_equal(mapped.dates, csv.dates)
+    assert numpy.array_equal(mapped.fields["price"], csv.fields["price"])
+
+
+@pytest.mark.parametrize("name", ["pairs", "kalman1", "kalman2"])
+def test_backtests_match_the_csv_path_exactly(stores, name):
+    results = []
+    for prices in stores:
+        backtest = Backtest(prices)
+        context = Context()
+        context.screenedPairs = [(8554, 8347), (23112, 4283), (100000, 100001)]
+        results.append(backtest.run(loadAlgorithm(ALGORITHMS[name], backtest.api()), start=prices.dates[80], context=context))
+    assert numpy.array_equal(results[0], results[1])
+    assert len(set(results[0])) > 1
+
+
+def test_float32_store_is_close(stores, tmp_path):
+    (csv, mapped) = stores
+    directory = str(tmp_path / "prices")
+    writePriceFiles(csv, tmp_path)
+    ingest(str(tmp_path), directory, dtype="float32")
+    small = PriceData.load(directory)
+    assert small.fields["price"].dtype == numpy.float32
+    assert numpy.allclose(small.fields["price"], csv.fields["price"], rtol=1e-6)
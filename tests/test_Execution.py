@@ -0,0 +1,78 @@
+import numpy
+
+from backtest.Execution import AsyncExecution, FakeBroker, splitShares
+from backtest.Harness import Backtest, loadAlgorithm, main
+from benchmarks.Suite import ALGORITHMS, dailyBars
+from conftest import writePriceFiles
+
+
+def test_split_shares_adds_up():
+    for (amount, pieces) in [(10, 3), (-10, 3), (2, 5), (-1, 1)]:
+        parts = splitShares(amount, pieces)
+        assert sum(parts) == amount
+        assert all(part != 0 and (part > 0) == (amount > 0) for part in parts)
+        assert len(parts) <= pieces
+
+
+def test_fills_add_up_to_what_the_broker_acknowledged():
+    broker = FakeBroker(lambda sid: 50.0, latency=0.001, jitter=0.001, partialFills=0.5)
+    execution = AsyncExecution(broker, poolSize=4)
+    try:
+        orders = [("%08d" % i, 8554, 100 if i % 2 else -100) for i in range(40)]
+        filled = execution.send(orders)
+        execution.wait()
+        fills = execution.drain()
+    finally:
+        execution.close()
+
+    assert broker.connections == 4
+    assert any(filled[orderId] != amount for (orderId, sid, amount) in orders)
+    for (orderId, sid, amount) in orders:
+        assert sum(shares for (fillId, shares, price) in fills if fillId == orderId) == filled[orderId]
+    # Only the orders left partly filled are still tracked by the broker
+    assert set(broker.attempts) == set(orderId for (orderId, sid, amount) in orders if filled[orderId] != amount)
+
+
+def runKalman(prices, execution=None):
+    backtest = Backtest(prices, execution=execution)
+    if execution is not None:
+        execution.broker.priceOf = backtest.lastPrice
+    portfolioValues = backtest.run(loadAlgorithm(ALGORITHMS["kalman1"], backtest.api()), start=prices.dates[40])
+    return (backtest, portfolioValues)
+
+
+def test_broker_fills_match_the_direct_fills():
+    prices = dailyBars(3, 80)
+    (direct, expected) = runKalman(prices)
+    execution = AsyncExecution(FakeBroker(None, latency=0.0005), poolSize=4)
+    try:
+        (brokered, portfolioValues) = runKalman(prices, execution)
+    finally:
+        execution.close()
+    assert numpy.allclose(portfolioValues, expected, rtol=1e-12)
+    # The broker fills in pieces, so only the realised profit adds up the same
+    assert numpy.isclose(sum(brokered.closedTrades), sum(direct.closedTrades), rtol=1e-9)
+
+
+def test_partial_fills_stay_open_until_filled():
+    prices = dailyBars(3, 80)
+    execution = AsyncExecution(FakeBroker(None, latency=0.0005, partialFills=0.5), poolSize=4)
+    try:
+        (backtest, portfolioValues) = runKalman(prices, execution)
+    finally:
+        execution.close()
+
+    partial = [currOrder for currOrder in backtest.orders.values() if currOrder.dt != currOrder.created]
+    assert partial
+    for currOrder in backtest.orders.values():
+        assert (currOrder in backtest.openOrders) == (currOrder.filled != currOrder.amount)
+    # Shares held are what was filled
+    for security in backtest.securities:
+        held = sum(currOrder.filled for currOrder in backtest.orders.values() if currOrder.sid == security)
+        assert backtest.portfolio.positions[security].amount == held
+
+
+def test_command_line_broker(tmp_path, capsys):
+    dataPath = writePriceFiles(dailyBars(3, 80), tmp_path)
+    main([ALGORITHMS["kalman1"], "--data", dataPath, "--start", "2005-03-01", "--broker-latency", "0.5", "--partial-fills", "0.2"])
+    assert "sharpe: " in capsys.readouterr().out
@@ -0,0 +1,56 @@
+import numpy
+import pandas
+import pytest
+
+from backtest.Harness import Backtest, Context, loadAlgorithm
+from backtest.PriceData import PriceData
+from benchmarks.Suite import ALGORITHMS, dailyBars
+
+
+def linearPrices(n_days=10):
+    """ Two securities whose price goes up by 1 and 2 a day """
+    prices = 10.0 + numpy.arange(n_days, dtype=float)[:, None] * numpy.array([1.0, 2.0])
+    return PriceData(pandas.bdate_range("2010-01-04", periods=n_days).values, [1, 2], {"price": prices})
+
+
+def test_orders_fill_at_the_next_bars_price():
+    backtest = Backtest(linearPrices())
+
+    def handle_data(context, data):
+        if backtest.index == 2:
+            context.orderId = backtest.order(backtest.sid(1), 10)
+
+    portfolioValues = backtest.run({"initialize": lambda context: None, "handle_data": handle_data})
+    currOrder = backtest.get_order(backtest.context.orderId)
+    assert currOrder.filled == 10
+    assert backtest.transactions[0][3] == 13.0
+    assert portfolioValues[-1] == 100000 + 10 * (19.0 - 13.0)
+
+
+def test_history_returns_a_full_window_from_the_first_bar():
+    backtest = Backtest(linearPrices())
+    windows = []
+
+    def handle_data(context, data):
+        windows.append(backtest.history(5, '1d', 'price'))
+
+    backtest.run({"initialize": lambda context: None, "handle_data": handle_data})
+    assert [len(window) for window in windows] == [5] * 10
+
+    # Bars before the data starts repeat the first one
+    assert list(windows[1][backtest.sid(2)]) == [10.0, 10.0, 10.0, 10.0, 12.0]
+    assert windows[1].index[:3].isna().all()
+    assert list(windows[-1][backtest.sid(1)]) == [15.0, 16.0, 17.0, 18.0, 19.0]
+
+
+# The padded history is flat, which mustn't trip up the algorithms' statistics either
+@pytest.mark.filterwarnings("error::RuntimeWarning")
+@pytest.mark.parametrize("name", sorted(ALGORITHMS))
+def test_algorithms_run_from_the_first_data_bar(name):
+    prices = dailyBars(6, 60)
+    backtest = Backtest(prices)
+    context = Context()
+    context.screenedPairs = [(8554, 8347), (23112, 4283)]
+    portfolioValues = backtest.run(loadAlgorithm(ALGORITHMS[name], backtest.api()), context=context)
+    assert len(portfolioValues) == 60
+    assert numpy.isfinite(portfolioValues).all()
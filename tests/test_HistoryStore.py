@@ -0,0 +1,31 @@
+import numpy
+
+from backtest.HistoryStore import HistoryStore
+
+
+def test_windows_match_slicing_the_full_history():
+    rng = numpy.random.RandomState(0)
+    (bars, dates) = (rng.normal(size=(50, 3)), numpy.arange(50).astype('datetime64[D]').astype('datetime64[ns]'))
+    store = HistoryStore(3, ["price"], capacity=8)
+    store.extend({"price": bars[:5]}, dates[:5])
+    assert len(store) == 5
+    assert numpy.array_equal(store.window(8), bars[:5])
+
+    for t in range(5, 50):
+        store.append({"price": bars[t]}, dates[t])
+        for n in (1, 5, 8):
+            assert numpy.array_equal(store.window(n), bars[max(0, t + 1 - n):t + 1])
+            assert numpy.array_equal(store.windowDates(n), dates[max(0, t + 1 - n):t + 1])
+        assert numpy.array_equal(store.window(4, columns=[2, 0]), bars[t - 3:t + 1][:, [2, 0]])
+
+    # The window is a view of the buffer, not a copy
+    assert numpy.shares_memory(store.window(8), store.buffers["price"])
+
+
+def test_replace_overwrites_the_latest_bar():
+    store = HistoryStore(2, ["price", "volume"], capacity=3)
+    for t in range(4):
+        store.append({"price": [t, t], "volume": [10 * t, 10 * t]})
+    store.replace({"price": [9, 9], "volume": [90, 90]})
+    assert store.window(3).tolist() == [[1, 1], [2, 2], [9, 9]]
+    assert store.window(2, "volume").tolist() == [[20, 20], [90, 90]]
@@ -0,0 +1,200 @@
+import numpy
+
+from conftest import algorithm
+
+
+kalman = algorithm("kalman1")
+
+
+def randomWalks(n_stocks, length, seed=0):
+    return 50 * numpy.exp(numpy.cumsum(numpy.random.RandomState(seed).normal(0, 0.01, (n_stocks, length)), axis=1))
+
+
+def test_batch_filter_matches_scalar_filter():
+    prices = randomWalks(3, 40)
+    windowSizes = numpy.array([[7, 15, 30], [7, 10, 0], [7, 0, 0]])
+    R = numpy.array([[0.1 ** 2], [0.05 ** 2], [0.05 ** 2]])
+
+    batch = kalman["BatchKalmanFilter"](windowSizes.shape, init_xhat=0.0, init_P=1.0, Q=1e-5, R=R)
+    batch.processWindows(prices, windowSizes)
+
+    for (i, j) in zip(*numpy.nonzero(windowSizes)):
+        m = windowSizes[i, j]
+        single = kalman["KalmanFilter"](m + 1, init_xhat=0.0, init_P=1.0, Q=1e-5, R=R[i, 0])
+        single.processInput(prices[i, -m - 1:])
+        assert numpy.isclose(batch.predict()[i, j], single.predict(), rtol=1e-12)
+
+
+def scalarPrediction(prices, m, R):
+    """ What a freshly built KalmanFilter over the last m prices predicts, as KalmanFilter1 originally did every bar """
+    single = kalman["KalmanFilter"](m + 1, init_xhat=0.0, init_P=1.0, Q=1e-5, R=R)
+    single.processInput(prices[-m - 1:])
+    return single.predict()
+
+
+def test_streaming_filter_stays_warm():
+    prices = randomWalks(2, 60, seed=1)
+    windowSizes = numpy.array([[7, 15], [10, 0]])
+    models = kalman["StreamingKalmanFilter"](windowSizes, R=0.1 ** 2)
+    models.seed(prices[:, :40])
+    for t in range(40, 60):
+        models.update(prices[:, t])
+
+    # A warm filter has seen every price since its window started on the first bar
+    for (i, j) in zip(*numpy.nonzero(windowSizes)):
+        m = windowSizes[i, j] + 20
+        assert numpy.isclose(models.predict()[i, j], scalarPrediction(prices[i], m, 0.1 ** 2), rtol=1e-12)
+
+
+def test_rolling_streaming_filter_matches_refiltering():
+    prices = randomWalks(2, 60, seed=2)
+    windowSizes = numpy.array([[7, 15], [10, 0]])
+    models = kalman["StreamingKalmanFilter"](windowSizes, R=0.1 ** 2, rolling=True)
+    models.seed(prices[:, :40])
+    for t in range(40, 60):
+        models.update(prices[:, t])
+        for (i, j) in zip(*numpy.nonzero(windowSizes)):
+            expected = scalarPrediction(prices[i, :t + 1], windowSizes[i, j], 0.1 ** 2)
+            assert numpy.isclose(models.predict()[i, j], expected, rtol=1e-10)
+
+
+def steadyStateError(Q, R):
+    """ The aposteri error the filter settles at, K * R, so a filter started there runs at the steady state gain """
+    return kalman["steadyStateGain"](Q, R) * R
+
+
+def test_steady_state_mode_matches_a_settled_filter():
+    prices = randomWalks(2, 40, seed=3)
+    windowSizes = numpy.array([[7, 15, 30], [7, 10, 0]])
+    R = numpy.array([[0.1 ** 2], [0.05 ** 2]])
+    init_P = steadyStateError(1e-5, R)
+
+    steady = kalman["BatchKalmanFilter"](windowSizes.shape, init_xhat=50.0, init_P=init_P, R=R, steadyState=True)
+    assert steady.steadyStateError(prices, windowSizes).max() < 1e-12
+    # From the default init_P the gain is still far from settled after historicalDays steps
+    assert kalman["BatchKalmanFilter"](windowSizes.shape, R=R, steadyState=True).steadyStateError(prices, windowSizes).max() > 0.1
+
+    for rolling in (False, True):
+        (exact, fixed) = [kalman["StreamingKalmanFilter"](windowSizes, init_xhat=50.0, init_P=init_P, R=R, rolling=rolling, steadyState=steadyState)
+                          for steadyState in (False, True)]
+        for models in (exact, fixed):
+            models.seed(prices[:, :30])
+        for t in range(30, 40):
+            exact.update(prices[:, t])
+            fixed.update(prices[:, t])
+            assert numpy.allclose(fixed.predict(), exact.predict(), rtol=1e-10)
+
+
+def runSteadyState(overrides, **attributes):
+    """ Portfolio values and context of kalman1 in steady state mode on synthetic prices """
+    from backtest.Harness import Backtest, Context, loadAlgorithm
+    from benchmarks.Suite import ALGORITHMS, dailyBars
+
+    prices = dailyBars(3, 120)
+    backtest = Backtest(prices)
+    context = Context()
+    (context.paramOverrides, context.steadyState) = (overrides, True)
+    for (name, value) in attributes.items():
+        setattr(context, name, value)
+    values = backtest.run(loadAlgorithm(ALGORITHMS["kalman1"], backtest.api()), start=prices.dates[40], context=context)
+    assert backtest.transactions
+    return (values, context)
+
+
+def test_algorithm_runs_in_steady_state_mode():
+    overrides = {"init_xhat": 50.0, "percentChange": 0.002}
+    (steady, context) = runSteadyState(overrides)
+    assert context.models.steadyState
+    R = numpy.array([[0.1 ** 2], [0.05 ** 2], [0.05 ** 2]])
+    assert numpy.allclose(context.models.init_P, steadyStateError(1e-5, R), rtol=1e-12)
+
+    # Forcing the fallback runs the full recursion from the same initial guesses, which gives the same estimates
+    (exact, context) = runSteadyState(overrides, steadyStateTolerance=-1.0)
+    assert not context.models.steadyState
+    assert numpy.allclose(steady, exact, rtol=1e-12)
+
+
+def test_steady_state_mode_falls_back_when_off(caplog):
+    # A sweep's init_P = 1 is kept, and the steady state gain is too far off from there
+    with caplog.at_level("WARNING", "backtest"):
+        (values, context) = runSteadyState({"init_xhat": 50.0, "init_P": 1.0, "percentChange": 0.002})
+    assert not context.models.steadyState
+    assert numpy.all(context.models.init_P == 1.0)
+    assert any("using the full recursion" in message for message in caplog.messages)
+
+
+def test_prediction_tally_follows_the_price_moves():
+    from backtest.Harness import Backtest, loadAlgorithm
+    from benchmarks.Suite import ALGORITHMS, dailyBars
+
+    prices = dailyBars(3, 100)
+    backtest = Backtest(prices)
+    namespace = loadAlgorithm(ALGORITHMS["kalman1"], backtest.api())
+    voted = []
+    voteSignals = namespace["voteSignals"]
+    namespace["voteSignals"] = lambda predictions, slots, current, percentChange: \
+        voted.append((current.copy(), voteSignals(predictions, slots, current, percentChange))) or voted[-1][1]
+    backtest.run(namespace, start=prices.dates[40])
+
+    # Each prediction is settled on the next bar: right if the price moved the way it said
+    (correct, total) = (numpy.zeros(3, dtype=int), numpy.zeros(3, dtype=int))
+    for ((before, signals), (after, nextSignals)) in zip(voted, voted[1:]):
+        total += signals != 0
+        correct += (after - before) * signals > 0
+    assert total.sum() > 0
+    assert numpy.array_equal(backtest.context.total, total)
+    assert numpy.array_equal(backtest.context.correct, correct)
+
+
+def test_vote_matches_the_per_stock_vote():
+    rng = numpy.random.RandomState(4)
+    prices = 50 + rng.normal(0, 1, 20)
+    predictions = prices[:, None] * (1 + rng.normal(0, 0.05, (20, 3)))
+    nModels = rng.randint(1, 4, 20)
+    slots = numpy.arange(3) < nModels[:, None]
+    percentChange = numpy.full(20, 0.02)
+
+    signals = kalman["voteSignals"](predictions, slots, prices, percentChange)
+    for i in range(20):
+        models = predictions[i, :nModels[i]]
+        up = sum(prediction >= 1.02 * prices[i] for prediction in models)
+        down = sum(prediction <= 0.98 * prices[i] for prediction in models)
+        assert signals[i] == (1 if up > nModels[i] / 2 else -1 if down > nModels[i] / 2 else 0)
+    assert set(signals) == set([-1, 0, 1])
+
+
+def test_order_batch_falls_back_to_order():
+    placed = []
+    namespace = algorithm("kalman1", order=lambda stock, amount, stop_price=None: placed.append((stock, amount, stop_price)) or len(placed))
+    assert namespace["orderBatch"](["a", "b", "c"], [5, 0, -3], stop_prices=[1.0, 2.0, 3.0]) == [1, None, 2]
+    assert placed == [("a", 5, 1.0), ("c", -3, 3.0)]
+
+
+def test_algorithm_rolling_window_refilters_every_bar():
+    from backtest.Harness import Backtest, Context, loadAlgorithm
+    from benchmarks.Suite import ALGORITHMS, dailyBars
+
+    prices = dailyBars(3, 80)
+    backtest = Backtest(prices)
+    algorithm = loadAlgorithm(ALGORITHMS["kalman1"], backtest.api())
+    context = Context()
+    context.rollingWindow = True
+    R = {8554: 0.1 ** 2, 8347: 0.05 ** 2, 23112: 0.05 ** 2}
+    (start, bars) = (40, [])
+
+    def handle_data(context, data):
+        handle(context, data)
+
+        # The prices fed in: history on the first bar with that bar's price appended to it, as the original algorithm
+        # did, and every bar's price after that. Every model predicts what a fresh filter over its window of them would.
+        history = numpy.concatenate([prices.fields["price"][:start + 1], prices.fields["price"][start:backtest.index + 1]])
+        for (i, j) in zip(*numpy.nonzero(context.windowSizes)):
+            stock = context.stocks[i]
+            expected = scalarPrediction(history[:, prices.column[stock.sid]], context.windowSizes[i, j], R[stock.sid])
+            assert numpy.isclose(context.predictions[i, j], expected, rtol=1e-10)
+        bars.append(backtest.index)
+
+    (handle, algorithm["handle_data"]) = (algorithm["handle_data"], handle_data)
+    backtest.run(algorithm, start=prices.dates[start], context=context)
+    assert context.models.rolling
+    assert len(bars) == len(prices) - start
@@ -0,0 +1,61 @@
+import numpy
+from pykalman import KalmanFilter
+
+from conftest import algorithm
+
+
+kalman = algorithm("kalman2")
+
+
+def randomWalk(length, seed=0):
+    return 50 * numpy.exp(numpy.cumsum(numpy.random.RandomState(seed).normal(0, 0.01, length)))
+
+
+def test_streaming_filter_matches_pykalman_over_everything_seen():
+    prices = randomWalk(60)
+    model = kalman["StreamingKalmanFilter"]()
+    model.seed(prices[:7])
+    for price in prices[7:]:
+        model.update(price)
+
+    (means, covariances) = KalmanFilter(initial_state_mean=0, n_dim_obs=1).filter(prices)
+    assert numpy.isclose(model.predict(), means[-1, 0], rtol=1e-12)
+
+
+def test_rolling_streaming_filter_matches_pykalman_over_the_window():
+    prices = randomWalk(60, seed=1)
+    model = kalman["StreamingKalmanFilter"](window=8)
+    model.seed(prices[:8])
+    for t in range(8, 60):
+        model.update(prices[t])
+        (means, covariances) = KalmanFilter(initial_state_mean=0, n_dim_obs=1).filter(prices[t - 7:t + 1])
+        assert numpy.isclose(model.predict(), means[-1, 0], rtol=1e-10)
+
+
+def test_algorithm_rolling_window_refilters_every_bar():
+    from backtest.Harness import Backtest, Context, loadAlgorithm
+    from benchmarks.Suite import ALGORITHMS, dailyBars
+
+    prices = dailyBars(3, 60)
+    backtest = Backtest(prices)
+    algorithm = loadAlgorithm(ALGORITHMS["kalman2"], backtest.api())
+    context = Context()
+    context.rollingWindow = True
+    (start, bars) = (30, [])
+
+    def handle_data(context, data):
+        handle(context, data)
+
+        # The prices fed in: history on the first bar with that bar's price appended to it, as the original algorithm
+        # did, and every bar's price after that. Every model predicts what a fresh filter over its window of them would.
+        history = numpy.concatenate([prices.fields["price"][:start + 1], prices.fields["price"][start:backtest.index + 1]])
+        for (i, stock) in enumerate(context.stocks):
+            for (j, modelSize) in enumerate(context.params[stock]["historicalDays"]):
+                window = history[-modelSize - 1:, prices.column[stock.sid]]
+                (means, covariances) = KalmanFilter(initial_state_mean=0, n_dim_obs=1).filter(window)
+                assert numpy.isclose(context.predictions[i, j], means[-1, 0], rtol=1e-10)
+        bars.append(backtest.index)
+
+    (handle, algorithm["handle_data"]) = (algorithm["handle_data"], handle_data)
+    backtest.run(algorithm, start=prices.dates[start], context=context)
+    assert len(bars) == len(prices) - start
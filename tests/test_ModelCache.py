@@ -0,0 +1,39 @@
+import os
+import numpy
+
+from backtest.ModelCache import ModelCache
+
+
+def test_key_depends_on_every_part():
+    window = numpy.arange(10.0)
+    key = ModelCache.key("8554", {"years": 5, "historicalDays": 30}, window)
+    assert key == ModelCache.key("8554", {"historicalDays": 30, "years": 5}, window.copy())
+    assert key != ModelCache.key("8554", {"years": 5, "historicalDays": 31}, window)
+    assert key != ModelCache.key("8554", {"years": 5, "historicalDays": 30}, window.astype(numpy.float32))
+    assert key != ModelCache.key("8347", {"years": 5, "historicalDays": 30}, window)
+
+
+def test_entries_round_trip(tmp_path):
+    cache = ModelCache(str(tmp_path))
+    assert cache.get("missing") is None
+    cache.put("key", {"weights": numpy.ones(3)})
+    assert "key" in cache
+    assert numpy.array_equal(cache.get("key")["weights"], numpy.ones(3))
+
+    built = []
+    assert cache.getOrCreate("other", lambda: built.append(1) or 5) == 5
+    assert cache.getOrCreate("other", lambda: built.append(1) or 6) == 5
+    assert built == [1]
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ModelCache(str(tmp_path), maxBytes=10 ** 9)
+    for (age, name) in enumerate(["old", "used", "new"]):
+        cache.put(name, numpy.zeros(1000))
+        os.utime(cache.path(name), (1000 + age, 1000 + age))
+    # A hit makes an entry the most recently used one
+    cache.get("old")
+
+    cache.maxBytes = 2 * os.path.getsize(cache.path("new"))
+    cache.evict()
+    assert "old" in cache and "new" in cache and "used" not in cache
@@ -0,0 +1,47 @@
+import sys
+import subprocess
+import numpy
+
+from backtest.MultiStrategy import MultiStrategy
+from benchmarks.Suite import ALGORITHMS, dailyBars
+from conftest import ROOT, writePriceFiles
+
+
+def test_workers_run_the_forest_alongside_another_strategy(tmp_path):
+    # The forest's ModelScheduler runs inside a worker process here, which used to hang on a nested process pool
+    dataPath = writePriceFiles(dailyBars(6, 1320), tmp_path)
+    result = subprocess.run([sys.executable, "-m", "backtest.MultiStrategy", ALGORITHMS["forest"], ALGORITHMS["kalman1"],
+                             "--data", dataPath, "--start", "2009-12-01", "--workers", "2"],
+                            cwd=ROOT, capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr
+    assert "RandomForestPortfolio: " in result.stdout
+    assert "KalmanFilter1: " in result.stdout
+
+
+def strategies():
+    return [("kalman1", ALGORITHMS["kalman1"], 2.0, None), ("kalman2", ALGORITHMS["kalman2"], 1.0, None)]
+
+
+def test_strategies_trade_as_they_would_alone():
+    from backtest.Harness import Backtest, loadAlgorithm
+
+    prices = dailyBars(5, 120)
+    runner = MultiStrategy(prices, strategies())
+    runner.run(start=prices.dates[40])
+    for strategy in runner.strategies:
+        backtest = Backtest(prices, capital_base=strategy.capital_base)
+        alone = backtest.run(loadAlgorithm(strategy.path, backtest.api()), start=prices.dates[40])
+        assert numpy.allclose(strategy.portfolioValues, alone, rtol=1e-12)
+
+
+def test_workers_give_the_same_portfolio():
+    prices = dailyBars(5, 120)
+    together = MultiStrategy(prices, strategies())
+    together.run(start=prices.dates[40])
+    split = MultiStrategy(prices, strategies(), workers=2)
+    split.run(start=prices.dates[40])
+
+    assert numpy.allclose(split.portfolioValues, together.portfolioValues, rtol=1e-12)
+    assert split.grossShares == together.grossShares
+    for (a, b) in zip(split.strategies, together.strategies):
+        assert numpy.allclose(a.portfolioValues, b.portfolioValues, rtol=1e-12)
@@ -0,0 +1,64 @@
+import logging
+import numpy
+import pandas
+
+from backtest.Harness import AlgorithmLog, main
+from backtest.Output import RecordWriter, readRecords
+from benchmarks.Suite import ALGORITHMS, dailyBars
+from conftest import writePriceFiles
+
+
+def test_records_round_trip_across_chunks(tmp_path):
+    path = str(tmp_path / "records.bin")
+    writer = RecordWriter(path, chunkRows=3)
+    dates = pandas.bdate_range("2010-01-04", periods=8).values
+    for (i, date) in enumerate(dates):
+        writer.record(date, {"a": i})
+        writer.record(date, {"a": 10 * i})
+        if i >= 4:
+            writer.record(date, {"b": -i})
+    writer.close()
+
+    records = readRecords(path)
+    assert numpy.array_equal(records.index.values, dates)
+    assert list(records["a"]) == [10.0 * i for i in range(8)]
+    assert numpy.isnan(records["b"].values[:4]).all()
+    assert list(records["b"].values[4:]) == [-4.0, -5.0, -6.0, -7.0]
+
+
+class Clock(object):
+    def currentDatetime(self):
+        return "2010-01-04"
+
+
+class Unprintable(object):
+    def __format__(self, spec):
+        raise AssertionError("formatted below the logger's level")
+
+
+def test_log_formats_like_logbook(caplog):
+    log = AlgorithmLog(Clock(), logging.getLogger("test.log"))
+    with caplog.at_level(logging.INFO, "test.log"):
+        log.info("bp: predict up on {} stocks, accuracy {:f}", 3, 0.5)
+        log.info("100% sure {}")
+        log.debug("not shown {}", Unprintable())
+    assert caplog.messages == ["2010-01-04 bp: predict up on 3 stocks, accuracy 0.500000", "2010-01-04 100% sure {}"]
+
+
+def test_streaming_outputs_from_the_command_line(tmp_path, capsys):
+    prices = dailyBars(3, 100)
+    dataPath = writePriceFiles(prices, tmp_path)
+    (recordsPath, logPath) = (str(tmp_path / "records.bin"), str(tmp_path / "algo.log"))
+    main([ALGORITHMS["kalman1"], "--data", dataPath, "--start", "2005-03-01", "--records", recordsPath, "--log-file", logPath])
+    logger = logging.getLogger("backtest")
+    (logger.handlers, logger.propagate) = ([], True)
+    logger.setLevel(logging.NOTSET)
+    assert "sharpe" in capsys.readouterr().out
+
+    records = readRecords(recordsPath)
+    assert len(records) > 0
+    assert ((records["accuracy"] >= 0) & (records["accuracy"] <= 1)).all()
+    with open(logPath) as f:
+        lines = f.read().splitlines()
+    assert any("overall accuracy" in line for line in lines)
+    assert not any("{" in line or "%" in line for line in lines)
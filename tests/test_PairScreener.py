@@ -0,0 +1,15 @@
+import itertools
+
+from backtest.PairScreener import screenPairs
+from benchmarks.Suite import dailyBars
+from conftest import algorithm
+
+
+def test_screened_pairs_match_a_serial_screen():
+    prices = dailyBars(12, 200)
+    test_coint = algorithm("pairs")["test_coint"]
+    window = prices.fields["price"][-60:]
+
+    expected = [(prices.sids[x], prices.sids[y]) for (x, y) in itertools.combinations(range(12), 2)
+                if test_coint((window[:, x], window[:, y]))]
+    assert screenPairs(prices, window=60, minCorrelation=-1.0, processes=2, chunksize=5) == expected
@@ -0,0 +1,129 @@
+import numpy
+import pytest
+import statsmodels.tsa.stattools as ts
+
+from conftest import ALGORITHMS, algorithm
+
+
+pairs = algorithm("pairs")
+
+
+def pairPrices(n_pairs, length, seed=0):
+    """ (n_pairs x length) x and y prices, y tracking x more loosely the further down the rows """
+    rng = numpy.random.RandomState(seed)
+    x = 50 * numpy.exp(numpy.cumsum(rng.normal(0, 0.01, (n_pairs, length)), axis=1))
+    noise = numpy.cumsum(rng.normal(0, 0.2, (n_pairs, length)), axis=1) * numpy.linspace(0, 1, n_pairs)[:, None]
+    y = 0.8 * x + 5 + rng.normal(0, 0.3, (n_pairs, length)) + noise
+    return (x, y)
+
+
+def test_rolling_cointegration_matches_coint():
+    (x, y) = pairPrices(6, 150)
+    window = 60
+    engine = pairs["RollingCointegration"](6, window, refresh=25)
+    engine.seed(x[:, :engine.size], y[:, :engine.size])
+
+    decisions = set()
+    for t in range(engine.size, 150):
+        engine.update(x[:, t], y[:, t])
+        (tstat, cointegrated) = (engine.tstat(), engine.cointegrated())
+        for p in range(6):
+            (xw, yw) = (x[p, t + 1 - window:t + 1], y[p, t + 1 - window:t + 1])
+            assert numpy.isclose(tstat[p], ts.coint(yw, xw)[0], rtol=1e-6)
+            assert cointegrated[p] == pairs["test_coint"]((xw, yw))
+            decisions.add(cointegrated[p])
+
+    # Both decisions came up, so the test covers the critical value too
+    assert decisions == set([True, False])
+
+
+@pytest.mark.filterwarnings("error::RuntimeWarning")
+def test_rolling_cointegration_flat_prices_are_not_cointegrated():
+    (x, y) = pairPrices(3, 80, seed=4)
+    # A flat x, a flat y and both flat, like history padded out before the first bar of data
+    x[0] = x[0, 0]
+    y[1] = y[1, 0]
+    (x[2], y[2]) = (x[2, 0], y[2, 0])
+    engine = pairs["RollingCointegration"](3, 30)
+    engine.seed(x[:, :60], y[:, :60])
+    assert (engine.tstat() == -numpy.inf).all()
+    assert not engine.cointegrated().any()
+
+    # Once the prices move again the test picks back up
+    engine.seed(*pairPrices(3, 80, seed=4))
+    assert numpy.isfinite(engine.tstat()).all()
+
+
+def test_hedge_ratio_filter_matches_pykalman():
+    from pykalman import KalmanFilter
+
+    (x, y) = pairPrices(3, 80, seed=1)
+    (Q, R) = (numpy.array([1e-4, 1e-3, 1e-5]), numpy.array([1e-3, 1e-2, 1e-3]))
+    hedge = pairs["HedgeRatioKalmanFilter"](3, Q=Q, R=R)
+    hedge.seed(x[:, :60], y[:, :60])
+    for t in range(60, 80):
+        hedge.step(x[:, t], y[:, t])
+
+    for p in range(3):
+        # pykalman updates on the first observation straight from the initial state, so start it one (masked) step back
+        H = numpy.stack([numpy.concatenate([[0.0], x[p]]), numpy.ones(81)], axis=1)[:, numpy.newaxis, :]
+        kf = KalmanFilter(transition_matrices=numpy.eye(2), observation_matrices=H,
+                          transition_covariance=Q[p] * numpy.eye(2), observation_covariance=R[p],
+                          initial_state_mean=numpy.zeros(2), initial_state_covariance=numpy.eye(2))
+        (means, covariances) = kf.filter(numpy.ma.masked_invalid(numpy.concatenate([[numpy.nan], y[p]])))
+        assert numpy.allclose(hedge.xhat[p], means[-1], rtol=1e-8)
+
+
+def test_rolling_spread_stats_match_numpy():
+    spreads = numpy.cumsum(numpy.random.RandomState(2).normal(0, 1, (3, 200)), axis=1) + 1000
+    windows = [5, 14, 30]
+    stats = pairs["RollingSpreadStats"](windows, refresh=50)
+    stats.seed(spreads[:, :40])
+    for t in range(40, 200):
+        stats.update(spreads[:, t])
+        for (p, window) in enumerate(windows):
+            recent = spreads[p, t + 1 - window:t + 1]
+            assert numpy.isclose(stats.mean[p], numpy.mean(recent), rtol=1e-12)
+            assert numpy.isclose(stats.std()[p], numpy.std(recent), rtol=1e-8)
+
+
+def test_rolling_spread_stats_without_pairs():
+    stats = pairs["RollingSpreadStats"]([])
+    stats.seed(numpy.zeros((0, 10)))
+    stats.update(numpy.zeros(0))
+    assert stats.std().shape == (0,)
+
+
+def test_kalman_hedge_mode_trades_on_the_filter_innovation():
+    from backtest.Harness import Backtest, Context, loadAlgorithm
+    from benchmarks.Suite import dailyBars
+
+    prices = dailyBars(6, 300)
+    backtest = Backtest(prices)
+    api = backtest.api()
+    (spreads, orders) = ([], [])
+
+    def record(**values):
+        # The spread and bands handle_data records for the pair it is on, next to the filter's state at the time
+        i = context.stocks.index((context.currX, context.currY))
+        if "currSpread" in values:
+            spreads.append((values["currSpread"], -context.hedgeFilter.innovation[i]))
+        elif "spreadMeanPlus" in values:
+            spreads.append((values["spreadMeanPlus"], 2.0 * numpy.sqrt(context.hedgeFilter.innovationVar[i])))
+        api["record"](**values)
+
+    def order(*args, **kwargs):
+        orders.append(args)
+        return backtest.order(*args, **kwargs)
+
+    context = Context()
+    (context.screenedPairs, context.kalmanHedge) = ([(8554, 8347), (23112, 4283)], True)
+    # The innovations of these synthetic pairs stay within half an sd, so enter closer in than the default 2 sds
+    context.paramOverrides = {"thresholdEnter": 0.25, "thresholdExit": 0.0}
+    algorithm = loadAlgorithm(ALGORITHMS["pairs"], dict(api, record=record, order=order))
+    backtest.run(algorithm, start=prices.dates[100], context=context)
+
+    assert context.hedgeSeeded and not context.spreadSeeded
+    assert len(spreads) > 0
+    assert all(recorded == expected for (recorded, expected) in spreads)
+    assert len(orders) > 0
@@ -0,0 +1,29 @@
+import json
+import numpy
+
+from backtest.Harness import Backtest, loadAlgorithm
+from backtest.Profiler import Profiler
+from benchmarks.Suite import ALGORITHMS, dailyBars
+
+
+def test_profiled_run_times_sections_without_changing_results(tmp_path):
+    prices = dailyBars(3, 80)
+    results = []
+    for profiler in (None, Profiler()):
+        backtest = Backtest(prices, profiler=profiler)
+        results.append(backtest.run(loadAlgorithm(ALGORITHMS["kalman1"], backtest.api()), start=prices.dates[40]))
+    assert numpy.array_equal(results[0], results[1])
+
+    summary = profiler.summary()
+    assert summary["handle_data"]["calls"] == 40
+    assert summary["handle_data"]["bars"] == 40
+    assert summary["StreamingKalmanFilter.update"]["calls"] == 40
+    assert summary["history"]["calls"] == 1
+    assert summary["handle_data"]["total_s"] >= summary["StreamingKalmanFilter.update"]["total_s"]
+
+    profiler.write(str(tmp_path / "profile.json"))
+    with open(str(tmp_path / "profile.json")) as f:
+        assert json.load(f)["bars"] == 40
+    profiler.write(str(tmp_path / "profile.csv"))
+    with open(str(tmp_path / "profile.csv")) as f:
+        assert f.readline().startswith("section,stock,calls")
@@ -0,0 +1,158 @@
+from datetime import timedelta
+import numpy
+
+from backtest.Harness import Context
+from conftest import algorithm
+
+
+forest = algorithm("forest")
+
+
+def randomWalk(length, seed=0):
+    return 50 * numpy.exp(numpy.cumsum(numpy.random.RandomState(seed).normal(0, 0.01, length)))
+
+
+def forestContext(historicalDays=10, predictionDays=5, percentChange=0.02):
+    context = Context()
+    context.params = {"stock": {"historicalDays": historicalDays, "predictionDays": predictionDays, "percentChange": percentChange}}
+    return context
+
+
+def loopModelData(context, stock, historical_data):
+    """ The training set as the original loop over the training examples built it """
+    params = context.params[stock]
+    priceChanges = [(historical_data[i + 1] - historical_data[i]) / historical_data[i] for i in range(len(historical_data) - 1)]
+    (inputs, outputs) = ([], [])
+    for i in range(len(historical_data) - params["historicalDays"] - params["predictionDays"]):
+        inputs.append(priceChanges[i:i + params["historicalDays"] - 1])
+        (now, later) = (historical_data[i + params["historicalDays"]], historical_data[i + params["historicalDays"] + params["predictionDays"]])
+        outputs.append(1 if later > (1 + params["percentChange"]) * now else -1 if later < (1 - params["percentChange"]) * now else 0)
+    return (numpy.array(inputs, dtype=numpy.float32), numpy.array(outputs, dtype=numpy.float32))
+
+
+def test_generate_model_data_matches_the_loop():
+    prices = randomWalk(300)
+    for historicalDays in (2, 10, 30):
+        context = forestContext(historicalDays)
+        (inputs, outputs) = forest["generateModelData"](context, "stock", prices)
+        (expectedInputs, expectedOutputs) = loopModelData(context, "stock", prices)
+        assert inputs.shape == (300 - historicalDays - 5, historicalDays - 1)
+        assert numpy.array_equal(inputs, expectedInputs)
+        assert numpy.array_equal(outputs, expectedOutputs)
+        assert set(outputs) == set([-1, 0, 1])
+
+
+def test_generate_model_data_from_a_window_of_known_changes():
+    prices = randomWalk(300, seed=1)
+    changes = numpy.concatenate([[0.5], forest["generatePercentChanges"](prices)])[1:]
+    context = forestContext()
+    (inputs, outputs) = forest["generateModelData"](context, "stock", prices, changes)
+    assert numpy.array_equal(inputs, loopModelData(context, "stock", prices)[0])
+
+
+def trainingSet(seed=0, rows=200):
+    rng = numpy.random.RandomState(seed)
+    X = rng.normal(0, 1, (rows, 4)).astype(numpy.float32)
+    return (X, numpy.sign(X[:, 0]).astype(numpy.float32))
+
+
+def test_scheduler_fits_in_the_background():
+    scheduler = forest["ModelScheduler"](workers=2)
+    try:
+        (X, y) = trainingSet()
+        scheduler.submit("stock", lambda: (X, y), n_estimators=10)
+        assert scheduler.busy("stock")
+        model = scheduler.ready("stock", wait=True)
+        assert not scheduler.busy("stock")
+        assert len(model.estimators_) == 10
+        assert (model.predict(X) == y).mean() > 0.9
+        assert scheduler.ready("stock") is None
+    finally:
+        scheduler.close()
+
+
+def test_scheduler_reuses_cached_models(tmp_path):
+    from backtest.ModelCache import ModelCache
+
+    cache = ModelCache(str(tmp_path))
+    scheduler = forest["ModelScheduler"](workers=1, processes=False, cache=cache)
+    try:
+        (X, y) = trainingSet()
+        key = scheduler.key("stock", X)
+        scheduler.submit("stock", lambda: (X, y), key, n_estimators=5)
+        fitted = scheduler.ready("stock", wait=True)
+        assert key in cache
+
+        def refit():
+            raise AssertionError("a cached model should not be fitted again")
+        scheduler.submit("stock", refit, key)
+        assert numpy.array_equal(scheduler.ready("stock").predict(X), fitted.predict(X))
+    finally:
+        scheduler.close()
+
+
+def test_predict_forest_matches_predict():
+    from sklearn.ensemble import RandomForestClassifier
+
+    (X, y) = trainingSet(rows=300)
+    y[::7] = 0
+    model = RandomForestClassifier(n_estimators=20, random_state=0).fit(X, y)
+    inputs = numpy.ascontiguousarray(trainingSet(seed=1, rows=50)[0])
+    assert numpy.array_equal(forest["predictForest"](model, inputs), model.predict(inputs))
+
+
+def test_positions_follow_the_open_transactions():
+    from backtest.Harness import Backtest, Context, loadAlgorithm
+    from benchmarks.Suite import ALGORITHMS, HISTORY_DAYS, dailyBars
+
+    prices = dailyBars(5, HISTORY_DAYS + 60)
+    backtest = Backtest(prices)
+    context = Context()
+    context.paramOverrides = {"percentChange": 0.005}
+    backtest.run(loadAlgorithm(ALGORITHMS["forest"], backtest.api()), start=prices.dates[HISTORY_DAYS], context=context)
+
+    assert backtest.transactions
+    for (stock, state) in zip(context.stocks, context.state):
+        # Every transaction still open is younger than predictionDays, and together they make up the position
+        assert all(backtest.currentDatetime() - when < timedelta(days=context.params[stock]["predictionDays"]) for (when, size) in state.transactions)
+        pending = sum(currOrder.amount for currOrder in backtest.get_open_orders(stock))
+        assert context.portfolio.positions[stock].amount + pending == sum(size for (when, size) in state.transactions)
+
+
+def test_training_window_rolls_forward_like_a_rebuild():
+    prices = randomWalk(400, seed=2)
+    context = forestContext(historicalDays=10, predictionDays=5)
+    (length, newBars) = (300, 20)
+    window = forest["TrainingWindow"](*forest["generateModelData"](context, "stock", prices[:length]), bar=1)
+
+    # What scheduleModels adds: the rows whose inputs and outcome take in the new bars
+    size = newBars + 10 + 5
+    window.advance(*forest["generateModelData"](context, "stock", prices[length + newBars - size:length + newBars]), bar=1 + newBars)
+
+    (X, y) = forest["generateModelData"](context, "stock", prices[newBars:length + newBars])
+    assert numpy.array_equal(window.X, X)
+    assert numpy.array_equal(window.y, y)
+
+
+def test_grow_forest_replaces_the_oldest_trees():
+    from sklearn.ensemble import RandomForestClassifier
+
+    (X, y) = trainingSet()
+    previous = RandomForestClassifier(n_estimators=10, random_state=0).fit(X, y)
+    grown = forest["growForest"](previous, 10, 3).fit(*trainingSet(seed=1))
+    assert len(previous.estimators_) == 10
+    assert len(grown.estimators_) == 10
+    assert grown.estimators_[:7] == previous.estimators_[3:]
+    assert all(tree not in previous.estimators_ for tree in grown.estimators_[7:])
+
+
+def test_return_store_matches_the_percent_changes_of_the_full_history():
+    prices = numpy.stack([randomWalk(120, seed) for seed in range(3)], axis=1)
+    returns = forest["ReturnStore"](3, capacity=50)
+    returns.seed(prices[:60])
+    for t in range(60, 120):
+        returns.update(prices[t])
+        expected = forest["generatePercentChanges"](prices[:t + 1])
+        assert numpy.allclose(returns.window(50), expected[-50:], rtol=1e-12)
+        assert numpy.allclose(returns.window(9, 1), expected[-9:, 1], rtol=1e-12)
+    assert numpy.shares_memory(returns.window(50), returns.buffer)
@@ -0,0 +1,19 @@
+from benchmarks.Suite import CASES, compare, configurations, label, measure
+
+
+def test_compare_flags_slowdowns_and_memory_growth():
+    baseline = {"a": {"rate": 100.0, "peak_kb": 10.0}, "b": {"rate": 100.0, "peak_kb": 10.0}, "c": {"rate": 100.0, "peak_kb": 10.0}}
+    results = {"a": {"rate": 90.0, "peak_kb": 11.0}, "b": {"rate": 50.0, "peak_kb": 10.0}, "c": {"rate": 100.0, "peak_kb": 20.0},
+               "new": {"rate": 1.0, "peak_kb": 1.0}}
+    (lines, regressions) = compare(results, baseline, 0.4)
+    assert sorted(regressions) == ["b", "c"]
+    assert len(lines) == 3
+
+
+def test_quick_cases_run():
+    for (name, function, grid, quickGrid) in CASES:
+        if name == "handle_data":
+            continue
+        for params in configurations(quickGrid):
+            result = measure(function, params, repeat=1, minTime=0.0)
+            assert result["rate"] > 0, label(name, params)
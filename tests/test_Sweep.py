@@ -0,0 +1,41 @@
+import sys
+import subprocess
+
+from backtest.Sweep import sweepConfigs
+from benchmarks.Suite import ALGORITHMS, dailyBars
+from conftest import ROOT, writePriceFiles
+
+
+def test_grid_points_get_their_own_random_draws():
+    configs = sweepConfigs({"thresholdEnter": [1.5, 2.0]}, {"thresholdExit": (0.0, 1.0), "window_length": (10, 20)}, 3, seed=1)
+    assert [config["thresholdEnter"] for config in configs] == [1.5] * 3 + [2.0] * 3
+    assert len(set(config["thresholdExit"] for config in configs)) == 6
+    assert all(isinstance(config["window_length"], int) for config in configs)
+    assert configs == sweepConfigs({"thresholdEnter": [1.5, 2.0]}, {"thresholdExit": (0.0, 1.0), "window_length": (10, 20)}, 3, seed=1)
+
+
+def runSweep(algorithm, dataPath, output, *arguments):
+    result = subprocess.run([sys.executable, "-m", "backtest.Sweep", ALGORITHMS[algorithm], "--data", dataPath,
+                             "--start", "2009-12-01", "--processes", "2", "--output", str(output)] + list(arguments),
+                            cwd=ROOT, capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr
+    with open(str(output)) as f:
+        return f.read().splitlines()[1:]
+
+
+def test_sweep_runs_the_forest_in_worker_processes(tmp_path):
+    # Each worker hosts the forest's ModelScheduler, which used to hang on a nested process pool
+    dataPath = writePriceFiles(dailyBars(6, 1320), tmp_path)
+    rows = runSweep("forest", dataPath, tmp_path / "sweep.csv", "--param", "retrainDays=[30]", "--param", "retrainTrees=[0, 20]")
+    assert len(rows) == 2
+
+
+def test_sweep_trades_the_given_pairs(tmp_path):
+    dataPath = writePriceFiles(dailyBars(6, 1320), tmp_path)
+    with open(str(tmp_path / "pairs.csv"), "w") as f:
+        f.write("x,y\n8554,8347\n23112,4283\n")
+    rows = runSweep("pairs", dataPath, tmp_path / "sweep.csv", "--pairs", str(tmp_path / "pairs.csv"), "--param", "thresholdEnter=[1.5, 2.0]")
+
+    # The last column is the number of closed trades
+    assert len(rows) == 2
+    assert all(float(row.rsplit(",", 1)[1]) > 0 for row in rows)